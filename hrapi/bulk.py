@@ -0,0 +1,185 @@
+"""
+Bulk changes of employees, validated as a whole and written in one
+transaction.
+
+    [{"op": "create", "data": {"first_name": "Jane", ...}},
+     {"op": "update", "id": 12, "data": {"salary": "81000.00"}},
+     {"op": "update", "email": "john@example.com", "data": {"industry": 3}},
+     {"op": "delete", "id": 13}]
+
+Fields are validated item by item without touching the database, what
+needs it (the employees to update or delete, the industries, the email
+uniqueness) is looked up with a few queries for the whole batch. Nothing
+is written unless every item is valid, then deletes, updates and creates
+go through delete, bulk_update and bulk_create.
+
+is_valid() and save() are called in the same transaction: the employees to
+update or delete are locked when they are looked up, a concurrent write to
+them waits for the batch instead of being overwritten with what it read.
+"""
+from django.db import transaction
+from rest_framework import serializers
+
+from hrapi.models import Employee, Industry
+from hrapi.serializers import EmployeeSerializer
+
+OPERATIONS = ['create', 'update', 'delete']
+LOOKUP_BATCH_SIZE = 1000
+# how the employees to update or delete are designated
+TARGET_FIELDS = {'id': serializers.IntegerField(), 'email': serializers.EmailField()}
+
+
+class BulkEmployeeSerializer(EmployeeSerializer):
+    # no per item query, industries and email uniqueness are checked by BulkChange
+    industry = serializers.IntegerField(allow_null=True, required=False)
+
+    class Meta(EmployeeSerializer.Meta):
+        extra_kwargs = {'email': {'validators': []}}
+
+
+def in_batches(values):
+    values = list(values)
+    for start in range(0, len(values), LOOKUP_BATCH_SIZE):
+        yield values[start:start + LOOKUP_BATCH_SIZE]
+
+
+class BulkChange:
+
+    def __init__(self, items):
+        self.items = items
+        self.results = []
+        self.data = {}        # item index -> validated data
+        self.keys = {}        # item index -> ('id' or 'email', value) of the employee to update or delete
+        self.targets = {}     # item index -> Employee to update or delete
+
+    def is_valid(self):
+        if not isinstance(self.items, list):
+            raise serializers.ValidationError({'non_field_errors': ['Expected a list of changes']})
+
+        self.results = [{'index': index, 'op': None, 'status': 'valid'} for index in range(len(self.items))]
+        self.errors = {}
+        creating = BulkEmployeeSerializer()
+        updating = BulkEmployeeSerializer(partial=True)
+        for index, item in enumerate(self.items):
+            if not isinstance(item, dict) or item.get('op') not in OPERATIONS:
+                self.errors[index] = {'op': [f'Expected one of {OPERATIONS}']}
+                continue
+            self.results[index]['op'] = item['op']
+            if item['op'] != 'create':
+                if len({'id', 'email'} & item.keys()) != 1:
+                    self.errors[index] = {'non_field_errors': ['Expected either an id or an email']}
+                    continue
+                field = 'id' if 'id' in item else 'email'
+                try:
+                    self.keys[index] = (field, TARGET_FIELDS[field].run_validation(item[field]))
+                except serializers.ValidationError as exc:
+                    self.errors[index] = {field: exc.detail}
+                    continue
+            if item['op'] != 'delete':
+                try:
+                    serializer = creating if item['op'] == 'create' else updating
+                    self.data[index] = serializer.run_validation(item.get('data'))
+                except serializers.ValidationError as exc:
+                    self.errors[index] = exc.detail
+
+        self.check_targets()
+        self.check_industries()
+        self.check_emails()
+
+        for index, errors in self.errors.items():
+            self.results[index].update(status='error', errors=errors)
+        return not self.errors
+
+    def check_targets(self):
+        keyed = {index: key for index, key in self.keys.items() if index not in self.errors}
+        found = {}
+        for field in ('id', 'email'):
+            for values in in_batches({value for key, value in keyed.values() if key == field}):
+                for employee in Employee.objects.select_for_update().filter(**{f'{field}__in': values}).order_by('pk'):
+                    found[(field, getattr(employee, field))] = employee
+
+        targeted = set()
+        for index, key in keyed.items():
+            employee = found.get(key)
+            if employee is None:
+                self.errors[index] = {key[0]: ['Employee not found']}
+            elif employee.pk in targeted:
+                self.errors[index] = {key[0]: ['Employee changed twice in the batch']}
+            else:
+                targeted.add(employee.pk)
+                self.targets[index] = employee
+
+    def check_industries(self):
+        referenced = {data['industry'] for data in self.data.values() if data.get('industry') is not None}
+        existing = set()
+        for pks in in_batches(referenced):
+            existing.update(Industry.objects.filter(pk__in=pks).values_list('pk', flat=True))
+        for index, data in self.data.items():
+            if data.get('industry') not in existing | {None}:
+                self.errors[index] = {'industry': [f'Invalid pk "{data["industry"]}" - object does not exist.']}
+
+    def check_emails(self):
+        # the emails after the change must stay unique: the ones written by the
+        # batch against each other, and against the employees keeping theirs
+        written = {}
+        for index, data in self.data.items():
+            target = self.targets.get(index)
+            if 'email' in data and (target is None or data['email'] != target.email):
+                written.setdefault(data['email'], []).append(index)
+
+        released = {
+            target.pk for index, target in self.targets.items()
+            if self.items[index]['op'] == 'delete'
+            or self.data.get(index, {}).get('email', target.email) != target.email
+        }
+        taken = set()
+        for emails in in_batches(written):
+            taken.update(
+                Employee.objects.filter(email__in=emails).exclude(pk__in=released).values_list('email', flat=True))
+
+        # the updates are written one row after the other in the order of the
+        # batch, an email released by a later one is still taken
+        holders = {
+            target.email: index for index, target in self.targets.items() if self.items[index]['op'] == 'update'
+        }
+
+        for email, indexes in written.items():
+            for index in indexes:
+                if email in taken:
+                    self.errors[index] = {'email': ['employee with this email already exists.']}
+                elif len(indexes) > 1:
+                    self.errors[index] = {'email': ['Email used twice in the batch']}
+                elif holders.get(email, -1) > index:
+                    self.errors[index] = {'email': [
+                        f'Email still held by the employee of item {holders[email]}, update that one first']}
+
+    @transaction.atomic
+    def save(self):
+        deleted = [target.pk for index, target in self.targets.items() if self.items[index]['op'] == 'delete']
+        for pks in in_batches(deleted):
+            Employee.objects.filter(pk__in=pks).delete()
+
+        updated, fields = [], set()
+        for index, target in self.targets.items():
+            if self.items[index]['op'] == 'update':
+                for field, value in self.data[index].items():
+                    setattr(target, 'industry_id' if field == 'industry' else field, value)
+                    fields.add(field)
+                updated.append(target)
+        if fields:
+            Employee.objects.bulk_update(updated, sorted(fields))
+
+        creating = [index for index, item in enumerate(self.items) if item['op'] == 'create']
+        created = Employee.objects.bulk_create(
+            [self.employee(self.data[index]) for index in creating], batch_size=500)
+
+        for index, target in self.targets.items():
+            self.results[index].update(status=f"{self.items[index]['op']}d", id=target.pk)
+        for index, employee in zip(creating, created):
+            self.results[index].update(status='created', id=employee.pk)
+
+    def employee(self, data):
+        data = dict(data)
+        if 'industry' in data:
+            data['industry_id'] = data.pop('industry')
+        return Employee(**data)
@@ -0,0 +1,108 @@
+"""
+Versioned response cache for the statistics endpoints.
+
+Every table has a generation token in the cache, replaced on each write.
+Cached responses are keyed by the tokens of the tables they read, so a
+write makes them unreachable at once and they are evicted by the cache
+backend (TIMEOUT, MAX_ENTRIES) later on.
+"""
+import hashlib
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+
+
+def generation_key(table):
+    return f'hrapi:generation:{table}'
+
+
+def generation(table):
+    token = cache.get(generation_key(table))
+    if token is None:
+        cache.add(generation_key(table), uuid.uuid4().hex, None)
+        token = cache.get(generation_key(table))
+    return token
+
+
+LAST_WRITE_KEY = 'hrapi:last_write'
+
+
+def last_write():
+    # time.time() of the last write, which keeps the cache fills off the replicas for a while, see hrapi.replicas
+    return cache.get(LAST_WRITE_KEY)
+
+
+def bump_generation(*tables):
+    def bump():
+        tokens = {generation_key(table): uuid.uuid4().hex for table in tables}
+        cache.set_many({**tokens, LAST_WRITE_KEY: time.time()}, None)
+    # right away for the writing request, and again once committed so that
+    # nothing computed from the data before the commit stays reachable
+    bump()
+    transaction.on_commit(bump)
+
+
+def seconds_until_tomorrow(now):
+    tomorrow = datetime.combine(now.date() + timedelta(days=1), datetime.min.time())
+    return max(1, int((tomorrow - now).total_seconds()))
+
+
+class CachedResponseMixin:
+    # GET responses of get_uncached() are cached until one of cache_tables is
+    # written to, and until midnight when they depend on the age of the
+    # employees. They are looked up once the request is authenticated and
+    # its permissions and throttles checked, under the key of its user.
+    cache_tables = ('employee', 'industry')
+    age_dependent = False
+
+    def cache_key(self, request, now):
+        parts = [
+            type(self).__name__,
+            request.get_full_path(),
+            request.META.get('HTTP_ACCEPT', ''),
+            str(getattr(request.user, 'pk', None)),
+            *(generation(table) for table in self.cache_tables),
+        ]
+        if self.age_dependent:
+            parts.append(now.date().isoformat())
+        return 'hrapi:response:' + hashlib.sha256('|'.join(parts).encode()).hexdigest()
+
+    def get(self, request, *args, **kwargs):
+        now = datetime.now()
+        key = self.cache_key(request, now)
+        entry = cache.get(key)
+        if entry is not None:
+            response = HttpResponse(entry['content'], content_type=entry['content_type'], headers=entry['headers'])
+        else:
+            from hrapi.replicas import pin_after_write
+            pin_after_write()
+            response = self.get_uncached(request, *args, **kwargs)
+            if response.status_code != 200:
+                return response
+            # rendered now, with the headers dispatch() adds
+            response = self.finalize_response(request, response, *args, **kwargs)
+            response.render()
+            entry = {
+                'content': response.content,
+                'content_type': response['Content-Type'],
+                'headers': {header: response[header] for header in ('Allow', 'Vary') if response.has_header(header)},
+                # strong validator, the hash of the exact bytes sent
+                'etag': '"%s"' % hashlib.sha256(response.content).hexdigest(),
+            }
+            timeout = settings.STATS_CACHE_TIMEOUT
+            if self.age_dependent:
+                timeout = min(timeout, seconds_until_tomorrow(now))
+            cache.set(key, entry, timeout)
+
+        response['ETag'] = entry['etag']
+        patch_cache_control(response, no_cache=True)
+        return get_conditional_response(request, etag=entry['etag'], response=response)
+
+    def get_uncached(self, request, *args, **kwargs):
+        raise NotImplementedError
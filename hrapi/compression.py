@@ -0,0 +1,16 @@
+"""
+Responses of GZIP_MIN_LENGTH bytes and more are gzipped for the clients
+sending Accept-Encoding: gzip, e.g. pages of employees and exports (streamed
+ones are compressed chunk by chunk). Below, the bytes saved aren't worth
+the time: a response fitting in a packet goes out in one packet anyway.
+"""
+from django.conf import settings
+from django.middleware.gzip import GZipMiddleware
+
+
+class LargeResponseGZipMiddleware(GZipMiddleware):
+
+    def process_response(self, request, response):
+        if not response.streaming and len(response.content) < settings.GZIP_MIN_LENGTH:
+            return response
+        return super().process_response(request, response)
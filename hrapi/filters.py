@@ -0,0 +1,84 @@
+"""
+Server side filters of the employee list (and export).
+
+    /api/employees/?industry=3&gender=F&salary_min=50000&salary_max=80000
+        &yoe_min=5&yoe_max=10&age_min=30&age_max=40
+        &born_after=1980-01-01&born_before=1990-12-31
+        &search=smith        first name, last name or email containing smith
+        &prefix=smi          first name, last name or email starting with smi
+
+Every filter is a range or an equality on an indexed column (see the
+Employee indexes), ages are turned into a birth date range so that the
+date_of_birth index is used. search and prefix are served by trigram
+indexes on PostgreSQL (migration 0013).
+"""
+from datetime import date
+
+from django.db.models import Q
+from rest_framework import serializers
+from rest_framework.exceptions import ValidationError
+from rest_framework.filters import BaseFilterBackend
+
+from hrapi.models import Employee
+
+
+def years_before(day, years):
+    # the same day, years earlier. February 29 becomes March 1
+    try:
+        return day.replace(year=day.year - years)
+    except ValueError:
+        return date(day.year - years, 3, 1)
+
+
+class EmployeeFilterSerializer(serializers.Serializer):
+    industry = serializers.IntegerField(required=False)
+    gender = serializers.ChoiceField(choices=Employee.GENDER_CHOICES, required=False)
+    salary_min = serializers.DecimalField(max_digits=10, decimal_places=2, required=False)
+    salary_max = serializers.DecimalField(max_digits=10, decimal_places=2, required=False)
+    yoe_min = serializers.IntegerField(required=False)
+    yoe_max = serializers.IntegerField(required=False)
+    age_min = serializers.IntegerField(min_value=0, required=False)
+    age_max = serializers.IntegerField(min_value=0, required=False)
+    born_after = serializers.DateField(required=False)
+    born_before = serializers.DateField(required=False)
+    search = serializers.CharField(required=False)
+    prefix = serializers.CharField(required=False)
+
+
+class EmployeeFilterBackend(BaseFilterBackend):
+    search_fields = ['first_name', 'last_name', 'email']
+
+    def filter_queryset(self, request, queryset, view):
+        params = EmployeeFilterSerializer(data=request.query_params)
+        if not params.is_valid():
+            raise ValidationError(params.errors)
+        return self.filter(queryset, params.validated_data)
+
+    def filter(self, queryset, params, today=None):
+        today = today or date.today()
+        lookups = {
+            'industry': 'industry_id',
+            'gender': 'gender',
+            'salary_min': 'salary__gte',
+            'salary_max': 'salary__lte',
+            'yoe_min': 'years_of_experience__gte',
+            'yoe_max': 'years_of_experience__lte',
+            'born_after': 'date_of_birth__gte',
+            'born_before': 'date_of_birth__lte',
+        }
+        queryset = queryset.filter(**{lookups[name]: value for name, value in params.items() if name in lookups})
+
+        # someone is at least n years old when born n years ago or before,
+        # and at most n years old when born after n + 1 years ago
+        if 'age_min' in params:
+            queryset = queryset.filter(date_of_birth__lte=years_before(today, params['age_min']))
+        if 'age_max' in params:
+            queryset = queryset.filter(date_of_birth__gt=years_before(today, params['age_max'] + 1))
+
+        for name, lookup in (('search', 'icontains'), ('prefix', 'istartswith')):
+            if name in params:
+                condition = Q()
+                for field in self.search_fields:
+                    condition |= Q(**{f'{field}__{lookup}': params[name]})
+                queryset = queryset.filter(condition)
+        return queryset
@@ -0,0 +1,69 @@
+"""
+Trends of the statistics over the daily snapshots of the snapshot_stats
+command, e.g. /api/stats/history?metric=industry_salary&from=2026-01-01
+
+    {"metric": "industry_salary", "from": "2026-01-01", "to": "2026-10-18",
+     "dates": ["2026-10-16", "2026-10-17", ...],
+     "series": {"Banks": [71234.5, 71301.2, ...], ...}}
+
+A series per industry, experience bracket, ... of the metric, with a value
+per date of dates, null where the group had no employee that day. They are
+read from the StatsSnapshot rows of the range, never from the employees.
+"""
+from datetime import date, timedelta
+
+from rest_framework.exceptions import ValidationError
+
+from hrapi.models import StatsSnapshot
+
+DEFAULT_DAYS = 365
+
+
+def industry_field(field):
+    return lambda stored: {row['industry']: row[field] for row in stored}
+
+
+# metric -> (statistic stored, {group: value} of a stored statistic)
+METRICS = {
+    'industry_salary': ('industry', industry_field('salary')),
+    'industry_years_of_experience': ('industry', industry_field('years_of_experience')),
+    'industry_age': ('industry', industry_field('age')),
+    'yoe_salary': ('yoe', lambda stored: {row['experience_bracket']: row['salary'] for row in stored}),
+    'age_salary': ('age', lambda stored: {
+        f'{years}, {age}': salary for years, ages in stored.items() for age, salary in ages.items()
+    }),
+    'gender_salary': ('gender', lambda stored: {
+        f"{gender}, {row['years_of_experience']}": row['salary'] for gender, rows in stored.items() for row in rows
+    }),
+}
+
+
+def parse_date(params, name, default):
+    value = params.get(name)
+    if not value:
+        return default
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        raise ValidationError({name: f"Expected a date as YYYY-MM-DD, got {value!r}"})
+
+
+def trend(params):
+    metric = params.get('metric')
+    if metric not in METRICS:
+        raise ValidationError({'metric': f"Expected one of {', '.join(METRICS)}"})
+    end = parse_date(params, 'to', date.today())
+    start = parse_date(params, 'from', end - timedelta(days=DEFAULT_DAYS))
+    if start > end:
+        raise ValidationError({'from': "Must not be after to"})
+
+    statistic, groups = METRICS[metric]
+    dates, series = [], {}
+    snapshots = StatsSnapshot.objects.filter(date__range=(start, end)).order_by('date')
+    for index, (day, stored) in enumerate(snapshots.values_list('date', statistic)):
+        dates.append(day.isoformat())
+        for group, value in groups(stored).items():
+            series.setdefault(group, [None] * index).append(value)
+        for values in series.values():
+            values.extend([None] * (len(dates) - len(values)))
+    return {'metric': metric, 'from': start.isoformat(), 'to': end.isoformat(), 'dates': dates, 'series': series}
@@ -0,0 +1,319 @@
+"""
+Where the time of a request goes.
+
+InstrumentationMiddleware records, for every request:
+
+- the SQL queries, their total duration and the rows fetched, on every
+  connection the request uses (those of hrapi.offload threads included)
+- the phases timed with timer(): DataFrame construction and aggregation
+  in the pandas statistics, the statistics as a whole, serialization
+- the size of the response
+
+It sends them back in a Server-Timing header (shown by the network panel
+of the browsers), adds them to the histograms served by /metrics in the
+Prometheus text format (with the counters of the detail cache,
+hrapi.objectcache), and logs the requests slower than
+SLOW_REQUEST_THRESHOLD with their queries slower than
+SLOW_QUERY_THRESHOLD to the hrapi.slow logger.
+
+The histograms are kept by each process, scrape every worker.
+"""
+import contextvars
+import logging
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+logger = logging.getLogger('hrapi.slow')
+
+# the Recorder of the request being handled, copied into the threads running it
+current = contextvars.ContextVar('hrapi_instrumentation', default=None)
+
+SLOW_QUERIES_KEPT = 20
+PHASES = ['dataframe', 'aggregate', 'stats', 'serialize']
+
+
+class Recorder:
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.lock = threading.Lock()
+        self.queries = self.rows = 0
+        self.db_time = 0.0
+        self.slow_queries = []
+        self.phases = {}
+
+    def add(self, queries=0, rows=0, seconds=0.0):
+        with self.lock:
+            self.queries += queries
+            self.rows += rows
+            self.db_time += seconds
+
+    def query(self, sql, duration):
+        with self.lock:
+            self.queries += 1
+            self.db_time += duration
+            if duration >= settings.SLOW_QUERY_THRESHOLD and len(self.slow_queries) < SLOW_QUERIES_KEPT:
+                self.slow_queries.append((duration, sql))
+
+    def phase(self, name, duration):
+        with self.lock:
+            self.phases[name] = self.phases.get(name, 0.0) + duration
+
+
+@contextmanager
+def timer(name):
+    # adds the time spent in the block to a phase of the current request
+    recorder = current.get()
+    if recorder is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        recorder.phase(name, time.perf_counter() - start)
+
+
+class CountingCursor:
+    # database cursor counting the rows fetched through it and the time
+    # spent fetching them, which is database time too
+
+    def __init__(self, cursor, counter):
+        self.cursor = cursor
+        self.counter = counter
+
+    def __getattr__(self, name):
+        return getattr(self.cursor, name)
+
+    def __iter__(self):
+        for row in self.cursor:
+            self.counter.add(rows=1)
+            yield row
+
+    def fetchone(self):
+        start = time.perf_counter()
+        row = self.cursor.fetchone()
+        self.counter.add(rows=row is not None, seconds=time.perf_counter() - start)
+        return row
+
+    def fetchmany(self, *args, **kwargs):
+        start = time.perf_counter()
+        rows = self.cursor.fetchmany(*args, **kwargs)
+        self.counter.add(rows=len(rows), seconds=time.perf_counter() - start)
+        return rows
+
+    def fetchall(self):
+        start = time.perf_counter()
+        rows = self.cursor.fetchall()
+        self.counter.add(rows=len(rows), seconds=time.perf_counter() - start)
+        return rows
+
+
+def count_rows(cursor, counter):
+    # wraps the database cursor of a CursorWrapper, once per counter
+    inner = cursor.cursor
+    while isinstance(inner, CountingCursor):
+        if inner.counter is counter:
+            return
+        inner = inner.cursor
+    cursor.cursor = CountingCursor(cursor.cursor, counter)
+
+
+def record_query(execute, sql, params, many, context):
+    recorder = current.get()
+    if recorder is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        recorder.query(sql, time.perf_counter() - start)
+        count_rows(context['cursor'], recorder)
+
+
+@receiver(connection_created)
+def install(sender=None, connection=None, **kwargs):
+    # on every connection of every thread, it does nothing outside requests
+    for wrapper in [connection] if connection is not None else connections.all():
+        if record_query not in wrapper.execute_wrappers:
+            wrapper.execute_wrappers.append(record_query)
+
+
+# ---------------------------------------------------------------------------
+# Histograms
+# ---------------------------------------------------------------------------
+
+class Histogram:
+
+    def __init__(self, name, documentation, buckets, labels):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = buckets
+        self.labels = labels
+        self.lock = threading.Lock()
+        self.series = {}   # label values -> [count per bucket (+Inf last), sum]
+
+    def observe(self, value, *labels):
+        with self.lock:
+            series = self.series.setdefault(labels, [[0] * (len(self.buckets) + 1), 0.0])
+            series[0][bisect_left(self.buckets, value)] += 1
+            series[1] += value
+
+    def clear(self):
+        with self.lock:
+            self.series = {}
+
+    def exposition(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        with self.lock:
+            series = sorted(self.series.items())
+        for labels, (counts, total) in series:
+            pairs = [f'{name}="{escape(value)}"' for name, value in zip(self.labels, labels)]
+            cumulated = 0
+            for bound, count in zip(self.buckets + [float('inf')], counts):
+                cumulated += count
+                le = '+Inf' if bound == float('inf') else repr(float(bound))
+                bucket = ','.join(pairs + ['le="%s"' % le])
+                lines.append(f'{self.name}_bucket{{{bucket}}} {cumulated}')
+            labelled = ','.join(pairs)
+            lines.append(f'{self.name}_sum{{{labelled}}} {total!r}')
+            lines.append(f'{self.name}_count{{{labelled}}} {cumulated}')
+        return '\n'.join(lines)
+
+
+class Counter:
+
+    def __init__(self, name, documentation, labels):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.lock = threading.Lock()
+        self.series = {}   # label values -> count
+
+    def inc(self, *labels, amount=1):
+        with self.lock:
+            self.series[labels] = self.series.get(labels, 0) + amount
+
+    def value(self, *labels):
+        return self.series.get(labels, 0)
+
+    def clear(self):
+        with self.lock:
+            self.series = {}
+
+    def exposition(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} counter']
+        with self.lock:
+            series = sorted(self.series.items())
+        for labels, count in series:
+            pairs = ','.join(f'{name}="{escape(value)}"' for name, value in zip(self.labels, labels))
+            lines.append(f'{self.name}{{{pairs}}} {count}')
+        return '\n'.join(lines)
+
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+SECONDS = [0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+
+REQUEST_SECONDS = Histogram(
+    'hrapi_request_duration_seconds', 'Time to answer a request', SECONDS, ['view', 'method', 'status'])
+DB_SECONDS = Histogram('hrapi_request_db_seconds', 'Time spent in SQL queries per request', SECONDS, ['view'])
+QUERIES = Histogram(
+    'hrapi_request_queries', 'SQL queries per request', [0, 1, 2, 5, 10, 25, 50, 100, 250, 1000], ['view'])
+ROWS = Histogram(
+    'hrapi_request_rows', 'Rows fetched from the database per request',
+    [0, 1, 10, 100, 1000, 10000, 100000, 1000000], ['view'])
+PHASE_SECONDS = Histogram(
+    'hrapi_request_phase_seconds', 'Time spent per phase of a request (dataframe, aggregate, stats, serialize)',
+    SECONDS, ['view', 'phase'])
+RESPONSE_BYTES = Histogram(
+    'hrapi_response_size_bytes', 'Size of the response bodies',
+    [100, 1000, 10000, 100000, 1000000, 10000000], ['view'])
+HISTOGRAMS = [REQUEST_SECONDS, DB_SECONDS, QUERIES, ROWS, PHASE_SECONDS, RESPONSE_BYTES]
+
+DETAIL_CACHE_LOOKUPS = Counter(
+    'hrapi_detail_cache_lookups_total', 'Detail lookups answered from the detail cache (hit) or not (miss)',
+    ['table', 'result'])
+DETAIL_CACHE_EVICTIONS = Counter(
+    'hrapi_detail_cache_evictions_total', 'Detail payloads evicted from the detail cache to stay in its bounds',
+    ['table'])
+COUNTERS = [DETAIL_CACHE_LOOKUPS, DETAIL_CACHE_EVICTIONS]
+
+
+def exposition():
+    return '\n'.join(metric.exposition() for metric in HISTOGRAMS + COUNTERS) + '\n'
+
+
+# ---------------------------------------------------------------------------
+# Middleware
+# ---------------------------------------------------------------------------
+
+class InstrumentationMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        install()
+        recorder = Recorder()
+        token = current.set(recorder)
+        try:
+            response = self.get_response(request)
+        finally:
+            current.reset(token)
+        self.finish(request, response, recorder)
+        return response
+
+    async def __acall__(self, request):
+        recorder = Recorder()
+        token = current.set(recorder)
+        try:
+            response = await self.get_response(request)
+        finally:
+            current.reset(token)
+        self.finish(request, response, recorder)
+        return response
+
+    def finish(self, request, response, recorder):
+        elapsed = time.perf_counter() - recorder.start
+        size = None if response.streaming else len(response.content)
+        match = request.resolver_match
+        view = (match.view_name if match else None) or 'unmatched'
+
+        timings = [f'db;dur={recorder.db_time * 1000:.1f};desc="{recorder.queries} queries, {recorder.rows} rows"']
+        timings += [f'{name};dur={recorder.phases[name] * 1000:.1f}' for name in PHASES if name in recorder.phases]
+        timings.append(f'total;dur={elapsed * 1000:.1f}')
+        response['Server-Timing'] = ', '.join(timings)
+
+        REQUEST_SECONDS.observe(elapsed, view, request.method, str(response.status_code))
+        DB_SECONDS.observe(recorder.db_time, view)
+        QUERIES.observe(recorder.queries, view)
+        ROWS.observe(recorder.rows, view)
+        for name, duration in recorder.phases.items():
+            PHASE_SECONDS.observe(duration, view, name)
+        if size is not None:
+            RESPONSE_BYTES.observe(size, view)
+
+        if elapsed >= settings.SLOW_REQUEST_THRESHOLD:
+            queries = ''.join(f'\n  {duration * 1000:.1f} ms: {sql}' for duration, sql in recorder.slow_queries)
+            logger.warning(
+                '%s %s %s took %.0f ms, %d queries in %.0f ms, %d rows, %s bytes%s',
+                request.method, request.get_full_path(), response.status_code, elapsed * 1000,
+                recorder.queries, recorder.db_time * 1000, recorder.rows, size, queries,
+            )
@@ -0,0 +1,240 @@
+"""
+Background jobs queued in the database, run by the run_workers command:
+
+    python manage.py run_workers --concurrency 4
+
+POST /api/jobs/import/ (a file) and POST /api/jobs/stats/ (the parameters of
+/api/stats/) queue a Job and answer 202 with it, GET /api/jobs/<id>/ follows
+its status and progress and holds the result once it succeeded.
+
+A worker claims the oldest queued job with SELECT ... FOR UPDATE SKIP LOCKED
+on PostgreSQL, so that workers never wait on each other, and marks it
+running with an update conditioned on the job being still queued, which is
+all the locking SQLite gets. While it runs the job it moves heartbeat_at
+on: a running job whose heartbeat is older than JOB_STALE_SECONDS lost its
+worker and is queued again, up to JOB_MAX_ATTEMPTS runs. An import run again
+resumes where the previous run left off, see the importer. A job raising an
+error fails at once, with the error.
+
+The upload of an import is removed once the job succeeded or failed for
+good. The rows an import refused are served at GET /api/jobs/<id>/rejects/
+for JOB_REJECTS_SECONDS, the idle workers remove them afterwards.
+"""
+from contextlib import nullcontext, redirect_stdout
+from datetime import timedelta
+from io import StringIO
+from pathlib import Path
+import logging
+import os
+import socket
+import threading
+import time
+import traceback
+
+from django.conf import settings
+from django.core.management import call_command
+from django.db import DatabaseError, connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from hrapi.models import ImportCheckpoint, Job
+from hrapi.query import StatsQuery
+from hrapi.stats import AGE_BINS, YOE_BINS
+
+logger = logging.getLogger('hrapi.jobs')
+
+
+def enqueue(kind, params):
+    return Job.objects.create(kind=kind, params=params)
+
+
+def stats_query(params):
+    # validated when the job is queued, raises ValidationError
+    return StatsQuery.from_params(params, yoe_bins=YOE_BINS, age_bins=AGE_BINS)
+
+
+def requeue_stale():
+    stale = Job.objects.filter(
+        status=Job.RUNNING, heartbeat_at__lt=timezone.now() - timedelta(seconds=settings.JOB_STALE_SECONDS),
+    )
+    lost = stale.filter(attempts__gte=settings.JOB_MAX_ATTEMPTS)
+    for job in lost.filter(kind='import'):
+        remove_upload(job)
+    lost.update(status=Job.FAILED, error='Worker lost', finished_at=timezone.now())
+    stale.update(status=Job.QUEUED)
+
+
+def claim(worker):
+    # the oldest queued job, now running on worker, or None
+    requeue_stale()
+    # without row locks a transaction would only have SQLite workers
+    # deadlock upgrading their read locks, the update settles it alone
+    locking = connection.features.has_select_for_update
+    while True:
+        with transaction.atomic() if locking else nullcontext():
+            job = Job.objects.select_for_update(skip_locked=True)\
+                .filter(status=Job.QUEUED)\
+                .order_by('created_at', 'id')\
+                .first()
+            if job is None:
+                return None
+            now = timezone.now()
+            claimed = Job.objects.filter(pk=job.pk, status=Job.QUEUED).update(
+                status=Job.RUNNING, worker=worker, attempts=F('attempts') + 1, started_at=now, heartbeat_at=now,
+            )
+        if claimed:
+            job.refresh_from_db()
+            return job
+        # taken by another worker in between
+
+
+class Heartbeat:
+    # moves heartbeat_at on every JOB_STALE_SECONDS / 4 from a thread of its
+    # own, whatever the job is busy with
+
+    def __init__(self, job):
+        self.job = job
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.beat, name=f'hrapi-heartbeat-{job.pk}', daemon=True)
+
+    def beat(self):
+        try:
+            while not self.stopped.wait(settings.JOB_STALE_SECONDS / 4):
+                try:
+                    Job.objects.filter(pk=self.job.pk, status=Job.RUNNING).update(heartbeat_at=timezone.now())
+                except DatabaseError:
+                    # SQLite locked by the job itself, the next beat will do
+                    logger.warning("Missed the heartbeat of job %s", self.job.pk, exc_info=True)
+        finally:
+            connection.close()
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stopped.set()
+        self.thread.join()
+
+
+def progress(job, processed, total=None):
+    Job.objects.filter(pk=job.pk).update(processed=processed, total=total)
+
+
+def row_count(path):
+    # lines of a CSV (less its header) or NDJSON file, None for a JSON array
+    # which would have to be parsed
+    with open(path, 'rb') as file:
+        if file.read(4096).lstrip().startswith(b'['):
+            return None
+        file.seek(0)
+        lines, last = 0, b'\n'
+        for block in iter(lambda: file.read(2 ** 20), b''):
+            lines += block.count(b'\n')
+            last = block[-1:]
+    lines += last != b'\n'
+    return lines - path.lower().endswith('.csv')
+
+
+def remove_upload(job):
+    try:
+        os.unlink(job.params['path'])
+    except FileNotFoundError:
+        # never uploaded, or removed by another worker
+        pass
+
+
+def rejects_path(job):
+    # the rows refused by the importer, next to the upload
+    return f"{job.params['path']}.rejects.ndjson"
+
+
+def purge_rejects():
+    directory = Path(settings.JOB_UPLOAD_DIR)
+    if not directory.is_dir():
+        return
+    expired = time.time() - settings.JOB_REJECTS_SECONDS
+    for path in directory.glob('*.rejects.ndjson'):
+        try:
+            if path.stat().st_mtime < expired:
+                path.unlink()
+        except FileNotFoundError:
+            # removed by another worker
+            pass
+
+
+def run_import(job):
+    path = job.params['path']
+    try:
+        total = row_count(path)
+        with redirect_stdout(StringIO()):
+            call_command(
+                'importer', path, engine='bulk', batch_size=job.params.get('batch_size', 1000),
+                progress=lambda read: progress(job, read, total), stdout=StringIO(),
+            )
+    except Exception:
+        # a job raising an error isn't run again
+        remove_upload(job)
+        raise
+    checkpoint = ImportCheckpoint.objects.get(path=os.path.abspath(path))
+    # the rows refused stay next to it for a while, see purge_rejects()
+    remove_upload(job)
+    return {
+        'inserted': checkpoint.inserted,
+        'updated': checkpoint.updated,
+        'unchanged': checkpoint.unchanged,
+        'rejected': checkpoint.rejected,
+    }
+
+
+def run_stats(job):
+    results = stats_query(job.params).results()
+    progress(job, len(results), len(results))
+    return results
+
+
+HANDLERS = {
+    'import': run_import,
+    'stats': run_stats,
+}
+
+
+def run(job):
+    try:
+        with Heartbeat(job):
+            result = HANDLERS[job.kind](job)
+    except Exception as error:
+        logger.exception("Job %s failed", job.pk)
+        job.status, job.error = Job.FAILED, ''.join(traceback.format_exception_only(type(error), error)).strip()
+    else:
+        job.status, job.result = Job.SUCCEEDED, result
+    job.finished_at = timezone.now()
+    Job.objects.filter(pk=job.pk).update(
+        status=job.status, result=job.result, error=job.error, finished_at=job.finished_at,
+    )
+    return job
+
+
+def work(worker=None, burst=False, poll_interval=1.0, stopped=None):
+    # runs the queued jobs until stopped is set, or until there are none left
+    # when burst. Returns the number of jobs run.
+    worker = worker or f'{socket.gethostname()}:{os.getpid()}'
+    stopped = stopped or threading.Event()
+    done = 0
+    while not stopped.is_set():
+        try:
+            job = claim(worker)
+        except DatabaseError:
+            # the database is restarting, or SQLite busy for too long
+            logger.warning("Couldn't look for a job", exc_info=True)
+            stopped.wait(poll_interval)
+            continue
+        if job is None:
+            purge_rejects()
+            if burst:
+                break
+            stopped.wait(poll_interval)
+            continue
+        run(job)
+        done += 1
+    return done
@@ -0,0 +1,340 @@
+from contextlib import redirect_stdout
+from datetime import datetime, timedelta
+from io import StringIO
+from pathlib import Path
+import functools
+import json
+import math
+import os
+import platform
+import random
+import re
+import resource
+import subprocess
+import tempfile
+import threading
+import time
+
+import django
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.db.backends.signals import connection_created
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import Client, override_settings
+from django.urls import URLResolver, get_resolver, reverse
+
+from hrapi.instrumentation import count_rows
+from hrapi.jobs import enqueue
+from hrapi.models import Employee, Industry
+
+DATE_FORMAT = '%d/%m/%Y'
+
+# (url name, kwargs, query string or POST body) of every endpoint of hrapi.urls,
+# kwargs and bodies are filled in once the employees are loaded. The jobs
+# posted are only queued, no worker runs them
+ENDPOINTS = [
+    ('api-root', {}, {}),
+    ('employee-list', {}, {}),
+    ('employee-list', {}, {'industry': 'first', 'salary_min': 100000}),
+    ('employee-list', {}, {'search': 'an'}),
+    ('employee-list', {}, {'fields': 'first_name,last_name,salary', 'format': 'columnar'}),
+    ('employee-detail', {'pk': 'middle'}, {}),
+    ('employee-export', {}, {'format': 'ndjson'}),
+    ('employee-bulk', {}, 'updates'),
+    ('industry-list', {}, {}),
+    ('industry-detail', {'pk': 'first'}, {}),
+    ('averages_per_industry', {}, {}),
+    ('averages_per_yoe', {}, {}),
+    ('agestats', {}, {}),
+    ('genderstats', {}, {}),
+    ('stats', {}, {'group_by': 'industry', 'metrics': 'salary:mean,salary:p90,age:mean'}),
+    ('stats-history', {}, {'metric': 'industry_salary'}),
+    ('job-list', {}, {}),
+    ('job-detail', {'pk': 'job'}, {}),
+    ('job-import', {}, 'upload'),
+    ('job-stats', {}, 'report'),
+    ('async-employee-list', {}, {}),
+    ('async-averages_per_industry', {}, {}),
+    ('async-averages_per_yoe', {}, {}),
+    ('async-agestats', {}, {}),
+    ('async-genderstats', {}, {}),
+    ('async-stats', {}, {'group_by': 'industry', 'metrics': 'salary:mean,salary:p90,age:mean'}),
+]
+BULK_UPDATES = 100
+REPORT = {'group_by': 'industry,gender', 'metrics': 'salary:mean,salary:p99'}
+
+
+def synthetic_employees(source, count, seed):
+    # Employees drawn from the columns of MOCK_DATA.json: names, gender,
+    # industry, experience and birth dates (moved by up to half a year) as
+    # often as they appear there, salaries from the same industry. Emails are
+    # made unique, the fields the importer requires are always there.
+    rng = random.Random(seed)
+    records = json.loads(Path(source).read_text())
+    first_names = [record['first_name'] for record in records]
+    last_names = [record['last_name'] for record in records]
+    genders = [record['gender'] for record in records]
+    industries = [record['industry'] for record in records]
+    experiences = [record['years_of_experience'] for record in records if record['years_of_experience'] is not None]
+    births = [datetime.strptime(record['date_of_birth'], DATE_FORMAT) for record in records]
+    salaries = {}
+    for record in records:
+        if record['salary'] is not None:
+            salaries.setdefault(record['industry'], []).append(record['salary'])
+    every_salary = [salary for values in salaries.values() for salary in values]
+
+    for index in range(count):
+        first_name, last_name = rng.choice(first_names), rng.choice(last_names)
+        industry = rng.choice(industries)
+        salary = rng.choice(salaries.get(industry) or every_salary) * rng.uniform(0.95, 1.05)
+        birth = rng.choice(births) + timedelta(days=rng.randint(-182, 182))
+        yield {
+            'id': index + 1,
+            'first_name': first_name,
+            'last_name': last_name,
+            'email': re.sub(r'[^a-z0-9.]', '', f'{first_name}.{last_name}.{index}'.lower()) + '@example.com',
+            'gender': rng.choice(genders),
+            'date_of_birth': birth.strftime(DATE_FORMAT),
+            'industry': industry,
+            'salary': round(salary, 2),
+            'years_of_experience': rng.choice(experiences),
+        }
+
+
+def percentile(values, fraction):
+    # nearest rank
+    values = sorted(values)
+    return values[max(0, math.ceil(fraction * len(values)) - 1)]
+
+
+def rss():
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except OSError:
+        # peak of the whole process so far, kilobytes on Linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class PeakMemory:
+    # resident memory sampled every few milliseconds while the block runs
+
+    def __enter__(self):
+        self.peak = rss()
+        self.running = True
+        self.thread = threading.Thread(target=self.sample, daemon=True)
+        self.thread.start()
+        return self
+
+    def sample(self):
+        while self.running:
+            self.peak = max(self.peak, rss())
+            time.sleep(0.002)
+
+    def __exit__(self, *exc_info):
+        self.running = False
+        self.thread.join()
+        self.peak = max(self.peak, rss())
+
+
+class QueryCounter:
+    # queries run and rows materialized on every connection opened while
+    # installed, the ones of the threads of hrapi.offload included
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.queries = self.rows = 0
+
+    def add(self, queries=0, rows=0, seconds=0.0):
+        with self.lock:
+            self.queries += queries
+            self.rows += rows
+
+    def __call__(self, execute, sql, params, many, context):
+        result = execute(sql, params, many, context)
+        self.add(queries=1)
+        count_rows(context['cursor'], self)
+        return result
+
+    def install(self, sender=None, connection=None, **kwargs):
+        for wrapper in [connection] if connection is not None else connections.all():
+            if self not in wrapper.execute_wrappers:
+                wrapper.execute_wrappers.append(self)
+
+    def __enter__(self):
+        self.install()
+        connection_created.connect(self.install)
+        return self
+
+    def __exit__(self, *exc_info):
+        connection_created.disconnect(self.install)
+        for wrapper in connections.all():
+            if self in wrapper.execute_wrappers:
+                wrapper.execute_wrappers.remove(self)
+
+
+def url_names(resolver):
+    for pattern in resolver.url_patterns:
+        if isinstance(pattern, URLResolver):
+            yield from url_names(pattern)
+        elif pattern.name:
+            yield pattern.name
+
+
+class Command(BaseCommand):
+    help = "Load N synthetic employees (seeded from MOCK_DATA.json) in a test database with the importer, " \
+           "then time every endpoint of hrapi.urls, cold (response cache cleared) and warm. " \
+           "Writes p50/p95/p99 latencies, queries, rows materialized and peak RSS as JSON."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--employees', nargs='+', type=int, default=[1000, 10000, 100000],
+                            help='Sizes to benchmark, up to 10M')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--source', default=Path(settings.BASE_DIR) / 'MOCK_DATA.json',
+                            help='Employees the synthetic ones are drawn from')
+        parser.add_argument('--repeat', type=int, default=20, help='Requests per endpoint, cold and warm each')
+        parser.add_argument('--import-engine', choices=['bulk', 'row', 'copy'], default='bulk')
+        parser.add_argument('--output', default='benchmark.json', help='JSON report, - for stdout')
+
+    def handle(self, *args, **options):
+        missing = set(url_names(get_resolver('hrapi.urls'))) - {name for name, _, _ in ENDPOINTS}
+        if missing:
+            raise CommandError(f"No benchmark for {', '.join(sorted(missing))}, see ENDPOINTS")
+
+        report = {
+            'commit': self.commit(),
+            'started': datetime.now().isoformat(timespec='seconds'),
+            'database': connection.vendor,
+            'stats_engine': settings.STATS_ENGINE,
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'seed': options['seed'],
+            'runs': [],
+        }
+        with QueryCounter() as self.counter:
+            for count in options['employees']:
+                # a test database, the real one is never touched. An in-memory
+                # SQLite one outlives destroy_test_db while the threads of
+                # hrapi.offload keep it open, hence the flush
+                old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+                try:
+                    call_command('flush', interactive=False, verbosity=0)
+                    report['runs'].append({
+                        'employees': count,
+                        'import': self.load(count, options),
+                        'endpoints': self.endpoints(options['repeat']),
+                    })
+                finally:
+                    connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        content = json.dumps(report, indent=2)
+        if options['output'] == '-':
+            self.stdout.write(content)
+        else:
+            Path(options['output']).write_text(content + '\n')
+            self.stdout.write(f"Report written to {options['output']}")
+
+    def commit(self):
+        try:
+            return subprocess.run(
+                ['git', 'rev-parse', 'HEAD'], cwd=settings.BASE_DIR, capture_output=True, text=True, check=True,
+            ).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+
+    def load(self, count, options):
+        with tempfile.TemporaryDirectory() as directory:
+            path = Path(directory) / 'employees.json'
+            with open(path, 'w') as file:
+                file.write('[')
+                for index, employee in enumerate(synthetic_employees(options['source'], count, options['seed'])):
+                    file.write(',\n' * bool(index) + json.dumps(employee))
+                file.write(']\n')
+
+            queries, rows = self.counter.queries, self.counter.rows
+            with PeakMemory() as memory, redirect_stdout(StringIO()):
+                start = time.perf_counter()
+                call_command('importer', str(path), engine=options['import_engine'])
+                elapsed = time.perf_counter() - start
+
+        loaded = Employee.objects.count()
+        self.stdout.write(f"{count} employees: imported {loaded} in {elapsed:.2f}s")
+        return {
+            'engine': options['import_engine'],
+            'loaded': loaded,
+            'seconds': round(elapsed, 3),
+            'rows_per_second': round(loaded / elapsed),
+            'queries': self.counter.queries - queries,
+            'rows': self.counter.rows - rows,
+            'peak_rss_mb': round(memory.peak / 2 ** 20, 1),
+        }
+
+    def endpoints(self, repeat):
+        employees = Employee.objects.order_by('id').values_list('id', flat=True)
+        values = {
+            'middle': employees[employees.count() // 2],
+            'first': Industry.objects.order_by('id').values_list('id', flat=True).first(),
+        }
+        updates = [
+            {'op': 'update', 'id': pk, 'data': {'salary': str(salary)}}
+            for pk, salary in Employee.objects.order_by('id').values_list('id', 'salary')[:BULK_UPDATES]
+        ]
+        # one day of history for stats-history
+        call_command('snapshot_stats', stdout=StringIO())
+        values['job'] = enqueue('stats', REPORT).pk
+        upload = '\n'.join(json.dumps(employee) for employee in synthetic_employees(
+            Path(settings.BASE_DIR) / 'MOCK_DATA.json', BULK_UPDATES, seed=0,
+        )).encode()
+        client = Client(HTTP_HOST='localhost')
+        bodies = {
+            # the salaries written are the ones already there
+            'updates': lambda url: client.post(url, updates, content_type='application/json'),
+            'upload': lambda url: client.post(url, {'file': SimpleUploadedFile('employees.ndjson', upload)}),
+            'report': lambda url: client.post(url, REPORT, content_type='application/json'),
+        }
+
+        results = []
+        with tempfile.TemporaryDirectory() as directory, override_settings(JOB_UPLOAD_DIR=directory):
+            for name, kwargs, params in ENDPOINTS:
+                url = reverse(name, kwargs={key: values.get(value, value) for key, value in kwargs.items()})
+                posted = isinstance(params, str)
+                if posted:
+                    request = functools.partial(bodies[params], url)
+                else:
+                    params = {key: values.get(value, value) for key, value in params.items()}
+                    request = functools.partial(client.get, url, params)
+                result = {'name': name, 'url': url, 'params': None if posted else params}
+                for mode in ('cold', 'warm'):
+                    result[mode] = self.time(name, request, repeat, cold=mode == 'cold')
+                results.append(result)
+                self.stdout.write(
+                    f"  {name} {'' if posted else params}: "
+                    f"cold p50 {result['cold']['p50_ms']} ms, warm p50 {result['warm']['p50_ms']} ms"
+                )
+        return results
+
+    def time(self, name, request, repeat, cold):
+        latencies = []
+        queries, rows = self.counter.queries, self.counter.rows
+        with PeakMemory() as memory:
+            for _ in range(repeat):
+                if cold:
+                    cache.clear()
+                start = time.perf_counter()
+                response = request()
+                if response.streaming:
+                    b''.join(response.streaming_content)
+                latencies.append((time.perf_counter() - start) * 1000)
+                if not 200 <= response.status_code < 300:
+                    raise CommandError(f"{name} answered {response.status_code}")
+        return {
+            'p50_ms': round(percentile(latencies, 0.5), 2),
+            'p95_ms': round(percentile(latencies, 0.95), 2),
+            'p99_ms': round(percentile(latencies, 0.99), 2),
+            'queries': round((self.counter.queries - queries) / repeat, 1),
+            'rows': round((self.counter.rows - rows) / repeat, 1),
+            'peak_rss_mb': round(memory.peak / 2 ** 20, 1),
+        }
@@ -0,0 +1,109 @@
+from concurrent.futures import ThreadPoolExecutor
+from itertools import count
+from statistics import quantiles
+from urllib.parse import urlsplit
+from wsgiref.util import setup_testing_defaults
+import asyncio
+import time
+
+from django.core.asgi import get_asgi_application
+from django.core.management.base import BaseCommand, CommandError
+from django.core.wsgi import get_wsgi_application
+
+
+class Command(BaseCommand):
+    help = "Requests per second at 1, 16 and 64 concurrent clients: the sync views under WSGI (a thread " \
+           "per client), the same views under ASGI, and their async variants (/api/async/...) under ASGI. " \
+           "The applications are called in process, without sockets."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clients', nargs='+', type=int, default=[1, 16, 64])
+        parser.add_argument('--requests', type=int, default=256, help='Requests per level of concurrency')
+        parser.add_argument('--path', default='/api/averages_per_industry/', help='Sync endpoint to request')
+        parser.add_argument(
+            '--cold', action='store_true',
+            help='A distinct query string per request, so that none is answered from the response cache')
+
+    def handle(self, *args, **options):
+        url = urlsplit(options['path'])
+        if not url.path.startswith('/api/'):
+            raise CommandError("Expected an endpoint under /api/")
+        async_path = '/api/async/' + url.path[len('/api/'):]
+
+        numbers = count()
+        if options['cold']:
+            query = lambda: '&'.join(filter(None, [url.query, f'cold={next(numbers)}']))  # noqa: E731
+        else:
+            query = lambda: url.query  # noqa: E731
+
+        wsgi, asgi = get_wsgi_application(), get_asgi_application()
+        paths = {
+            'wsgi': lambda clients: self.wsgi(wsgi, url.path, query, clients, options['requests']),
+            'asgi': lambda clients: self.asgi(asgi, url.path, query, clients, options['requests']),
+            'asgi async': lambda clients: self.asgi(asgi, async_path, query, clients, options['requests']),
+        }
+        for clients in options['clients']:
+            for name, path in paths.items():
+                start = time.perf_counter()
+                results = path(clients)
+                elapsed = time.perf_counter() - start
+                statuses = {status for status, _ in results}
+                if statuses != {200}:
+                    raise CommandError(f"{name} answered {sorted(statuses)}")
+                latencies = sorted(latency * 1000 for _, latency in results)
+                p50, p95 = (quantiles(latencies, n=20)[index] for index in (9, 18))
+                self.stdout.write(
+                    f"{clients:>3} clients, {name:<10}: {len(results) / elapsed:8,.0f} requests/s, "
+                    f"p50 {p50:.1f} ms, p95 {p95:.1f} ms"
+                )
+
+    def wsgi(self, application, path, query, clients, requests):
+        # a threaded WSGI server with a thread per client
+        def request(_):
+            environ = {'PATH_INFO': path, 'QUERY_STRING': query(), 'HTTP_HOST': 'localhost'}
+            setup_testing_defaults(environ)
+            start = time.perf_counter()
+            status = []
+            body = application(environ, lambda line, headers: status.append(int(line.split()[0])))
+            b''.join(body)
+            body.close()
+            return status[0], time.perf_counter() - start
+
+        with ThreadPoolExecutor(max_workers=clients) as executor:
+            return list(executor.map(request, range(requests)))
+
+    def asgi(self, application, path, query, clients, requests):
+        # one event loop, as in a uvicorn worker
+        async def request():
+            scope = {
+                'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET',
+                'scheme': 'http', 'path': path, 'raw_path': path.encode(), 'query_string': query().encode(),
+                'headers': [(b'host', b'localhost')], 'server': ('localhost', 80), 'client': ('127.0.0.1', 0),
+            }
+            messages = [{'type': 'http.request', 'body': b'', 'more_body': False}]
+            status = []
+
+            async def receive():
+                if messages:
+                    return messages.pop()
+                await asyncio.Event().wait()
+
+            async def send(message):
+                if message['type'] == 'http.response.start':
+                    status.append(message['status'])
+
+            start = time.perf_counter()
+            await application(scope, receive, send)
+            return status[0], time.perf_counter() - start
+
+        async def client(remaining, results):
+            while remaining:
+                remaining.pop()
+                results.append(await request())
+
+        async def run():
+            remaining, results = list(range(requests)), []
+            await asyncio.gather(*(client(remaining, results) for _ in range(clients)))
+            return results
+
+        return asyncio.run(run())
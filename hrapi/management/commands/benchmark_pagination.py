@@ -0,0 +1,59 @@
+from statistics import median
+from urllib.parse import parse_qs, urlparse
+import time
+
+from django.core.management.base import BaseCommand
+from django.test import Client
+from rest_framework.pagination import Cursor
+
+from hrapi.models import Employee
+from hrapi.pagination import KeysetPagination
+
+
+class Command(BaseCommand):
+    help = "Time /api/employees/ pages with keyset pagination against the same pages read with OFFSET"
+
+    def add_arguments(self, parser):
+        parser.add_argument('pages', nargs='*', type=int, default=[1, 10000], help='Page numbers to time')
+        parser.add_argument('--page-size', type=int, default=100)
+        parser.add_argument('--repeat', type=int, default=5, help='Runs per page, the median is reported')
+
+    def handle(self, *args, **options):
+        page_size = options['page_size']
+        total = Employee.objects.count()
+        client = Client()
+        for page in options['pages']:
+            offset = (page - 1) * page_size
+            if offset >= total:
+                self.stdout.write(f"page {page}: only {total} employees, skipped")
+                continue
+
+            params = {'page_size': page_size}
+            keyset_queryset = Employee.objects.order_by('id')
+            if offset:
+                # the cursor the client would get by following the next links
+                last_id = Employee.objects.order_by('id').values_list('id', flat=True)[offset - 1]
+                params['cursor'] = self.cursor(last_id)
+                keyset_queryset = keyset_queryset.filter(id__gt=last_id)
+            keyset = self.time(options['repeat'], lambda: client.get('/api/employees/', params, HTTP_HOST='localhost'))
+            keyset_query = self.time(options['repeat'], lambda: list(keyset_queryset[:page_size]))
+            offset_query = self.time(
+                options['repeat'], lambda: list(Employee.objects.order_by('id')[offset:offset + page_size]))
+            self.stdout.write(
+                f"page {page}: endpoint {keyset:.1f} ms, "
+                f"keyset query {keyset_query:.1f} ms, offset query {offset_query:.1f} ms"
+            )
+
+    def cursor(self, position):
+        paginator = KeysetPagination()
+        paginator.base_url = 'http://localhost/api/employees/'
+        url = paginator.encode_cursor(Cursor(offset=0, reverse=False, position=str(position)))
+        return parse_qs(urlparse(url).query)['cursor'][0]
+
+    def time(self, repeat, call):
+        durations = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            call()
+            durations.append((time.perf_counter() - start) * 1000)
+        return median(durations)
@@ -0,0 +1,54 @@
+from statistics import median
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.test import override_settings
+
+from hrapi.models import Employee
+from hrapi.parallel import parallel_stats, pool
+
+
+def doubling(limit):
+    workers = 1
+    while workers < limit:
+        yield workers
+        workers *= 2
+    yield limit
+
+
+class Command(BaseCommand):
+    help = "Time the statistics of the parallel engine over the employees of the database with 1, 2, 4, ... " \
+           "worker processes, up to the number of cores, and the speedup over the fewest"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', nargs='+', type=int, default=list(doubling(os.cpu_count())),
+                            help='Numbers of worker processes to time')
+        parser.add_argument('--statistics', nargs='+', choices=['industry', 'yoe', 'age', 'gender'],
+                            default=['industry', 'yoe', 'age', 'gender'], help='Statistics computed by each run')
+        parser.add_argument('--repeat', type=int, default=3, help='Runs per number of workers, the median is reported')
+
+    def handle(self, *args, **options):
+        levels = sorted(set(options['workers']))
+        if levels[0] < 1:
+            raise CommandError("--workers must be at least 1")
+        self.stdout.write(f"{Employee.objects.count()} employees, {os.cpu_count()} cores")
+        with override_settings(STATS_PARALLELISM=levels[-1]):
+            # started beforehand, busy at once so that they all start,
+            # starting them isn't what is timed
+            list(pool().map(time.sleep, [0.5] * levels[-1]))
+            expected, baseline = None, None
+            for workers in levels:
+                durations = []
+                for _ in range(options['repeat']):
+                    start = time.perf_counter()
+                    results = parallel_stats(options['statistics'], parallelism=workers)
+                    durations.append(time.perf_counter() - start)
+                if expected is None:
+                    expected = results
+                elif results != expected:
+                    raise CommandError(f"{workers} workers gave other statistics than {levels[0]}")
+                seconds = median(durations)
+                baseline = baseline or seconds
+                self.stdout.write(
+                    f"{workers:>3} workers: {seconds:.2f}s, {baseline / seconds:.2f}x the speed of {levels[0]}")
@@ -0,0 +1,55 @@
+from statistics import median
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.renderers import JSONRenderer
+
+from hrapi.models import Employee
+from hrapi.renderers import FastJSONRenderer
+from hrapi.serializers import EmployeeReadSerializer, EmployeeSerializer
+
+
+class Command(BaseCommand):
+    help = "Rows per second through the employee read path, ModelSerializer and JSONRenderer " \
+           "against EmployeeReadSerializer and FastJSONRenderer"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=10000, help='Employees serialized per run')
+        parser.add_argument('--repeat', type=int, default=5, help='Runs per path, the median is reported')
+
+    def handle(self, *args, **options):
+        queryset = Employee.objects.order_by('id')[:options['rows']]
+        rows = queryset.count()
+        if not rows:
+            raise CommandError("No employees to serialize")
+
+        paths = {
+            'before': lambda: (list(queryset.all()), EmployeeSerializer, JSONRenderer()),
+            'after': lambda: (list(queryset.values(*EmployeeReadSerializer.fields())),
+                              EmployeeReadSerializer, FastJSONRenderer()),
+        }
+        contents = {}
+        for name, path in paths.items():
+            timings = {'query': [], 'serialize': [], 'render': []}
+            for _ in range(options['repeat']):
+                start = time.perf_counter()
+                objects, serializer, renderer = path()
+                queried = time.perf_counter()
+                data = serializer(objects, many=True).data
+                serialized = time.perf_counter()
+                contents[name] = renderer.render(data)
+                rendered = time.perf_counter()
+                timings['query'].append(queried - start)
+                timings['serialize'].append(serialized - queried)
+                timings['render'].append(rendered - serialized)
+            timings = {stage: median(durations) for stage, durations in timings.items()}
+            total = sum(timings.values())
+            self.stdout.write(
+                f"{name}: {rows / total:,.0f} rows/s ("
+                + ", ".join(f"{stage} {duration * 1000:.1f} ms" for stage, duration in timings.items())
+                + ")"
+            )
+
+        if contents['before'] != contents['after']:
+            raise CommandError("The two paths rendered different bytes")
+        self.stdout.write(f"same {len(contents['after'])} bytes rendered by both paths")
@@ -1,53 +1,414 @@
 from django.core.management.base import BaseCommand
 import pandas as pd
-from hrapi.models import Employee, Industry
-from datetime import datetime
-from django.db import IntegrityError
-import math
+from hrapi import reader, summary
+from hrapi.caching import bump_generation
+from hrapi.objectcache import invalidate_all
+from hrapi.models import Employee, ImportCheckpoint, Industry
+from decimal import Decimal
+from django.db import IntegrityError, connection, connections, transaction
+from concurrent.futures import ProcessPoolExecutor
+from io import StringIO
+import hashlib
+import json
+import multiprocessing
+import os
+import tempfile
+import time
+import uuid
+
+REQUIRED_FIELDS = ['first_name', 'last_name', 'email', 'date_of_birth', 'salary', 'years_of_experience']
+# missing or invalid, a row is refused; gender may only be missing
+CHECKED_FIELDS = REQUIRED_FIELDS[:3] + ['gender'] + REQUIRED_FIELDS[3:]
+GENDERS = [gender for gender, _ in Employee.GENDER_CHOICES]
+# salary is numeric(10, 2)
+MAX_SALARY = 10 ** 8
+STAGING_COLUMNS = [
+    'position', 'first_name', 'last_name', 'email', 'gender',
+    'date_of_birth', 'industry', 'salary', 'years_of_experience',
+]
+EMPLOYEE_COLUMNS = STAGING_COLUMNS[1:6] + STAGING_COLUMNS[7:]
+# what a row of the file sets on the employee of its email
+CONTENT_FIELDS = EMPLOYEE_COLUMNS + ['industry_id']
+UPDATE_FIELDS = ['first_name', 'last_name', 'gender', 'date_of_birth', 'industry', 'salary', 'years_of_experience']
+CENTS = Decimal('0.01')
+
+
+def content(values):
+    # the fields of an employee as compared by the importer, from a row of
+    # values() or the __dict__ of an instance
+    return tuple(values[field] for field in CONTENT_FIELDS)
+
+
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(2 ** 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def copy_csv(table, file):
+    columns = ', '.join(STAGING_COLUMNS)
+    with connection.cursor() as cursor:
+        cursor.copy_expert(f"COPY {table} ({columns}) FROM STDIN WITH (FORMAT csv)", file)
+
+
+def copy_shard(table, path):
+    # runs in a worker process, with its own database connection
+    try:
+        with open(path) as shard:
+            copy_csv(table, shard)
+    finally:
+        connection.close()
+
+
+class RejectFile:
+    # the rows refused, as read, one JSON object per line with their
+    # position in the file and the reason. Created on the first one.
+
+    def __init__(self, path, append=False):
+        self.path = path
+        self.mode = 'a' if append else 'w'
+        self.file = None
+        self.count = 0
+        if not append and os.path.exists(path):
+            # left by a previous import of the file
+            os.unlink(path)
+
+    def write(self, raw, reasons):
+        if self.file is None:
+            self.file = open(self.path, self.mode)
+        raw = raw.astype(object).where(raw.notna(), None)
+        for (position, row), reason in zip(raw.iterrows(), reasons):
+            self.file.write(json.dumps({'position': position, 'reason': reason, **row.to_dict()}, default=str) + '\n')
+        self.count += len(raw)
+
+    def write_unreadable(self, unreadable):
+        # the elements of the file which aren't objects, see hrapi.reader.frame
+        if self.file is None:
+            self.file = open(self.path, self.mode)
+        for position, element in unreadable.items():
+            self.file.write(json.dumps({'position': position, 'reason': element.reason, 'text': element.text}) + '\n')
+        self.count += len(unreadable)
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
 
 
 class Command(BaseCommand):
-    help = "Import mock data in the database"
+    help = "Import employees in the database from a JSON array, NDJSON or CSV file, read in chunks"
+    # progress(rows read so far) is called after each chunk, by the jobs of hrapi.jobs
+    stealth_options = ('progress',)
 
     def add_arguments(self, parser):
         parser.add_argument('file_path', type=str, help='File path to process')
-
-    def format_date(self, date):
-        date_obj = datetime.strptime(date, '%d/%m/%Y')
-        formatted_date = date_obj.strftime('%Y-%m-%d')
-        return formatted_date
+        parser.add_argument(
+            '--engine', choices=['bulk', 'row', 'copy'], default='bulk',
+            help='bulk upserts in batches and resumes where a stopped import left off, '
+                 'row inserts one employee at a time, '
+                 'copy loads a staging table and upserts on email (for full reloads)'
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Number of rows of the file read at a time, and written per transaction by the bulk engine'
+        )
+        parser.add_argument(
+            '--restart', action='store_true',
+            help='Start over instead of resuming the last import of the file stopped midway (bulk engine)'
+        )
+        parser.add_argument(
+            '--rejects',
+            help='NDJSON file receiving the rows refused, FILE_PATH.rejects.ndjson by default'
+        )
+        parser.add_argument(
+            '--workers', type=int, default=os.cpu_count(),
+            help='Number of processes loading the staging table with the copy engine (PostgreSQL only, '
+                 'a single one when run inside a transaction)'
+        )
 
     def handle(self, *args, **options):
+        start = time.perf_counter()
+        path = options['file_path']
+        rejects = options['rejects'] or f'{path}.rejects.ndjson'
+        self.read = 0
+        self.progress = options.get('progress')
+        chunks = self.chunks(path, options['batch_size'])
+        if options['engine'] == 'row':
+            added = self.import_rows(chunks)
+            rejected = None
+        elif options['engine'] == 'copy':
+            added, rejected = self.import_copy(chunks, options['workers'], RejectFile(rejects))
+        else:
+            added, rejected = self.import_bulk(chunks, path, options['restart'], rejects)
+        elapsed = time.perf_counter() - start
+        print(f"Wrote {added}/{self.read} employees in {elapsed:.2f}s ({self.read / elapsed:.0f} rows/s)")
+        if rejected is not None and rejected.count:
+            print(f"{rejected.count} rows refused written to {rejected.path}")
+
+    def chunks(self, path, size):
+        for raw in reader.chunks(path, size):
+            self.read += len(raw)
+            yield raw
+            if self.progress is not None:
+                self.progress(self.read)
+
+    def import_rows(self, chunks):
         # what if a field is missing ?
         # what if we try to insert a duplicate ?
-        df = pd.read_json(options['file_path'])
-        df = df.where(pd.notnull(df), None)
-        for index, employee in df.iterrows():
+        added = 0
+        for df in chunks:
+            df = self.clean(df)
+            for index, employee in df.iterrows():
 
-            if employee['industry'] not in [None, 'n/a']:
-                industry, _ = Industry.objects.get_or_create(
-                    name=employee['industry']
-                )
+                if employee['industry'] is not None:
+                    industry, _ = Industry.objects.get_or_create(
+                        name=employee['industry']
+                    )
+                else:
+                    industry = None
+
+                try:
+                    Employee.objects.create(
+                        first_name=employee['first_name'],
+                        last_name=employee['last_name'],
+                        email=employee['email'],
+                        gender=employee['gender'],
+                        date_of_birth=employee['date_of_birth'],
+                        industry=industry,
+                        salary=employee['salary'],
+                        years_of_experience=employee['years_of_experience'],
+                    )
+                    added += 1
+                    print(f"Successfully added {employee['first_name']} - {index}")
+                except IntegrityError:
+                    print(f"Couldn't add {employee['first_name']}, email already taken: {employee['email']} - {index}")
+        return added
+
+    def import_bulk(self, chunks, path, restart, rejects):
+        # Upserts on email in batches, each committed with the progress of
+        # the import through the file, which a new run resumes from. Rows are
+        # compared with the employee of the same email and only the ones
+        # that differ are written.
+        checkpoint = self.checkpoint(path, restart)
+        if checkpoint.offset:
+            print(f"Resuming {path} after row {checkpoint.offset}")
+        industry_ids = {}
+
+        with RejectFile(rejects, append=checkpoint.offset > 0) as rejects:
+            for raw in chunks:
+                # the index of the rows is their position in the file
+                raw = raw[raw.index >= checkpoint.offset]
+                if raw.empty:
+                    continue
+                start, end = int(raw.index[0]), int(raw.index[-1]) + 1
+                df = self.valid_rows(self.clean(raw), raw, rejects)
+                names = [name for name in df['industry'].dropna().unique().tolist() if name not in industry_ids]
+                industry_ids.update(self.industry_ids(names))
+                self.write_batch(df, industry_ids, checkpoint, end, rejected=len(raw) - len(df))
+                print(f"Imported rows {start}-{end - 1}")
+
+        checkpoint.finished = True
+        checkpoint.save(update_fields=['finished', 'updated_at'])
+        print(f"{checkpoint.inserted} inserted, {checkpoint.updated} updated, "
+              f"{checkpoint.unchanged} unchanged, {checkpoint.rejected} rejected")
+        return checkpoint.inserted + checkpoint.updated, rejects
+
+    def checkpoint(self, path, restart):
+        path = os.path.abspath(path)
+        content_hash = file_hash(path)
+        checkpoint, created = ImportCheckpoint.objects.get_or_create(path=path, defaults={'content_hash': content_hash})
+        if not created and (restart or checkpoint.finished or checkpoint.content_hash != content_hash):
+            checkpoint.content_hash = content_hash
+            checkpoint.offset = checkpoint.inserted = checkpoint.updated = 0
+            checkpoint.unchanged = checkpoint.rejected = 0
+            checkpoint.finished = False
+            checkpoint.save()
+        return checkpoint
+
+    def write_batch(self, batch, industry_ids, checkpoint, offset, rejected):
+        existing = {
+            row['email']: row
+            for row in Employee.objects.filter(email__in=batch['email'].tolist()).values('id', *CONTENT_FIELDS)
+        }
+        new, changed, unchanged = [], [], 0
+        for first_name, last_name, email, gender, date_of_birth, industry, salary, yoe in zip(
+            batch['first_name'], batch['last_name'], batch['email'], batch['gender'],
+            batch['date_of_birth'], batch['industry'], batch['salary'], batch['years_of_experience'],
+        ):
+            employee = Employee(
+                first_name=first_name,
+                last_name=last_name,
+                email=email,
+                gender=gender,
+                date_of_birth=date_of_birth,
+                industry_id=industry_ids.get(industry),
+                salary=Decimal(str(salary)).quantize(CENTS),
+                years_of_experience=int(yoe),
+            )
+            current = existing.get(email)
+            if current is None:
+                new.append(employee)
+            elif content(current) != content(employee.__dict__):
+                employee.pk = current['id']
+                changed.append(employee)
             else:
-                industry = None
+                unchanged += 1
 
-            try:
-                salary = employee['salary'] if not math.isnan(
-                    employee['salary']) else None
-                yoe = employee['years_of_experience'] if not math.isnan(
-                    employee['years_of_experience']) else None
-                Employee.objects.create(
-                    first_name=employee['first_name'],
-                    last_name=employee['last_name'],
-                    email=employee['email'],
-                    gender=employee['gender'],
-                    date_of_birth=self.format_date(employee['date_of_birth']),
-                    industry=industry,
-                    salary=salary,
-                    years_of_experience=yoe,
+        with transaction.atomic():
+            if new:
+                Employee.objects.bulk_create(new)
+            if changed:
+                Employee.objects.bulk_update(changed, UPDATE_FIELDS)
+            checkpoint.offset = offset
+            checkpoint.inserted += len(new)
+            checkpoint.updated += len(changed)
+            checkpoint.unchanged += unchanged
+            checkpoint.rejected += rejected
+            checkpoint.save()
+
+    def import_copy(self, chunks, workers, rejects):
+        table = f"hrapi_employee_staging_{uuid.uuid4().hex[:8]}"
+        unlogged = 'UNLOGGED ' if connection.vendor == 'postgresql' else ''
+        with connection.cursor() as cursor:
+            cursor.execute(f"""
+                CREATE {unlogged}TABLE {table} (
+                    position bigint, first_name varchar(100), last_name varchar(100),
+                    email varchar(254), gender varchar(1), date_of_birth date,
+                    industry varchar(100), salary numeric(10, 2), years_of_experience integer
                 )
-                print(f"Successfully added {employee['first_name']} - {index}/{len(df)}")
-            except IntegrityError:
-                print(f"Couldn't add {employee['first_name']}, email already taken: {employee['email']} - {index}/{len(df)}")
+            """)
+        try:
+            with rejects:
+                self.load_staging(table, self.staging_rows(chunks, rejects), workers)
+            with transaction.atomic(), connection.cursor() as cursor:
+                cursor.execute(f"CREATE INDEX {table}_email ON {table} (email, position)")
+                # industries and employees are resolved with set based statements,
+                # the last row of an email in the file wins
+                cursor.execute(f"""
+                    INSERT INTO hrapi_industry (name)
+                    SELECT DISTINCT industry FROM {table} WHERE industry IS NOT NULL
+                    ON CONFLICT (name) DO NOTHING
+                """)
+                columns = ', '.join(EMPLOYEE_COLUMNS)
+                cursor.execute(f"""
+                    INSERT INTO hrapi_employee ({columns}, industry_id)
+                    SELECT {', '.join('s.' + column for column in EMPLOYEE_COLUMNS)}, i.id
+                    FROM {table} s LEFT JOIN hrapi_industry i ON i.name = s.industry
+                    WHERE s.position = (SELECT MAX(position) FROM {table} l WHERE l.email = s.email)
+                    ON CONFLICT (email) DO UPDATE SET
+                    {', '.join(f'{column} = EXCLUDED.{column}' for column in EMPLOYEE_COLUMNS + ['industry_id'])}
+                """)
+                merged = cursor.rowcount
+                # a full reload touches most cells, recounting is cheaper than tracking
+                summary.rebuild()
+                invalidate_all('employee')
+                bump_generation('industry', 'employee')
+        finally:
+            with connection.cursor() as cursor:
+                cursor.execute(f"DROP TABLE {table}")
+        print(f"Successfully added or updated {merged} employees")
+        return merged, rejects
+
+    def staging_rows(self, chunks, rejects):
+        # the valid rows of each chunk as staging table columns
+        for raw in chunks:
+            df = self.valid_rows(self.clean(raw), raw, rejects)
+            yield df.assign(
+                position=df.index,
+                years_of_experience=df['years_of_experience'].astype('int64'),
+            )[STAGING_COLUMNS]
+
+    def load_staging(self, table, chunks, workers):
+        if connection.vendor != 'postgresql':
+            # no COPY, a plain insert in this process is enough for tests
+            with connection.cursor() as cursor:
+                for df in chunks:
+                    cursor.executemany(
+                        f"INSERT INTO {table} ({', '.join(STAGING_COLUMNS)}) "
+                        f"VALUES ({', '.join(['%s'] * len(STAGING_COLUMNS))})",
+                        df.itertuples(index=False, name=None),
+                    )
+            return
+
+        if connection.in_atomic_block or workers <= 1:
+            # the workers' connections wouldn't see the staging table of an
+            # uncommitted transaction, nor may its connection be closed
+            for df in chunks:
+                copy_csv(table, StringIO(df.to_csv(header=False, index=False)))
+            return
+
+        with tempfile.TemporaryDirectory() as directory:
+            # the chunks are dealt to a shard per worker on disk
+            paths = [os.path.join(directory, f'shard{index}.csv') for index in range(max(1, workers))]
+            shards = [open(path, 'w') for path in paths]
+            try:
+                for index, df in enumerate(chunks):
+                    df.to_csv(shards[index % len(shards)], header=False, index=False)
+            finally:
+                for shard in shards:
+                    shard.close()
+            # forked workers must not share the connection of this process
+            connections.close_all()
+            with ProcessPoolExecutor(len(paths), mp_context=multiprocessing.get_context('fork')) as pool:
+                for future in [pool.submit(copy_shard, table, path) for path in paths]:
+                    future.result()
+
+    def valid_rows(self, df, raw, rejects):
+        # rows the database would refuse go to the reject file, with the
+        # earlier rows of an email appearing again in the chunk: the rows of
+        # the file are applied in order, the last one of an email wins
+        unreadable = raw.attrs.get('unreadable', {})
+        if unreadable:
+            print(f"Couldn't read {len(unreadable)} rows: {', '.join(map(str, unreadable))}")
+            rejects.write_unreadable(unreadable)
+        absent = raw[CHECKED_FIELDS].isna()
+        missing = df[CHECKED_FIELDS].isna() & (~absent | absent.columns.isin(REQUIRED_FIELDS))
+        invalid = missing.any(axis=1) & ~df.index.isin(list(unreadable))
+        if invalid.any():
+            print(f"Couldn't add {invalid.sum()} employees with missing or invalid fields: "
+                  f"{', '.join(df.loc[invalid, 'email'].fillna('no email').astype(str))}")
+            rejects.write(raw[invalid], [
+                ', '.join(f"{'missing' if absent.at[position, field] else 'invalid'} {field}" for field in fields)
+                for position, fields in missing[invalid].apply(lambda row: row.index[row].tolist(), axis=1).items()
+            ])
+        invalid |= df.index.isin(list(unreadable))
+        df = df[~invalid]
+
+        superseded = df['email'].duplicated(keep='last')
+        if superseded.any():
+            print(f"Couldn't add {superseded.sum()} employees appearing again later in the file: "
+                  f"{', '.join(df.loc[superseded, 'email'])}")
+            rejects.write(raw.loc[df.index[superseded]], ['superseded by a later row of the email'] * superseded.sum())
+        return df[~superseded]
 
+    def clean(self, df):
+        # column-wise conversions of a chunk, None where a value is missing
+        # or can't be converted
+        df = df.astype(object).where(df.notna(), None)
+        df['industry'] = df['industry'].where(df['industry'] != 'n/a', None)
+        df['gender'] = df['gender'].where(df['gender'].isin(GENDERS), None)
+        dates = pd.to_datetime(df['date_of_birth'], format='%d/%m/%Y', errors='coerce')
+        df['date_of_birth'] = dates.dt.date.astype(object).where(dates.notna(), None)
+        salaries = pd.to_numeric(df['salary'], errors='coerce').round(2)
+        for column, numbers in [
+            ('salary', salaries.where(salaries.abs() < MAX_SALARY)),
+            ('years_of_experience', pd.to_numeric(df['years_of_experience'], errors='coerce')),
+        ]:
+            df[column] = numbers.astype(object).where(numbers.notna(), None)
+        return df
 
+    def industry_ids(self, names):
+        # one query for the known industries, one insert for the new ones
+        ids = dict(Industry.objects.filter(name__in=names).values_list('name', 'id'))
+        new = [Industry(name=name) for name in names if name not in ids]
+        if new:
+            Industry.objects.bulk_create(new, ignore_conflicts=True)
+            ids.update(Industry.objects.filter(name__in=[industry.name for industry in new]).values_list('name', 'id'))
+        return ids
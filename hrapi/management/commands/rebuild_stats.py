@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from hrapi import summary
+from hrapi.caching import bump_generation
+from hrapi.models import EmployeeStat, SalaryBin
+
+
+class Command(BaseCommand):
+    help = "Recompute the statistics summary from the employee table"
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            summary.rebuild()
+            bump_generation('employee')
+        self.stdout.write(
+            f"Rebuilt {EmployeeStat.objects.count()} statistics cells and {SalaryBin.objects.count()} salary bins")
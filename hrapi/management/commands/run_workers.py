@@ -0,0 +1,63 @@
+import multiprocessing
+import os
+import signal
+import threading
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+
+from hrapi.jobs import work
+
+
+def worker_process(poll_interval, burst):
+    # SIGTERM lets the job running finish, the parent forwards Ctrl-C as one
+    stopped = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *args: stopped.set())
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    try:
+        work(burst=burst, poll_interval=poll_interval, stopped=stopped)
+    finally:
+        connection.close()
+
+
+class Command(BaseCommand):
+    help = "Run the jobs queued through /api/jobs/ (imports, statistics reports) in a pool of worker processes, " \
+           "see hrapi.jobs. SIGTERM or Ctrl-C stops them once their current job is done."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=os.cpu_count(),
+                            help='Number of worker processes, each running one job at a time')
+        parser.add_argument('--poll-interval', type=float, default=1.0,
+                            help='Seconds a worker waits before looking again at an empty queue')
+        parser.add_argument('--burst', action='store_true',
+                            help='Stop once the queue is empty instead of waiting for new jobs')
+
+    def handle(self, *args, **options):
+        if options['concurrency'] < 1:
+            raise CommandError("--concurrency must be at least 1")
+        # forked workers must not share the connections of this process
+        connections.close_all()
+        context = multiprocessing.get_context('fork')
+        processes = [
+            context.Process(
+                target=worker_process, args=(options['poll_interval'], options['burst']), name=f'hrapi-worker-{index}',
+            )
+            for index in range(options['concurrency'])
+        ]
+        for process in processes:
+            process.start()
+        self.stdout.write(f"Started {len(processes)} workers: {', '.join(str(process.pid) for process in processes)}")
+
+        def stop(signum, frame):
+            self.stdout.write("Stopping the workers after their current job")
+            for process in processes:
+                if process.is_alive():
+                    os.kill(process.pid, signal.SIGTERM)
+
+        signal.signal(signal.SIGTERM, stop)
+        signal.signal(signal.SIGINT, stop)
+        for process in processes:
+            process.join()
+        failed = [process for process in processes if process.exitcode]
+        if failed:
+            raise CommandError(f"{len(failed)} workers exited with an error")
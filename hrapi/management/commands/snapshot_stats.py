@@ -0,0 +1,33 @@
+from datetime import date
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from hrapi.models import Employee, StatsSnapshot
+from hrapi.stats import python_stats
+
+
+class Command(BaseCommand):
+    help = "Store today's four statistics (per industry, experience, age and gender) for /api/stats/history, " \
+           "computed in one pass over the employees. Meant to run daily, from cron for instance; " \
+           "running it again the same day replaces that day's snapshot."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--date', type=date.fromisoformat, default=None,
+            help='Date of the snapshot (YYYY-MM-DD), today by default. The ages are those on that date, '
+                 'everything else is the employees as they are now'
+        )
+
+    def handle(self, *args, **options):
+        day = options['date'] or date.today()
+        if day > date.today():
+            raise CommandError("Can't snapshot the statistics of a future date")
+        start = time.perf_counter()
+        results = python_stats(now=day)
+        snapshot, created = StatsSnapshot.objects.update_or_create(
+            date=day, defaults={**results, 'employees': Employee.objects.count()})
+        self.stdout.write(
+            f"{'Stored' if created else 'Replaced'} the statistics of {day} "
+            f"({snapshot.employees} employees) in {time.perf_counter() - start:.2f}s"
+        )
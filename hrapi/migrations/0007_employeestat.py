@@ -0,0 +1,84 @@
+# Generated by Django 4.2 on 2026-10-18 10:09
+
+from decimal import Decimal
+
+from django.db import migrations, models
+from django.db.models import Case, Count, IntegerField, Sum, Value, When
+from django.db.models.functions import Coalesce, ExtractDay, ExtractMonth, ExtractYear
+import django.db.models.deletion
+
+# as hrapi.summary and hrapi.stats were when the tables were added
+YOE_BINS = [0, 5, 10, 15, 20, 25, 30, float('inf')]
+NO_BUCKET = -1
+
+
+def yoe_bucket():
+    # index of the (low, high] YOE_BINS bin holding the experience
+    whens = []
+    for index, (low, high) in enumerate(zip(YOE_BINS, YOE_BINS[1:])):
+        lookups = {'years_of_experience__gt': low}
+        if high != float('inf'):
+            lookups['years_of_experience__lte'] = high
+        whens.append(When(then=Value(index), **lookups))
+    return Case(*whens, default=Value(NO_BUCKET), output_field=IntegerField())
+
+
+def populate_stats(apps, schema_editor):
+    Employee = apps.get_model('hrapi', 'Employee')
+    EmployeeStat = apps.get_model('hrapi', 'EmployeeStat')
+    BirthdayStat = apps.get_model('hrapi', 'BirthdayStat')
+    cells = Employee.objects.order_by()\
+        .annotate(yoe_bucket=yoe_bucket(), birth_year=ExtractYear('date_of_birth'))\
+        .values('industry_id', 'gender', 'yoe_bucket', 'birth_year')\
+        .annotate(
+            headcount=Count('id'),
+            salary_sum=Coalesce(Sum('salary'), Value(Decimal(0))),
+            experience_sum=Coalesce(Sum('years_of_experience'), Value(0)),
+        )
+    EmployeeStat.objects.bulk_create((EmployeeStat(**row) for row in cells), batch_size=1000)
+    birthdays = Employee.objects.order_by()\
+        .annotate(birthday=ExtractMonth('date_of_birth') * 100 + ExtractDay('date_of_birth'))\
+        .values('industry_id', 'birthday')\
+        .annotate(headcount=Count('id'))
+    BirthdayStat.objects.bulk_create((BirthdayStat(**row) for row in birthdays), batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hrapi', '0006_alter_employee_industry'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EmployeeStat',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('gender', models.CharField(choices=[('M', 'Male'), ('F', 'Female')], max_length=1, null=True)),
+                ('yoe_bucket', models.SmallIntegerField()),
+                ('birth_year', models.SmallIntegerField()),
+                ('headcount', models.IntegerField(default=0)),
+                ('salary_sum', models.DecimalField(decimal_places=2, default=0, max_digits=20)),
+                ('experience_sum', models.BigIntegerField(default=0)),
+                ('industry', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, to='hrapi.industry')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='BirthdayStat',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('birthday', models.SmallIntegerField()),
+                ('headcount', models.IntegerField(default=0)),
+                ('industry', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, to='hrapi.industry')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='employeestat',
+            index=models.Index(fields=['industry', 'gender', 'yoe_bucket', 'birth_year'], name='hrapi_emplo_industr_be3115_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='birthdaystat',
+            index=models.Index(fields=['industry', 'birthday'], name='hrapi_birth_industr_c02201_idx'),
+        ),
+        migrations.RunPython(populate_stats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,77 @@
+# Generated by Django 4.2 on 2026-10-18 10:26
+
+from collections import defaultdict
+import math
+
+from django.db import migrations, models
+from django.db.models import Case, Count, IntegerField, Value, When
+import django.db.models.deletion
+
+# as hrapi.summary, hrapi.stats and hrapi.sketch were when the table was added
+YOE_BINS = [0, 5, 10, 15, 20, 25, 30, float('inf')]
+NO_BUCKET = -1
+LOG_GAMMA = math.log(1.01 / 0.99)
+ZERO_KEY = -2 ** 31
+
+
+def yoe_bucket():
+    # index of the (low, high] YOE_BINS bin holding the experience
+    whens = []
+    for index, (low, high) in enumerate(zip(YOE_BINS, YOE_BINS[1:])):
+        lookups = {'years_of_experience__gt': low}
+        if high != float('inf'):
+            lookups['years_of_experience__lte'] = high
+        whens.append(When(then=Value(index), **lookups))
+    return Case(*whens, default=Value(NO_BUCKET), output_field=IntegerField())
+
+
+def sketch_key(value):
+    value = float(value)
+    if value <= 0:
+        return ZERO_KEY
+    return math.ceil(math.log(value) / LOG_GAMMA)
+
+
+def populate_bins(apps, schema_editor):
+    Employee = apps.get_model('hrapi', 'Employee')
+    SalaryBin = apps.get_model('hrapi', 'SalaryBin')
+    bins = defaultdict(int)
+    rows = Employee.objects.order_by()\
+        .annotate(yoe_bucket=yoe_bucket())\
+        .values('industry_id', 'gender', 'yoe_bucket', 'salary')\
+        .annotate(headcount=Count('id'))
+    for row in rows:
+        bins[(row['industry_id'], row['gender'], row['yoe_bucket'], sketch_key(row['salary']))] += row['headcount']
+    SalaryBin.objects.bulk_create(
+        (
+            SalaryBin(industry_id=industry_id, gender=gender, yoe_bucket=bucket, key=key, headcount=headcount)
+            for (industry_id, gender, bucket, key), headcount in bins.items()
+        ),
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hrapi', '0007_employeestat'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SalaryBin',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('gender', models.CharField(choices=[('M', 'Male'), ('F', 'Female')], max_length=1, null=True)),
+                ('yoe_bucket', models.SmallIntegerField()),
+                ('key', models.IntegerField()),
+                ('headcount', models.IntegerField(default=0)),
+                ('industry', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, to='hrapi.industry')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='salarybin',
+            index=models.Index(fields=['industry', 'gender', 'yoe_bucket', 'key'], name='hrapi_salar_industr_fa7e1a_idx'),
+        ),
+        migrations.RunPython(populate_bins, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 4.2 on 2026-10-18 10:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hrapi', '0008_salarybin'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='employee',
+            index=models.Index(fields=['industry', 'salary'], name='hrapi_emplo_industr_7e370e_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='employee',
+            index=models.Index(fields=['gender', 'salary'], name='hrapi_emplo_gender_5b8e89_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='employee',
+            index=models.Index(fields=['salary'], name='hrapi_emplo_salary_d6d3dd_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='employee',
+            index=models.Index(fields=['years_of_experience'], name='hrapi_emplo_years_o_c3b9c1_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='employee',
+            index=models.Index(fields=['date_of_birth'], name='hrapi_emplo_date_of_e0aea7_idx'),
+        ),
+    ]
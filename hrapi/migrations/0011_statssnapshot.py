@@ -0,0 +1,26 @@
+# Generated by Django 4.2 on 2026-10-18 11:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hrapi', '0010_importcheckpoint'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StatsSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(unique=True)),
+                ('industry', models.JSONField()),
+                ('yoe', models.JSONField()),
+                ('age', models.JSONField()),
+                ('gender', models.JSONField()),
+                ('employees', models.IntegerField()),
+                ('computed_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
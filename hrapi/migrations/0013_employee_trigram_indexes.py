@@ -0,0 +1,48 @@
+# Generated by Django 4.2 on 2026-10-18 14:02
+
+import django.contrib.postgres.indexes
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations
+import django.db.models.functions.text
+
+
+class AddPostgreSQLIndex(migrations.AddIndex):
+    # GIN and its operator classes only exist on PostgreSQL, other databases
+    # (the tests on SQLite) keep the index in the model state alone
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor == 'postgresql':
+            super().database_forwards(app_label, schema_editor, from_state, to_state)
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor == 'postgresql':
+            super().database_backwards(app_label, schema_editor, from_state, to_state)
+
+
+def trigram_index(field):
+    return AddPostgreSQLIndex(
+        model_name='employee',
+        index=django.contrib.postgres.indexes.GinIndex(
+            django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Upper(field), name='gin_trgm_ops'),
+            name=f'hrapi_employee_{field}_trgm',
+        ),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hrapi', '0012_job'),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        # the same indexes, created by hand by an earlier version of 0009
+        migrations.RunSQL(
+            [f'DROP INDEX IF EXISTS hrapi_employee_{field}_trgm' for field in ['first_name', 'last_name', 'email']],
+            migrations.RunSQL.noop,
+        ),
+        trigram_index('first_name'),
+        trigram_index('last_name'),
+        trigram_index('email'),
+    ]
@@ -1,10 +1,145 @@
-from django.db import models
+from django.contrib.postgres.indexes import GinIndex, OpClass
+from django.db import connections, models, transaction
+from django.db.models.functions import Upper
+
+from hrapi.caching import bump_generation
+from hrapi.objectcache import invalidate
+
+
+class EmployeeQuerySet(models.QuerySet):
+    # bulk operations skip Employee.save/delete, so they maintain the
+    # statistics summary, the cache generation and the cached details themselves
+
+    def bulk_create(self, objs, *args, **kwargs):
+        from hrapi import summary
+        self._for_write = True
+        objs = list(objs)
+        with transaction.atomic(using=self.db):
+            if kwargs.get('ignore_conflicts') or kwargs.get('update_conflicts'):
+                # we can't tell which rows were written, so recount them by email
+                emails = [obj.email for obj in objs]
+                with summary.tracking(Employee.objects.filter(email__in=emails)):
+                    objs = super().bulk_create(objs, *args, **kwargs)
+                invalidate('employee', Employee.objects.filter(email__in=emails).values_list('pk', flat=True))
+            else:
+                objs = super().bulk_create(objs, *args, **kwargs)
+                summary.apply_contributions(summary.employee_contributions(objs))
+                invalidate('employee', [obj.pk for obj in objs if obj.pk is not None])
+            bump_generation('employee')
+            return objs
+
+    def bulk_update(self, objs, fields, batch_size=None):
+        # one prepared UPDATE for every row rather than the CASE per row and
+        # field Django builds, with the summary moved once per batch
+        from hrapi import summary
+        self._for_write = True
+        objs = list(objs)
+        fields = [self.model._meta.get_field(name) for name in fields]
+        connection = connections[self.db]
+        quote = connection.ops.quote_name
+        assignments = ', '.join(f'{quote(field.column)} = %s' for field in fields)
+        sql = f'UPDATE {quote(self.model._meta.db_table)} SET {assignments} WHERE id = %s'
+        batch_size = batch_size or 1000
+        with transaction.atomic(using=self.db):
+            for start in range(0, len(objs), batch_size):
+                batch = objs[start:start + batch_size]
+                params = [
+                    [field.get_db_prep_save(getattr(obj, field.attname), connection) for field in fields] + [obj.pk]
+                    for obj in batch
+                ]
+                with summary.tracking(Employee.objects.filter(pk__in=[obj.pk for obj in batch])):
+                    with connection.cursor() as cursor:
+                        cursor.executemany(sql, params)
+            invalidate('employee', [obj.pk for obj in objs])
+            bump_generation('employee')
+        return len(objs)
+
+    def update(self, **kwargs):
+        from hrapi import summary
+        self._for_write = True
+        with transaction.atomic(using=self.db):
+            pks = list(self.values_list('pk', flat=True))
+            with summary.tracking(Employee.objects.filter(pk__in=pks)):
+                updated = super().update(**kwargs)
+            invalidate('employee', pks)
+            bump_generation('employee')
+            return updated
+
+    def delete(self):
+        from hrapi import summary
+        self._for_write = True
+        with transaction.atomic(using=self.db):
+            pks = list(self.values_list('pk', flat=True))
+            summary.apply_contributions(summary.queryset_contributions(self), sign=-1)
+            deleted = super().delete()
+            invalidate('employee', pks)
+            bump_generation('employee')
+            return deleted
+
+    delete.alters_data = True
+    delete.queryset_only = True
+    update.alters_data = True
+
+
+class IndustryQuerySet(models.QuerySet):
+
+    def bulk_create(self, objs, *args, **kwargs):
+        self._for_write = True
+        with transaction.atomic(using=self.db):
+            objs = super().bulk_create(objs, *args, **kwargs)
+            invalidate('industry', [obj.pk for obj in objs if obj.pk is not None])
+            bump_generation('industry')
+            return objs
+
+    def update(self, **kwargs):
+        self._for_write = True
+        with transaction.atomic(using=self.db):
+            pks = list(self.values_list('pk', flat=True))
+            updated = super().update(**kwargs)
+            # a new name leaves the employees as they are, they hold the pk
+            invalidate('industry', pks)
+            bump_generation('industry')
+            return updated
+
+    def delete(self):
+        self._for_write = True
+        with transaction.atomic(using=self.db):
+            pks = list(self.values_list('pk', flat=True))
+            employees = list(Employee.objects.filter(industry__in=pks).values_list('pk', flat=True))
+            deleted = super().delete()
+            # the employees of deleted industries are updated too
+            invalidate('industry', pks)
+            invalidate('employee', employees)
+            bump_generation('industry', 'employee')
+            return deleted
+
+    delete.alters_data = True
+    delete.queryset_only = True
+    update.alters_data = True
 
 
 # Create your models here.
 class Industry(models.Model):
     name = models.CharField(max_length=100, unique=True)
 
+    objects = IndustryQuerySet.as_manager()
+
+    def save(self, *args, **kwargs):
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            invalidate('industry', [self.pk])
+            bump_generation('industry')
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            pk = self.pk
+            employees = list(self.employee_set.values_list('pk', flat=True))
+            deleted = super().delete(*args, **kwargs)
+            invalidate('industry', [pk])
+            invalidate('employee', employees)
+            bump_generation('industry', 'employee')
+            return deleted
+
 
 class Employee(models.Model):
     GENDER_CHOICES = (
@@ -22,12 +157,173 @@ class Employee(models.Model):
     salary = models.DecimalField(decimal_places=2, max_digits=10)
     years_of_experience = models.IntegerField()
 
+    objects = EmployeeQuerySet.as_manager()
+
     def __str__(self):
         return f"{self.first_name} {self.last_name}"
 
+    def save(self, *args, **kwargs):
+        # the statistics summary is updated in the same transaction
+        from hrapi import summary
+        with transaction.atomic():
+            previous = None
+            if self.pk is not None:
+                previous = Employee.objects.select_for_update().filter(pk=self.pk).first()
+            super().save(*args, **kwargs)
+            if previous is not None:
+                summary.apply_contributions(summary.employee_contributions([previous]), sign=-1)
+            summary.apply_contributions(summary.employee_contributions([self]))
+            invalidate('employee', [self.pk])
+            bump_generation('employee')
+
+    def delete(self, *args, **kwargs):
+        from hrapi import summary
+        with transaction.atomic():
+            pk = self.pk
+            previous = Employee.objects.select_for_update().filter(pk=pk).first()
+            deleted = super().delete(*args, **kwargs)
+            if previous is not None:
+                summary.apply_contributions(summary.employee_contributions([previous]), sign=-1)
+            invalidate('employee', [pk])
+            bump_generation('employee')
+            return deleted
+
+    class Meta:
+        # backing the list filters of hrapi.filters. icontains and istartswith
+        # filter on UPPER(column) LIKE, which the trigram indexes on the same
+        # expressions serve, they are only created on PostgreSQL (migration 0013)
+        indexes = [
+            models.Index(fields=['industry', 'salary']),
+            models.Index(fields=['gender', 'salary']),
+            models.Index(fields=['salary']),
+            models.Index(fields=['years_of_experience']),
+            models.Index(fields=['date_of_birth']),
+            GinIndex(OpClass(Upper('first_name'), name='gin_trgm_ops'), name='hrapi_employee_first_name_trgm'),
+            GinIndex(OpClass(Upper('last_name'), name='gin_trgm_ops'), name='hrapi_employee_last_name_trgm'),
+            GinIndex(OpClass(Upper('email'), name='gin_trgm_ops'), name='hrapi_employee_email_trgm'),
+        ]
+
     # first and last name could be used to make a unique combination like this :
     # but in bigger companies / countries, it's actually possible to have
     # two employees with same name and surname, so we won't do it
     #
     # class Meta:
     #     unique_together = ('first_name', 'first_name')
+
+
+class EmployeeStat(models.Model):
+    # Running totals of the employees sharing the same industry, gender,
+    # experience bucket (index in hrapi.stats.YOE_BINS, -1 below the first
+    # edge) and birth year. Maintained by hrapi.summary on every write, rows
+    # for a cell are summed when read, see the rebuild_stats command.
+    industry = models.ForeignKey(Industry, on_delete=models.SET_NULL, null=True)
+    gender = models.CharField(max_length=1, choices=Employee.GENDER_CHOICES, null=True)
+    yoe_bucket = models.SmallIntegerField()
+    birth_year = models.SmallIntegerField()
+    headcount = models.IntegerField(default=0)
+    salary_sum = models.DecimalField(decimal_places=2, max_digits=20, default=0)
+    experience_sum = models.BigIntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['industry', 'gender', 'yoe_bucket', 'birth_year']),
+        ]
+
+
+class BirthdayStat(models.Model):
+    # Employees per industry and birthday (month * 100 + day), so that ages
+    # can be computed exactly from EmployeeStat birth years whatever the date
+    industry = models.ForeignKey(Industry, on_delete=models.SET_NULL, null=True)
+    birthday = models.SmallIntegerField()
+    headcount = models.IntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['industry', 'birthday']),
+        ]
+
+
+class SalaryBin(models.Model):
+    # Employees per industry, gender, experience bucket (as in EmployeeStat)
+    # and salary bucket of hrapi.sketch, the quantile sketch of each group
+    industry = models.ForeignKey(Industry, on_delete=models.SET_NULL, null=True)
+    gender = models.CharField(max_length=1, choices=Employee.GENDER_CHOICES, null=True)
+    yoe_bucket = models.SmallIntegerField()
+    key = models.IntegerField()
+    headcount = models.IntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['industry', 'gender', 'yoe_bucket', 'key']),
+        ]
+
+
+class ImportCheckpoint(models.Model):
+    # Progress of the importer through a file: the rows before offset were
+    # committed, along with the tally, in the transaction of their batch.
+    # A file whose content_hash changed is imported again from the start.
+    path = models.CharField(max_length=1024, unique=True)
+    content_hash = models.CharField(max_length=64)
+    offset = models.BigIntegerField(default=0)
+    inserted = models.BigIntegerField(default=0)
+    updated = models.BigIntegerField(default=0)
+    unchanged = models.BigIntegerField(default=0)
+    rejected = models.BigIntegerField(default=0)
+    finished = models.BooleanField(default=False)
+    started_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.path} ({self.offset} rows)"
+
+
+class StatsSnapshot(models.Model):
+    # The four statistics as of a date, in the format of their endpoints,
+    # stored daily by the snapshot_stats command and read by the history
+    # endpoint. A column each, so that a trend reads only the one it shows.
+    date = models.DateField(unique=True)
+    industry = models.JSONField()
+    yoe = models.JSONField()
+    age = models.JSONField()
+    gender = models.JSONField()
+    employees = models.IntegerField()
+    computed_at = models.DateTimeField(auto_now=True)
+
+    def save(self, *args, **kwargs):
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            bump_generation('statssnapshot')
+
+    def __str__(self):
+        return f"Statistics of {self.date}"
+
+
+class Job(models.Model):
+    # Background work run by the run_workers command, see hrapi.jobs
+    QUEUED, RUNNING, SUCCEEDED, FAILED = 'queued', 'running', 'succeeded', 'failed'
+    STATUS_CHOICES = [(status, status) for status in (QUEUED, RUNNING, SUCCEEDED, FAILED)]
+    KIND_CHOICES = [('import', 'Import of an uploaded file'), ('stats', 'Statistics report')]
+
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    params = models.JSONField(default=dict)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=QUEUED)
+    # rows or groups done so far, out of total when it is known
+    processed = models.BigIntegerField(default=0)
+    total = models.BigIntegerField(null=True)
+    result = models.JSONField(null=True)
+    error = models.TextField(blank=True)
+    attempts = models.SmallIntegerField(default=0)
+    worker = models.CharField(max_length=100, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True)
+    # moved on by the worker while it runs the job, see JOB_STALE_SECONDS
+    heartbeat_at = models.DateTimeField(null=True)
+    finished_at = models.DateTimeField(null=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'created_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} job {self.pk} ({self.status})"
@@ -0,0 +1,163 @@
+"""
+Read-through cache of the detail payloads of /api/employees/<pk>/ and
+/api/industries/<pk>/, keyed by primary key.
+
+The payloads (the serialized data, rendered for each request) are kept in
+an LRU of each process, bounded by DETAIL_CACHE_MAX_ENTRIES and
+DETAIL_CACHE_MAX_BYTES. An entry holds while the version tokens it was
+stored with are still those of the 'objects' cache, shared by the
+processes: the token of its shard (the objects of the table with the same
+pk modulo SHARDS), replaced by every write changing one of them
+(invalidate()), and the one of its table, replaced by the writes changing
+rows wholesale (invalidate_all(), the copy engine of the importer, the
+large batches). The writes of any process, the importer's included, reach
+the LRU of every other one. The tokens are read before the object is, a
+write landing in between leaves the entry stored stale under tokens that
+are already gone.
+
+The tokens are few and in a cache of their own, which never culls: reads
+only write the tokens missing, a missing token created anew invalidates
+what it covered.
+
+Entries are filled from the primary while the replicas may lag behind a
+write, see hrapi.replicas.pin_after_write.
+
+Lookups are counted per table as hits or misses, and evictions, in the
+counters served by /metrics, see hrapi.instrumentation.
+"""
+from collections import OrderedDict
+import threading
+import uuid
+
+import orjson
+from django.conf import settings
+from django.core.cache import caches
+from django.core.signals import setting_changed
+from django.db import transaction
+from django.dispatch import receiver
+from rest_framework.response import Response
+
+from hrapi.instrumentation import DETAIL_CACHE_EVICTIONS, DETAIL_CACHE_LOOKUPS
+from hrapi.replicas import pin_after_write
+
+
+# objects of a table sharing a token, a write invalidates 1 / SHARDS of the
+# cached details of its table. Writes touching more than SHARDS / 4 shards
+# replace the token of the table instead.
+SHARDS = 1024
+
+
+def shard_key(table, pk):
+    return f'hrapi:objects:{table}:{pk % SHARDS}'
+
+
+def table_key(table):
+    return f'hrapi:objects:{table}'
+
+
+def versions(table, pk):
+    # (table token, shard token), created when missing
+    tokens = caches['objects']
+    keys = [table_key(table), shard_key(table, pk)]
+    found = tokens.get_many(keys)
+    missing = [key for key in keys if key not in found]
+    if missing:
+        for key in missing:
+            tokens.add(key, uuid.uuid4().hex, None)
+        found.update(tokens.get_many(missing))
+    return tuple(found.get(key) for key in keys)
+
+
+def replace(keys):
+    def write():
+        caches['objects'].set_many({key: uuid.uuid4().hex for key in keys}, None)
+    # right away for the writing request, and again once committed, as
+    # hrapi.caching.bump_generation does
+    write()
+    transaction.on_commit(write)
+
+
+def invalidate(table, pks):
+    keys = {shard_key(table, pk) for pk in pks}
+    if len(keys) > SHARDS // 4:
+        invalidate_all(table)
+    elif keys:
+        replace(keys)
+
+
+def invalidate_all(table):
+    replace([table_key(table)])
+
+
+class DetailCache:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()   # (table, pk) -> (versions, data, size)
+        self.size = 0
+
+    def get(self, table, pk, tokens):
+        with self.lock:
+            entry = self.entries.get((table, pk))
+            if entry is None or entry[0] != tokens:
+                return None
+            self.entries.move_to_end((table, pk))
+            return entry[1]
+
+    def set(self, table, pk, tokens, data):
+        size = len(orjson.dumps(data, default=str))
+        if size > settings.DETAIL_CACHE_MAX_BYTES:
+            return
+        with self.lock:
+            previous = self.entries.pop((table, pk), None)
+            if previous is not None:
+                self.size -= previous[2]
+            self.entries[table, pk] = (tokens, data, size)
+            self.size += size
+            while len(self.entries) > settings.DETAIL_CACHE_MAX_ENTRIES or self.size > settings.DETAIL_CACHE_MAX_BYTES:
+                (evicted, _), (_, _, evicted_size) = self.entries.popitem(last=False)
+                self.size -= evicted_size
+                DETAIL_CACHE_EVICTIONS.inc(evicted)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+    def get_or_load(self, table, pk, load):
+        tokens = versions(table, pk)
+        data = self.get(table, pk, tokens)
+        if data is not None:
+            DETAIL_CACHE_LOOKUPS.inc(table, 'hit')
+            return data
+        DETAIL_CACHE_LOOKUPS.inc(table, 'miss')
+        pin_after_write()
+        data = dict(load())
+        self.set(table, pk, tokens, data)
+        return data
+
+
+details = DetailCache()
+
+
+@receiver(setting_changed)
+def reset_details(setting, **kwargs):
+    if setting.startswith('DETAIL_CACHE_'):
+        details.clear()
+
+
+class CachedDetailMixin:
+    # retrieve() read through the detail cache when the request has no query
+    # parameters (?fields=, filters), the viewset answers the others with
+    # retrieve_uncached()
+
+    def retrieve(self, request, *args, **kwargs):
+        pk = str(kwargs[self.lookup_url_kwarg or self.lookup_field])
+        if request.query_params or not pk.isdecimal() or not settings.DETAIL_CACHE_MAX_ENTRIES:
+            return self.retrieve_uncached(request, *args, **kwargs)
+        table = self.get_queryset().model._meta.model_name
+        data = details.get_or_load(table, int(pk), lambda: self.retrieve_uncached(request, *args, **kwargs).data)
+        return Response(data)
+
+    def retrieve_uncached(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
@@ -0,0 +1,82 @@
+"""
+Async variants of the views, for ASGI servers:
+
+    uvicorn hrbro.asgi:application
+
+Under ASGI Django runs a sync view in a thread of its own per request, as
+many threads as requests in flight: 64 dashboards asking for statistics are
+64 computations fighting for the GIL, the memory and the database at once.
+The views wrapped by offloaded() run on a pool of ASYNC_POOL_SIZE threads
+instead. The requests above it wait on the event loop, which keeps
+accepting connections, and most of them are answered from the response
+cache filled by the first ones.
+
+The database is read from the pool thread running the view, in the same
+hop as the aggregation and the rendering. Django's async ORM would only
+move the queries to yet another thread (it is sync_to_async underneath),
+and the pagination of DRF evaluates the queryset synchronously anyway.
+"""
+import asyncio
+import contextvars
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db import close_old_connections
+from django.dispatch import receiver
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(max_workers=settings.ASYNC_POOL_SIZE, thread_name_prefix='hrapi-offload')
+        return _pool
+
+
+@receiver(setting_changed)
+def reset_pool(setting, **kwargs):
+    global _pool
+    if setting == 'ASYNC_POOL_SIZE':
+        with _pool_lock:
+            if _pool is not None:
+                _pool.shutdown(wait=False)
+            _pool = None
+
+
+def run(func, *args, **kwargs):
+    # in a pool thread, connections are handled as around a request
+    close_old_connections()
+    try:
+        return func(*args, **kwargs)
+    finally:
+        close_old_connections()
+
+
+async def offload(func, *args, **kwargs):
+    # in the context of the caller, for hrapi.instrumentation
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(pool(), functools.partial(context.run, run, func, *args, **kwargs))
+
+
+def respond(view, request, *args, **kwargs):
+    response = view(request, *args, **kwargs)
+    if hasattr(response, 'render') and callable(response.render):
+        # serializing is part of the work kept off the event loop
+        response = response.render()
+    return response
+
+
+def offloaded(view):
+    # async view answering with the response of the sync view run in the pool
+    async def async_view(request, *args, **kwargs):
+        return await offload(respond, view, request, *args, **kwargs)
+    # as csrf_exempt does, whose wrapper is sync on Django 4.2
+    async_view.csrf_exempt = getattr(view, 'csrf_exempt', False)
+    return async_view
@@ -0,0 +1,14 @@
+from rest_framework.pagination import CursorPagination
+
+
+class KeysetPagination(CursorPagination):
+    # Pages are read with WHERE id > <last id of the previous page> on the
+    # primary key index, so page 10 000 costs the same as page 1, unlike
+    # OFFSET which reads and drops every row before the page.
+    ordering = 'id'
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
+
+
+class RecentFirstPagination(KeysetPagination):
+    ordering = '-id'
@@ -0,0 +1,127 @@
+"""
+Statistics aggregated on several cores: STATS_ENGINE = 'parallel'.
+
+The employee table is split into STATS_PARALLELISM ranges of primary keys.
+A pool of as many worker processes reads a range each, with its own
+database connection, and computes the partial aggregates of the python
+engine over it (count, sum, sum of squares, min and max per group, see
+hrapi.stats.python_partials). The partials are merged into the same
+response as a single pass over the whole table would give.
+
+The pool is started on first use and kept for the life of the process. Its
+workers are spawned rather than forked: the web server process has threads
+and open connections a fork would copy. They only see committed rows, and
+an in-memory SQLite database (the tests') isn't shared with them: the
+ranges are then aggregated one after the other in the process itself.
+
+Each web server process starts a pool of its own: with the default
+STATS_PARALLELISM (os.cpu_count()), a server of 8 worker processes on 8
+cores keeps 64 more Django processes, as many connections, loaded. Lower
+STATS_PARALLELISM accordingly, or keep this engine for servers running few
+workers.
+"""
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+import multiprocessing
+import threading
+
+import django
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db import close_old_connections, connection, connections
+from django.db.models import Max, Min
+from django.dispatch import receiver
+
+from hrapi.instrumentation import timer
+from hrapi.models import Employee
+from hrapi.stats import merge, python_partials, python_results
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(
+                max_workers=settings.STATS_PARALLELISM,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=django.setup,
+            )
+        return _pool
+
+
+@receiver(setting_changed)
+def reset_pool(setting, **kwargs):
+    global _pool
+    if setting == 'STATS_PARALLELISM':
+        with _pool_lock:
+            if _pool is not None:
+                _pool.shutdown(wait=False)
+            _pool = None
+
+
+def id_ranges(parts):
+    # [low, high) ranges of ids splitting the table into parts of about the
+    # same number of rows, ids being mostly dense
+    bounds = Employee.objects.aggregate(low=Min('id'), high=Max('id'))
+    if bounds['low'] is None:
+        return []
+    low, high = bounds['low'], bounds['high'] + 1
+    step = -(-(high - low) // parts)
+    return [(start, min(start + step, high)) for start in range(low, high, step)]
+
+
+def range_partials(id_range, statistics, now):
+    return python_partials(Employee.objects.filter(id__gte=id_range[0], id__lt=id_range[1]), statistics, now)
+
+
+def database_names():
+    return {alias: connections[alias].settings_dict['NAME'] for alias in connections}
+
+
+def worker_partials(id_range, statistics, now, names):
+    # in a worker process, which loaded the settings module anew: on the
+    # databases of the process of the pool (e.g. the test databases), its
+    # connection handled as around a request
+    for alias, name in names.items():
+        if connections[alias].settings_dict['NAME'] != name:
+            connections[alias].close()
+            connections[alias].settings_dict['NAME'] = name
+    close_old_connections()
+    return range_partials(id_range, statistics, now)
+
+
+def parallel_stats(statistics=('industry', 'yoe', 'age', 'gender'), now=None, parallelism=None):
+    parallelism = parallelism or settings.STATS_PARALLELISM
+    # the same date for every range
+    now = now or datetime.now()
+    ranges = id_ranges(parallelism)
+    if not ranges:
+        return python_results(python_partials(Employee.objects.none(), statistics, now), statistics)
+    with timer('aggregate'):
+        if parallelism == 1 or connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            partials = [range_partials(id_range, statistics, now) for id_range in ranges]
+        else:
+            count = len(ranges)
+            partials = list(pool().map(
+                worker_partials, ranges, [statistics] * count, [now] * count, [database_names()] * count,
+            ))
+    return python_results(merge(partials), statistics)
+
+
+def industry_stats_parallel():
+    return parallel_stats(['industry'])['industry']
+
+
+def yoe_stats_parallel():
+    return parallel_stats(['yoe'])['yoe']
+
+
+def age_stats_parallel():
+    return parallel_stats(['age'])['age']
+
+
+def gender_stats_parallel():
+    return parallel_stats(['gender'])['gender']
@@ -0,0 +1,337 @@
+"""
+Grouped statistics compiled into a single SQL aggregate query.
+
+    StatsQuery(group_by=['industry', 'gender'],
+               metrics=[('salary', 'mean'), ('salary', 'count')],
+               filters=[('gender', 'eq', 'F'), ('age', 'gt', 40)])
+
+Dimensions, fields, aggregates and filter operators are whitelisted, the
+experience and age dimensions are bucketed with (low, high] bin edges.
+Employees outside the bins of a bucketed dimension are left out, like
+pd.cut does. The four historical statistics are presets of it, at the
+bottom of this module.
+
+Salary quantiles (salary:median, salary:p90, ...) are merged from the
+sketches stored by hrapi.summary instead of being computed by the query,
+they are available for the groupings and filters those sketches keep:
+industry, gender and unions of the YOE_BINS experience buckets.
+"""
+import re
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+
+from django.db.models import Case, Count, IntegerField, Max, Min, Q, Sum, Value, When
+from django.db.models.functions import ExtractYear
+from rest_framework.exceptions import ValidationError
+
+from hrapi.models import Employee
+from hrapi.stats import (
+    AGE_BINS, BRACKET_YOE_BINS, YOE_BINS, bucket_index,
+    format_age_stats, format_gender_stats, format_industry_stats, format_yoe_stats,
+)
+
+# public name -> model field or annotation
+FIELDS = {
+    'industry': 'industry__name',
+    'gender': 'gender',
+    'salary': 'salary',
+    'yoe': 'years_of_experience',
+    'age': 'age',
+}
+DIMENSIONS = ['industry', 'gender', 'yoe', 'age']
+BUCKETED = ['yoe', 'age']
+NUMERIC = ['salary', 'yoe', 'age']
+AGGREGATES = ['mean', 'sum', 'count', 'min', 'max']
+OPERATORS = ['eq', 'ne', 'lt', 'lte', 'gt', 'gte', 'in', 'isnull']
+# what the salary sketches are kept by
+SKETCHED = ['industry', 'gender', 'yoe']
+
+
+def quantile(aggregate):
+    # 'median' -> 0.5, 'p90' -> 0.9, None for the other aggregates
+    if aggregate == 'median':
+        return 0.5
+    match = re.fullmatch(r'p(\d{1,2}(\.\d+)?)', aggregate)
+    return float(match.group(1)) / 100 if match else None
+
+
+# ---------------------------------------------------------------------------
+# SQL expressions
+# ---------------------------------------------------------------------------
+
+def age_expression(now=None):
+    # same rule as get_age, evaluated by the database
+    now = now or datetime.now()
+    birthday_ahead = Q(date_of_birth__month__gt=now.month) | Q(
+        date_of_birth__month=now.month, date_of_birth__day__gt=now.day)
+    return Value(now.year) - ExtractYear('date_of_birth') - Case(
+        When(birthday_ahead, then=Value(1)),
+        default=Value(0),
+        output_field=IntegerField(),
+    )
+
+
+def bucket_expression(field, bins, default=None):
+    # index of the (low, high] bin holding the field, NULL below the first edge
+    whens = []
+    for index, (low, high) in enumerate(zip(bins, bins[1:])):
+        lookups = {f'{field}__gt': low}
+        if high != float('inf'):
+            lookups[f'{field}__lte'] = high
+        whens.append(When(then=Value(index), **lookups))
+    return Case(*whens, default=Value(default), output_field=IntegerField())
+
+
+def bin_label(bins, index):
+    low, high = bins[index], bins[index + 1]
+    if high == float('inf'):
+        return f'{low:g}+'
+    return f'{low:g} to {high:g}'
+
+
+def field_value(field, value):
+    # a filter value as the field holds it, ValidationError otherwise
+    try:
+        if field == 'salary':
+            value = Decimal(str(value))
+            if not value.is_finite():
+                raise InvalidOperation
+            return value
+        if field in ('yoe', 'age'):
+            return int(value)
+    except (InvalidOperation, TypeError, ValueError):
+        raise ValidationError({'filter': f"Expected a number for {field}, got '{value}'"})
+    if field == 'gender':
+        genders = [gender for gender, _ in Employee.GENDER_CHOICES]
+        if value not in genders:
+            raise ValidationError({'filter': f"Unknown gender '{value}', expected one of {genders}"})
+    return str(value)
+
+
+def filter_value(field, operator, value):
+    if operator == 'isnull':
+        return str(value).lower() in ('true', '1')
+    if operator == 'in':
+        return [field_value(field, item) for item in (value.split('|') if isinstance(value, str) else value)]
+    return field_value(field, value)
+
+
+# ---------------------------------------------------------------------------
+# Query
+# ---------------------------------------------------------------------------
+
+class StatsQuery:
+
+    def __init__(self, group_by, metrics, filters=(), yoe_bins=None, age_bins=None, now=None):
+        self.group_by = list(group_by)
+        self.metrics = list(metrics)
+        self.filters = list(filters)
+        self.bins = {'yoe': yoe_bins, 'age': age_bins}
+        self.now = now or datetime.now()
+        self.validate()
+
+    @classmethod
+    def from_params(cls, params, **defaults):
+        # ?group_by=industry,gender&metrics=salary:mean,age:max
+        # &filter=gender:eq:F,age:gt:40,industry:in:Textiles|Coal Mining
+        # &yoe_bins=0,5,10,inf&age_bins=20,40,inf
+        def split(name):
+            return [part for part in params.get(name, '').split(',') if part]
+
+        metrics = [tuple(metric.partition(':')[::2]) for metric in split('metrics')]
+
+        filters = []
+        for condition in split('filter'):
+            parts = condition.split(':', 2)
+            if len(parts) != 3:
+                raise ValidationError({'filter': f"Expected field:operator:value, got '{condition}'"})
+            filters.append(tuple(parts))
+
+        for name in ('yoe_bins', 'age_bins'):
+            if name in params:
+                try:
+                    defaults[name] = [float(edge) for edge in split(name)]
+                except ValueError:
+                    raise ValidationError({name: 'Bin edges must be numbers'})
+
+        return cls(split('group_by'), metrics, filters, **defaults)
+
+    def validate(self):
+        for dimension in self.group_by:
+            if dimension not in DIMENSIONS:
+                raise ValidationError({'group_by': f"Unknown dimension '{dimension}', expected one of {DIMENSIONS}"})
+            if dimension in BUCKETED and not self.bins[dimension]:
+                raise ValidationError({'group_by': f"Grouping by {dimension} needs {dimension}_bins"})
+        if len(set(self.group_by)) != len(self.group_by):
+            raise ValidationError({'group_by': 'A dimension can only be used once'})
+        if not self.metrics:
+            raise ValidationError({'metrics': 'At least one metric is needed'})
+        for field, aggregate in self.metrics:
+            if quantile(aggregate) is not None:
+                self.validate_quantile(field)
+            elif field not in NUMERIC or aggregate not in AGGREGATES:
+                raise ValidationError({'metrics': f"Unknown metric '{field}:{aggregate}', expected one of "
+                                                  f"{NUMERIC} with one of {AGGREGATES}, median or pNN"})
+        for field, operator, _ in self.filters:
+            if field not in FIELDS or operator not in OPERATORS:
+                raise ValidationError({'filter': f"Unknown filter '{field}:{operator}', expected "
+                                                 f"one of {list(FIELDS)} with one of {OPERATORS}"})
+        self.filters = [(field, operator, filter_value(field, operator, value))
+                        for field, operator, value in self.filters]
+        for name, bins in self.bins.items():
+            if bins is not None and (len(bins) < 2 or any(low >= high for low, high in zip(bins, bins[1:]))):
+                raise ValidationError({f'{name}_bins': 'Expected at least two increasing bin edges'})
+
+    def validate_quantile(self, field):
+        if field != 'salary':
+            raise ValidationError({'metrics': 'Quantiles are only available for the salary'})
+        if any(dimension not in SKETCHED for dimension in self.group_by):
+            raise ValidationError({'group_by': f'Salary quantiles can only be grouped by {SKETCHED}'})
+        if any(field not in SKETCHED[:2] or operator not in ('eq', 'ne', 'in', 'isnull')
+               for field, operator, _ in self.filters):
+            raise ValidationError({'filter': 'Salary quantiles can only be filtered by industry or gender'})
+        if 'yoe' in self.group_by and not set(self.bins['yoe']) <= set(YOE_BINS):
+            raise ValidationError({'yoe_bins': f'Salary quantiles need yoe_bins edges among {YOE_BINS}'})
+
+    def uses(self, name):
+        return (name in self.group_by
+                or any(field == name for field, _ in self.metrics)
+                or any(field == name for field, _, _ in self.filters))
+
+    def condition(self, field, operator, value):
+        lookup = FIELDS[field]
+        # values converted by validate()
+        if operator == 'isnull':
+            return Q(**{f'{lookup}__isnull': value})
+        if operator == 'in':
+            return Q(**{f'{lookup}__in': value})
+        if operator == 'ne':
+            return ~Q(**{lookup: value})
+        if operator == 'eq':
+            return Q(**{lookup: value})
+        return Q(**{f'{lookup}__{operator}': value})
+
+    def group_columns(self):
+        return [f'{dimension}_bucket' if dimension in BUCKETED else FIELDS[dimension]
+                for dimension in self.group_by]
+
+    def queryset(self):
+        queryset = Employee.objects.order_by()
+        if self.uses('age'):
+            queryset = queryset.annotate(age=age_expression(self.now))
+
+        buckets = {
+            f'{dimension}_bucket': bucket_expression(FIELDS[dimension], self.bins[dimension])
+            for dimension in self.group_by if dimension in BUCKETED
+        }
+        if buckets:
+            queryset = queryset.annotate(**buckets).filter(**{f'{name}__isnull': False for name in buckets})
+
+        for condition in self.filters:
+            queryset = queryset.filter(self.condition(*condition))
+
+        aggregates = {'headcount': Count('id')}
+        for field, aggregate in self.metrics:
+            # means are divided afterwards, AVG rounds decimals on SQLite
+            if aggregate in ('mean', 'sum'):
+                aggregates[f'{field}_sum'] = Sum(FIELDS[field])
+            if aggregate in ('mean', 'count'):
+                aggregates[f'{field}_count'] = Count(FIELDS[field])
+            if aggregate in ('min', 'max'):
+                aggregates[f'{field}_{aggregate}'] = {'min': Min, 'max': Max}[aggregate](FIELDS[field])
+
+        groups = self.group_columns()
+        if not groups:
+            # a constant is not grouped by, which leaves a single group
+            queryset = queryset.annotate(everyone=Value(0))
+            groups = ['everyone']
+        return queryset.values(*groups).annotate(**aggregates).order_by(*self.group_columns())
+
+    def sketches(self):
+        # {group: SalarySketch} of the groups of the query
+        from hrapi import summary
+        groups = ['yoe_bucket' if dimension == 'yoe' else FIELDS[dimension] for dimension in self.group_by]
+        filters = Q()
+        for condition in self.filters:
+            filters &= self.condition(*condition)
+        return summary.salary_sketches(
+            groups, filters, lambda bucket: bucket_index(YOE_BINS[bucket + 1], self.bins['yoe']))
+
+    def rows(self):
+        # one dict per group, bucketed dimensions hold their bin index
+        sketches = {}
+        if any(quantile(aggregate) is not None for _, aggregate in self.metrics):
+            sketches = self.sketches()
+        results = []
+        for row in self.queryset():
+            result = {
+                dimension: row[column] for dimension, column in zip(self.group_by, self.group_columns())
+            }
+            for field, aggregate in self.metrics:
+                if quantile(aggregate) is not None:
+                    sketch = sketches.get(tuple(result[dimension] for dimension in self.group_by))
+                    result[f'{field}_{aggregate}'] = sketch.quantile(quantile(aggregate)) if sketch else None
+                elif aggregate == 'mean':
+                    count = row[f'{field}_count']
+                    result[f'{field}_mean'] = float(row[f'{field}_sum']) / count if count else None
+                else:
+                    result[f'{field}_{aggregate}'] = row[f'{field}_{aggregate}']
+            results.append(result)
+        return results
+
+    def results(self):
+        # rows with readable bin labels and plain numbers
+        results = self.rows()
+        for result in results:
+            for name, value in result.items():
+                if name in BUCKETED and name in self.group_by:
+                    result[name] = bin_label(self.bins[name], value)
+                elif name not in self.group_by and value is not None and not isinstance(value, int):
+                    result[name] = float(value)
+        return results
+
+    def explain(self):
+        queryset = self.queryset()
+        return {'sql': str(queryset.query), 'plan': queryset.explain()}
+
+
+# ---------------------------------------------------------------------------
+# Presets, the statistics endpoints of the sql engine
+# ---------------------------------------------------------------------------
+
+def industry_stats_sql():
+    rows = StatsQuery(
+        group_by=['industry'],
+        metrics=[('salary', 'mean'), ('yoe', 'mean'), ('age', 'mean')],
+        filters=[('industry', 'isnull', False)],
+    ).rows()
+    return format_industry_stats(
+        {
+            'industry': row['industry'],
+            'salary': row['salary_mean'],
+            'years_of_experience': row['yoe_mean'],
+            'age': row['age_mean'],
+        }
+        for row in rows
+    )
+
+
+def yoe_stats_sql():
+    rows = StatsQuery(group_by=['yoe'], metrics=[('salary', 'mean')], yoe_bins=YOE_BINS).rows()
+    return format_yoe_stats({row['yoe']: row['salary_mean'] for row in rows})
+
+
+def age_stats_sql():
+    rows = StatsQuery(
+        group_by=['yoe', 'age'], metrics=[('salary', 'mean')],
+        yoe_bins=BRACKET_YOE_BINS, age_bins=AGE_BINS,
+    ).rows()
+    return format_age_stats({(row['yoe'], row['age']): row['salary_mean'] for row in rows})
+
+
+def gender_stats_sql():
+    rows = StatsQuery(
+        group_by=['gender', 'yoe'], metrics=[('salary', 'mean')],
+        filters=[('gender', 'isnull', False)], yoe_bins=BRACKET_YOE_BINS,
+    ).rows()
+    return format_gender_stats({(row['gender'], row['yoe']): row['salary_mean'] for row in rows})
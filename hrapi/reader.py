@@ -0,0 +1,128 @@
+"""
+Employees read from an export in chunks, whatever its size.
+
+chunks() yields DataFrames of at most size rows from a JSON array, an NDJSON
+file (one object per line) or a CSV file with a header, indexed by the
+position of the rows in the file. Only one chunk and a block of the file are
+held at a time, the values are left as read for the importer to convert.
+
+The lines of an NDJSON file that aren't JSON objects are rows of missing
+values in their chunk, listed with the reason in its attrs['unreadable']
+for the importer to reject. An element of a JSON array that isn't valid
+JSON makes the whole file unreadable, where it ends can't be told.
+"""
+import json
+import re
+
+import pandas as pd
+
+COLUMNS = ['first_name', 'last_name', 'email', 'gender', 'date_of_birth', 'industry', 'salary', 'years_of_experience']
+BLOCK_SIZE = 2 ** 20
+WHITESPACE = re.compile(r'\s*')
+# a decode error this close to the end of the buffer may come from an
+# element cut by the end of the block, e.g. in a literal such as -Infinity
+CUT_MARGIN = 16
+
+
+class Unreadable:
+    # an element of the file which isn't an object, as read
+
+    def __init__(self, text, reason):
+        self.text = text
+        self.reason = reason
+
+
+def file_format(path):
+    # by extension, else by the first character of the file
+    if path.lower().endswith('.csv'):
+        return 'csv'
+    if path.lower().endswith(('.ndjson', '.jsonl')):
+        return 'ndjson'
+    with open(path) as file:
+        start = file.read(BLOCK_SIZE).lstrip()
+    return 'json' if start.startswith('[') else 'ndjson'
+
+
+def json_records(file):
+    # the objects of a JSON array, decoded one at a time from blocks of the file
+    decoder = json.JSONDecoder()
+    buffer, position, started = '', 0, False
+    while True:
+        position = WHITESPACE.match(buffer, position).end()
+        if position == len(buffer):
+            block = file.read(BLOCK_SIZE)
+            if not block:
+                raise ValueError("Unexpected end of the JSON array")
+            buffer, position = block, 0
+            continue
+        character = buffer[position]
+        if not started:
+            if character != '[':
+                raise ValueError("Expected a JSON array")
+            started, position = True, position + 1
+        elif character == ']':
+            return
+        elif character == ',':
+            position += 1
+        else:
+            try:
+                record, position = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError as exc:
+                cut = exc.msg.startswith('Unterminated string') or exc.pos >= len(buffer) - CUT_MARGIN
+                block = file.read(BLOCK_SIZE) if cut else ''
+                if not block:
+                    raise ValueError(f"Invalid JSON array: {exc}") from exc
+                # an object cut by the end of the block
+                buffer, position = buffer[position:] + block, 0
+                continue
+            yield record
+
+
+def ndjson_records(file):
+    for line in file:
+        if line.strip():
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError as exc:
+                yield Unreadable(line.rstrip('\n'), f'invalid JSON: {exc}')
+
+
+def record_chunks(records, size):
+    chunk, start = [], 0
+    for record in records:
+        chunk.append(record)
+        if len(chunk) == size:
+            yield frame(chunk, start)
+            chunk, start = [], start + size
+    if chunk:
+        yield frame(chunk, start)
+
+
+def frame(records, start):
+    unreadable = {}
+    for offset, record in enumerate(records):
+        if not isinstance(record, dict):
+            if not isinstance(record, Unreadable):
+                record = Unreadable(json.dumps(record), 'not a JSON object')
+            unreadable[start + offset] = record
+            records[offset] = {}
+    df = pd.DataFrame.from_records(records, columns=COLUMNS)
+    df.index = pd.RangeIndex(start, start + len(df))
+    df.attrs['unreadable'] = unreadable
+    return df
+
+
+def chunks(path, size):
+    kind = file_format(path)
+    if kind == 'csv':
+        # the values are kept as text, an empty field is missing
+        reader = pd.read_csv(
+            path, chunksize=size, dtype=str, keep_default_na=False, na_values=[''],
+            usecols=lambda column: column in COLUMNS,
+        )
+        with reader:
+            for df in reader:
+                yield df.reindex(columns=COLUMNS)
+        return
+    with open(path) as file:
+        yield from record_chunks(json_records(file) if kind == 'json' else ndjson_records(file), size)
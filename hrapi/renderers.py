@@ -0,0 +1,99 @@
+import csv
+import io
+
+import orjson
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+from hrapi.instrumentation import timer
+
+
+class FastJSONRenderer(JSONRenderer):
+    # The bytes of JSONRenderer, encoded by orjson. Dates and times go
+    # through the DRF encoder (orjson formats them differently), like the
+    # types orjson doesn't know. Only float exponents differ, 1e+16 is 1e16.
+    # Indented output (Accept: application/json; indent=4) is left to DRF.
+    options = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        with timer('serialize'):
+            return self.encode(data, accepted_media_type, renderer_context)
+
+    def encode(self, data, accepted_media_type, renderer_context):
+        if data is None:
+            return b''
+        if self.get_indent(accepted_media_type, renderer_context or {}) is not None \
+                or not self.compact or self.ensure_ascii:
+            return super().render(data, accepted_media_type, renderer_context)
+        try:
+            content = orjson.dumps(data, default=self.encoder_class().default, option=self.options)
+        except orjson.JSONEncodeError:
+            # e.g. integers over 64 bits
+            return super().render(data, accepted_media_type, renderer_context)
+        # like JSONRenderer, for the JavaScript parsers of the browsable API
+        return content.replace('\u2028'.encode(), b'\\u2028').replace('\u2029'.encode(), b'\\u2029')
+
+
+class ColumnarRenderer(FastJSONRenderer):
+    # ?format=columnar, for the lists built with columnar()
+    media_type = 'application/vnd.hrbro.columnar+json'
+    format = 'columnar'
+
+
+def columnar(rows, columns):
+    # {"columns": [...], "data": {column: [values, ...]}}, the keys are sent
+    # once instead of once per row
+    return {'columns': columns, 'data': {column: [row[column] for row in rows] for column in columns}}
+
+
+class RowStreamRenderer(BaseRenderer):
+    # Renders (columns, rows) where rows is an iterable of tuples, either at
+    # once with render() or lazily with stream() for StreamingHttpResponse
+    charset = 'utf-8'
+    rows_per_chunk = 500
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if isinstance(data, dict):
+            # error responses, e.g. {"detail": "..."}
+            return b''.join(self.stream(list(data), [tuple(data.values())]))
+        return b''.join(self.stream(*data))
+
+    def stream(self, columns, rows):
+        raise NotImplementedError
+
+    def chunks(self, rows):
+        chunk = []
+        for row in rows:
+            chunk.append(row)
+            if len(chunk) == self.rows_per_chunk:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+
+class NDJSONRenderer(RowStreamRenderer):
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+
+    def stream(self, columns, rows):
+        encoder = JSONEncoder(ensure_ascii=False)
+        for chunk in self.chunks(rows):
+            yield ''.join(encoder.encode(dict(zip(columns, row))) + '\n' for row in chunk).encode(self.charset)
+
+
+class CSVRenderer(RowStreamRenderer):
+    media_type = 'text/csv'
+    format = 'csv'
+
+    def stream(self, columns, rows):
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(columns)
+        for chunk in self.chunks(rows):
+            writer.writerows(chunk)
+            yield buffer.getvalue().encode(self.charset)
+            buffer.seek(0)
+            buffer.truncate()
+        if buffer.tell():
+            yield buffer.getvalue().encode(self.charset)
@@ -0,0 +1,173 @@
+"""
+Reads on the read replicas of the default database.
+
+The ORM reads of GET, HEAD and OPTIONS requests (the statistics, the list
+and detail of the viewsets) go to one of the DATABASE_REPLICAS, chosen
+once per request. Everything else stays on the primary:
+
+- writes, and the reads of a request after it wrote
+- the requests of other methods, management commands, the shell
+- the reads of a client for REPLICA_PIN_SECONDS after it wrote: a request
+  writing answers with a cookie holding the time, which the following
+  requests of the client send back. Clients keeping cookies see their
+  writes. REPLICA_PIN_SECONDS must be longer than the replication lag.
+- the reads filling a cache shared by every client (the statistics of
+  hrapi.caching, the details of hrapi.objectcache) for REPLICA_PIN_SECONDS
+  after a write of any client, see pin_after_write(): they aren't cached
+  under the new generation from a replica that hasn't received it yet.
+- the replicas lagging more than REPLICA_MAX_LAG seconds (PostgreSQL,
+  checked every REPLICA_LAG_CHECK_INTERVAL seconds per process) or not
+  answering
+
+Raw SQL on django.db.connection is not routed, it runs on the primary.
+"""
+import contextvars
+import random
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+
+from hrapi.caching import last_write
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+REPLICA_LAG_CHECK_INTERVAL = 5
+# time.time() of the last write of the client
+WRITE_COOKIE = 'hrapi_last_write'
+
+# the ReplicaState of the request being handled
+current = contextvars.ContextVar('hrapi_replicas', default=None)
+
+# replica alias -> (time of the check, lag in seconds or None when unreachable)
+lags = {}
+
+
+class ReplicaState:
+
+    def __init__(self, safe=True, written=None):
+        self.safe = safe
+        self.written = written   # last write of the client
+        self.alias = None
+        self.pinned = False      # the request wrote
+
+
+def recent(written):
+    return written is not None and time.time() - written < settings.REPLICA_PIN_SECONDS
+
+
+def client_write(request):
+    try:
+        return float(request.COOKIES[WRITE_COOKIE])
+    except (KeyError, ValueError):
+        return None
+
+
+def replication_lag(alias):
+    # seconds behind the primary, 0 when every change received is replayed
+    connection = connections[alias]
+    if connection.vendor != 'postgresql':
+        return 0.0
+    with connection.cursor() as cursor:
+        cursor.execute("""
+            SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+                        ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) END
+        """)
+        return float(cursor.fetchone()[0])
+
+
+def lag(alias):
+    checked, value = lags.get(alias, (None, None))
+    if checked is None or time.monotonic() - checked > REPLICA_LAG_CHECK_INTERVAL:
+        try:
+            value = replication_lag(alias)
+        except DatabaseError:
+            value = None
+        lags[alias] = (time.monotonic(), value)
+    return value
+
+
+def healthy_replicas():
+    if settings.REPLICA_MAX_LAG is None:
+        return list(settings.DATABASE_REPLICAS)
+    return [
+        alias for alias in settings.DATABASE_REPLICAS
+        if (value := lag(alias)) is not None and value <= settings.REPLICA_MAX_LAG
+    ]
+
+
+def read_alias(state):
+    if state.alias is None:
+        if recent(state.written):
+            state.alias = DEFAULT_DB_ALIAS
+        else:
+            state.alias = random.choice(healthy_replicas() or [DEFAULT_DB_ALIAS])
+    return state.alias
+
+
+def pin_after_write():
+    # the reads of the request that follow stay on the primary when anyone
+    # wrote less than REPLICA_PIN_SECONDS ago
+    state = current.get()
+    if state is not None and not state.pinned and recent(last_write()):
+        state.alias = DEFAULT_DB_ALIAS
+
+
+class ReplicaRouter:
+
+    def db_for_read(self, model, **hints):
+        state = current.get()
+        if state is None or not state.safe or state.pinned or not settings.DATABASE_REPLICAS:
+            return DEFAULT_DB_ALIAS
+        return read_alias(state)
+
+    def db_for_write(self, model, **hints):
+        state = current.get()
+        if state is not None:
+            state.pinned = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # the replicas hold the same rows
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # they are migrated by replication
+        return db not in settings.DATABASE_REPLICAS
+
+
+class ReplicaMiddleware:
+    # requests of a safe method may read from the replicas, the requests
+    # writing pin the reads of their client
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        state = ReplicaState(request.method in SAFE_METHODS, client_write(request))
+        token = current.set(state)
+        try:
+            return self.remember_write(state, self.get_response(request))
+        finally:
+            current.reset(token)
+
+    async def __acall__(self, request):
+        state = ReplicaState(request.method in SAFE_METHODS, client_write(request))
+        token = current.set(state)
+        try:
+            return self.remember_write(state, await self.get_response(request))
+        finally:
+            current.reset(token)
+
+    def remember_write(self, state, response):
+        if state.pinned:
+            response.set_cookie(
+                WRITE_COOKIE, repr(time.time()), max_age=settings.REPLICA_PIN_SECONDS, httponly=True, samesite='Lax',
+            )
+        return response
@@ -1,5 +1,6 @@
 from rest_framework import serializers
-from .models import Industry, Employee
+from .instrumentation import timer
+from .models import Industry, Employee, Job
 
 
 class IndustrySerializer(serializers.ModelSerializer):
@@ -12,3 +13,65 @@ class EmployeeSerializer(serializers.ModelSerializer):
     class Meta:
         model = Employee
         fields = '__all__'
+
+
+class EmployeeReadSerializer:
+    # Read only twin of EmployeeSerializer for the list and detail views,
+    # building the same dicts from values() rows. Only the fields whose
+    # representation differs from the database value (salary, date of birth)
+    # go through their DRF field, None is kept as is like DRF does.
+    #
+    #   EmployeeReadSerializer(queryset.values(*EmployeeReadSerializer.fields()), many=True).data
+
+    _converters = None
+
+    def __init__(self, rows, many=False):
+        self.rows = rows
+        self.many = many
+
+    @classmethod
+    def converters(cls):
+        if cls._converters is None:
+            cls._converters = {
+                name: field.to_representation
+                for name, field in EmployeeSerializer().fields.items()
+                if isinstance(field, (serializers.DecimalField, serializers.DateField))
+            }
+        return cls._converters
+
+    @classmethod
+    def fields(cls, requested=None):
+        # in the order of EmployeeSerializer, relations hold their pk. Or the
+        # ones of ?fields=first_name,salary in their order, after the id
+        # which is always there (the pagination cursor is made of it)
+        names = list(EmployeeSerializer().fields)
+        if not requested:
+            return names
+        requested = [name for name in requested.split(',') if name]
+        unknown = [name for name in requested if name not in names]
+        if unknown:
+            raise serializers.ValidationError(
+                {'fields': f"Unknown fields {', '.join(unknown)}, expected some of {', '.join(names)}"})
+        return ['id', *dict.fromkeys(name for name in requested if name != 'id')]
+
+    @property
+    def data(self):
+        rows = self.rows if self.many else [self.rows]
+        columns = rows[0].keys() if rows else ()
+        converters = [(name, convert) for name, convert in self.converters().items() if name in columns]
+        with timer('serialize'):
+            for row in rows:
+                for name, convert in converters:
+                    if row[name] is not None:
+                        row[name] = convert(row[name])
+        return rows if self.many else rows[0]
+
+
+class JobSerializer(serializers.ModelSerializer):
+    # the parameters stay private, an import's are a path on the server
+    class Meta:
+        model = Job
+        fields = [
+            'id', 'kind', 'status', 'processed', 'total', 'result', 'error', 'attempts',
+            'created_at', 'started_at', 'finished_at',
+        ]
@@ -0,0 +1,69 @@
+"""
+Mergeable quantile sketch of salaries, in the style of DDSketch.
+
+Salaries are counted in logarithmic buckets: bucket k holds the values in
+(GAMMA ** (k - 1), GAMMA ** k]. Every value of a bucket is estimated by the
+same number, within RELATIVE_ACCURACY of all of them, so that a quantile is
+always within 1% of one of the two salaries numpy.percentile interpolates
+between. Unlike t-digest or KLL sketches, counts can be decremented as well
+as incremented, which is what the summary tables need on updates and
+deletes, and merging two sketches is adding their counts.
+
+A salary range of 30k to 300k spans about 115 buckets.
+"""
+import math
+from collections import defaultdict
+
+RELATIVE_ACCURACY = 0.01
+GAMMA = (1 + RELATIVE_ACCURACY) / (1 - RELATIVE_ACCURACY)
+LOG_GAMMA = math.log(GAMMA)
+
+# bucket of the values <= 0, estimated as 0
+ZERO_KEY = -2 ** 31
+
+
+def sketch_key(value):
+    value = float(value)
+    if value <= 0:
+        return ZERO_KEY
+    return math.ceil(math.log(value) / LOG_GAMMA)
+
+
+def key_value(key):
+    if key == ZERO_KEY:
+        return 0.0
+    return 2 * GAMMA ** key / (GAMMA + 1)
+
+
+class SalarySketch:
+
+    def __init__(self, counts=None):
+        self.counts = defaultdict(int)
+        for key, count in (counts or {}).items():
+            self.counts[key] += count
+
+    def add(self, value, count=1):
+        self.counts[sketch_key(value)] += count
+
+    def merge(self, other):
+        for key, count in other.counts.items():
+            self.counts[key] += count
+        return self
+
+    @property
+    def count(self):
+        return sum(self.counts.values())
+
+    def quantile(self, q):
+        # the bucket holding the value of rank floor(q * (n - 1)),
+        # None for an empty sketch
+        count = self.count
+        if count <= 0:
+            return None
+        rank = q * (count - 1)
+        seen = 0
+        for key in sorted(self.counts):
+            seen += self.counts[key]
+            if seen > rank:
+                return key_value(key)
+        return key_value(max(self.counts))
@@ -0,0 +1,245 @@
+"""
+Columnar snapshot of the employee table, shared by every worker process.
+
+The snapshot is a directory of .npy files, one compact array per column,
+named after the employee and industry generation tokens (hrapi.caching).
+Workers memory-map it read-only, so the operating system keeps a single
+copy in its page cache. When a write changes a token, the first worker
+that needs the snapshot rebuilds it under a file lock while the others
+wait for it, then everyone maps the new directory. Every write costs a
+rebuild of the whole table, the engine suits tables read much more often
+than written.
+
+A superseded snapshot is removed by a later build, GRACE_SECONDS after it
+was superseded at the earliest, so that a worker about to map it still
+finds it. A worker finding it gone all the same looks for the current one
+again.
+"""
+import fcntl
+import json
+import os
+import shutil
+import tempfile
+import time
+from datetime import date, datetime
+from decimal import Decimal
+from pathlib import Path
+
+import numpy as np
+from django.conf import settings
+
+from hrapi.caching import generation
+from hrapi.models import Employee, Industry
+from hrapi.stats import (
+    AGE_BINS, BRACKET_YOE_BINS, YOE_BINS, mean,
+    format_age_stats, format_gender_stats, format_industry_stats, format_yoe_stats,
+)
+
+EPOCH = date(1970, 1, 1).toordinal()
+GENDERS = [code for code, _ in Employee.GENDER_CHOICES]
+
+# name, dtype. Missing industries and genders are coded -1
+COLUMNS = [
+    ('id', np.int64),
+    ('salary_cents', np.int64),
+    ('date_of_birth', np.int32),   # days since 1970-01-01
+    ('birth_year', np.int16),      # derived from date_of_birth, for ages
+    ('birthday', np.int16),        # month * 100 + day
+    ('years_of_experience', np.int16),
+    ('industry', np.int16),        # index in the industries dictionary
+    ('gender', np.int8),           # index in GENDERS
+]
+
+_loaded = {'name': None, 'snapshot': None}
+
+GRACE_SECONDS = 60
+
+
+class Snapshot:
+
+    def __init__(self, path):
+        self.path = path
+        self.columns = {
+            name: np.load(path / f'{name}.npy', mmap_mode='r') for name, _ in COLUMNS
+        }
+        with open(path / 'dictionary.json') as dictionary:
+            self.industries = json.load(dictionary)['industries']
+
+    def __len__(self):
+        return len(self.columns['id'])
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+
+def snapshot_name():
+    return f"{generation('employee')}-{generation('industry')}"
+
+
+def get_snapshot(attempts=3):
+    name = snapshot_name()
+    if _loaded['name'] == name:
+        return _loaded['snapshot']
+    directory = Path(settings.STATS_SNAPSHOT_DIR)
+    for attempt in range(attempts):
+        path = directory / name
+        if not path.exists():
+            directory.mkdir(parents=True, exist_ok=True)
+            with open(directory / 'lock', 'w') as lock:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+                if not path.exists():
+                    build(path)
+        try:
+            _loaded['snapshot'] = Snapshot(path)
+        except FileNotFoundError:
+            # removed in between, long superseded
+            if attempt == attempts - 1:
+                raise
+            name = snapshot_name()
+        else:
+            _loaded['name'] = name
+            return _loaded['snapshot']
+
+
+def build(path, chunk_size=10000):
+    # streamed from the database in chunks, written next to the final
+    # directory and renamed into place once complete
+    industries = list(Industry.objects.order_by('id').values_list('id', 'name'))
+    industry_codes = {pk: code for code, (pk, _) in enumerate(industries)}
+    gender_codes = {gender: code for code, gender in enumerate(GENDERS)}
+
+    chunks = {name: [] for name, _ in COLUMNS}
+    rows = Employee.objects.order_by('id').values_list(
+        'id', 'salary', 'date_of_birth', 'years_of_experience', 'industry_id', 'gender',
+    ).iterator(chunk_size=chunk_size)
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == chunk_size:
+            add_chunk(chunks, batch, industry_codes, gender_codes)
+            batch = []
+    if batch:
+        add_chunk(chunks, batch, industry_codes, gender_codes)
+
+    building = Path(tempfile.mkdtemp(prefix='.building-', dir=path.parent))
+    for name, dtype in COLUMNS:
+        column = np.concatenate(chunks[name]) if chunks[name] else np.empty(0, dtype=dtype)
+        np.save(building / f'{name}.npy', column)
+    with open(building / 'dictionary.json', 'w') as dictionary:
+        json.dump({'industries': [name for _, name in industries], 'genders': GENDERS}, dictionary)
+    os.rename(building, path)
+
+    # the snapshots superseded for long enough can go, processes still
+    # mapping them keep their pages until they move on to this one
+    for old in path.parent.iterdir():
+        if old.is_dir() and old != path:
+            superseded = old / 'superseded'
+            if not superseded.exists():
+                superseded.touch()
+            elif time.time() - superseded.stat().st_mtime > GRACE_SECONDS:
+                shutil.rmtree(old, ignore_errors=True)
+
+
+def add_chunk(chunks, rows, industry_codes, gender_codes):
+    ids, salaries, dates, years, industries, genders = zip(*rows)
+    chunks['id'].append(np.array(ids, dtype=np.int64))
+    chunks['salary_cents'].append(np.array([int(salary * 100) for salary in salaries], dtype=np.int64))
+    chunks['date_of_birth'].append(np.array([day.toordinal() - EPOCH for day in dates], dtype=np.int32))
+    chunks['birth_year'].append(np.array([day.year for day in dates], dtype=np.int16))
+    chunks['birthday'].append(np.array([day.month * 100 + day.day for day in dates], dtype=np.int16))
+    chunks['years_of_experience'].append(np.array(years, dtype=np.int16))
+    chunks['industry'].append(np.array([industry_codes.get(pk, -1) for pk in industries], dtype=np.int16))
+    chunks['gender'].append(np.array([gender_codes.get(gender, -1) for gender in genders], dtype=np.int8))
+
+
+# ---------------------------------------------------------------------------
+# Aggregations on the arrays
+# ---------------------------------------------------------------------------
+
+def buckets(values, bins):
+    # index of the (low, high] bin holding each value, -1 below the first edge
+    return np.searchsorted(np.asarray(bins[:-1]), values, side='left') - 1
+
+
+def ages(snapshot, now=None):
+    # same rule as get_age
+    now = now or datetime.now()
+    birthday_ahead = snapshot['birthday'] > now.month * 100 + now.day
+    return now.year - snapshot['birth_year'].astype(np.int32) - birthday_ahead
+
+
+def group_sums(groups, values, size):
+    # exact integer sums per group. bincount adds float64 weights, so values
+    # are split in two parts whose sums stay below 2**53 for 2**27 rows
+    low = np.bincount(groups, weights=values & 0x3FFFFFF, minlength=size)
+    high = np.bincount(groups, weights=values >> 26, minlength=size)
+    return [int(h) * 2 ** 26 + int(lo) for h, lo in zip(high, low)]
+
+
+def group_salaries(groups, salary_cents, size):
+    # {group: mean salary} for the groups holding someone
+    counts = np.bincount(groups, minlength=size)
+    totals = group_sums(groups, salary_cents, size)
+    return {
+        group: mean(Decimal(totals[group]) / 100, int(counts[group]))
+        for group in range(size) if counts[group]
+    }
+
+
+def industry_stats_snapshot():
+    snapshot = get_snapshot()
+    keep = snapshot['industry'] >= 0
+    industries = snapshot['industry'][keep].astype(np.intp)
+    size = len(snapshot.industries)
+    counts = np.bincount(industries, minlength=size)
+    salaries = group_salaries(industries, snapshot['salary_cents'][keep], size)
+    experience = group_sums(industries, snapshot['years_of_experience'][keep].astype(np.int64), size)
+    age = group_sums(industries, ages(snapshot)[keep].astype(np.int64), size)
+    return format_industry_stats(
+        {
+            'industry': snapshot.industries[code],
+            'salary': salaries[code],
+            'years_of_experience': mean(experience[code], int(counts[code])),
+            'age': mean(age[code], int(counts[code])),
+        }
+        for code in range(size) if counts[code]
+    )
+
+
+def yoe_stats_snapshot():
+    snapshot = get_snapshot()
+    brackets = buckets(snapshot['years_of_experience'], YOE_BINS)
+    keep = brackets >= 0
+    return format_yoe_stats(group_salaries(
+        brackets[keep], snapshot['salary_cents'][keep], len(YOE_BINS) - 1))
+
+
+def age_stats_snapshot():
+    snapshot = get_snapshot()
+    years = buckets(snapshot['years_of_experience'], BRACKET_YOE_BINS)
+    age = buckets(ages(snapshot), AGE_BINS)
+    keep = (years >= 0) & (age >= 0)
+    age_brackets = len(AGE_BINS) - 1
+    salaries = group_salaries(
+        years[keep] * age_brackets + age[keep], snapshot['salary_cents'][keep],
+        (len(BRACKET_YOE_BINS) - 1) * age_brackets,
+    )
+    return format_age_stats({
+        divmod(group, age_brackets): salary for group, salary in salaries.items()
+    })
+
+
+def gender_stats_snapshot():
+    snapshot = get_snapshot()
+    years = buckets(snapshot['years_of_experience'], BRACKET_YOE_BINS)
+    keep = (years >= 0) & (snapshot['gender'] >= 0)
+    year_brackets = len(BRACKET_YOE_BINS) - 1
+    salaries = group_salaries(
+        snapshot['gender'][keep].astype(np.intp) * year_brackets + years[keep],
+        snapshot['salary_cents'][keep], len(GENDERS) * year_brackets,
+    )
+    response_data = {}
+    for group, salary in salaries.items():
+        gender, years = divmod(group, year_brackets)
+        response_data[(GENDERS[gender], years)] = salary
+    return format_gender_stats(response_data)
@@ -0,0 +1,423 @@
+from datetime import datetime
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+from hrapi.instrumentation import timer
+from hrapi.models import Employee
+
+
+# Bin edges are exclusive on the left side and inclusive on the right side,
+# like pd.cut : someone with exactly 5 years of experience falls into 1-5
+YOE_BINS = [0, 5, 10, 15, 20, 25, 30, float('inf')]
+YOE_LABELS = ['1-5', '5-10', '10-15', '15-20', '20-25', '25-30', 'More than 30']
+
+# agestats and genderstats use coarser experience bins
+BRACKET_YOE_BINS = [0, 5, 10, 15, 20, 30, float('inf')]
+AGE_BINS = [20, 30, 40, 50, float('inf')]
+
+# STATS_ENGINE setting -> implementation of each statistic
+STATS_ENGINES = {
+    'snapshot': {
+        'industry': 'hrapi.snapshot.industry_stats_snapshot',
+        'yoe': 'hrapi.snapshot.yoe_stats_snapshot',
+        'age': 'hrapi.snapshot.age_stats_snapshot',
+        'gender': 'hrapi.snapshot.gender_stats_snapshot',
+    },
+    'summary': {
+        'industry': 'hrapi.summary.industry_stats_summary',
+        'yoe': 'hrapi.summary.yoe_stats_summary',
+        # the age brackets need exact ages, which the summary cells don't have
+        'age': 'hrapi.query.age_stats_sql',
+        'gender': 'hrapi.summary.gender_stats_summary',
+    },
+    'sql': {
+        'industry': 'hrapi.query.industry_stats_sql',
+        'yoe': 'hrapi.query.yoe_stats_sql',
+        'age': 'hrapi.query.age_stats_sql',
+        'gender': 'hrapi.query.gender_stats_sql',
+    },
+    'pandas': {
+        'industry': 'hrapi.stats.industry_stats_pandas',
+        'yoe': 'hrapi.stats.yoe_stats_pandas',
+        'age': 'hrapi.stats.age_stats_pandas',
+        'gender': 'hrapi.stats.gender_stats_pandas',
+    },
+    'python': {
+        'industry': 'hrapi.stats.industry_stats_python',
+        'yoe': 'hrapi.stats.yoe_stats_python',
+        'age': 'hrapi.stats.age_stats_python',
+        'gender': 'hrapi.stats.gender_stats_python',
+    },
+    'parallel': {
+        'industry': 'hrapi.parallel.industry_stats_parallel',
+        'yoe': 'hrapi.parallel.yoe_stats_parallel',
+        'age': 'hrapi.parallel.age_stats_parallel',
+        'gender': 'hrapi.parallel.gender_stats_parallel',
+    },
+}
+
+
+def compute_stats(statistic, engine=None):
+    engine = engine or settings.STATS_ENGINE
+    with timer('stats'):
+        return import_string(STATS_ENGINES[engine][statistic])()
+
+
+def get_age(date_of_birth, now=None):
+    now = now or datetime.now()
+    age = now.year - date_of_birth.year - ((now.month, now.day) < (date_of_birth.month, date_of_birth.day))
+    return age
+
+
+def prettify_brackets(bracket_str):
+    pretty_bracket = bracket_str.replace('(', '').replace(']', '').replace(',', ' to').replace('to inf', '+')
+    return pretty_bracket
+
+
+def interval_str(bins, index):
+    # same text as str() of the pandas Interval produced by pd.cut,
+    # the edges are floats because the bins contain inf
+    return f"({float(bins[index])}, {float(bins[index + 1])}]"
+
+
+def np_round(value, decimals):
+    # rounding the way numpy/pandas do it (scale, round half to even, unscale),
+    # which sometimes differs from the builtin round on the last digit
+    scale = 10 ** decimals
+    return round(float(value) * scale) / scale
+
+
+def mean(total, count):
+    if not count:
+        return None
+    return float(total) / count
+
+
+def bucket_index(value, bins):
+    # index of the (low, high] bin holding the value, None outside the bins
+    for index, (low, high) in enumerate(zip(bins, bins[1:])):
+        if low < value <= high:
+            return index
+    return None
+
+
+# ---------------------------------------------------------------------------
+# Formatting, shared by every implementation
+# ---------------------------------------------------------------------------
+
+def format_industry_stats(rows):
+    # rows : dicts with industry and the mean salary, years_of_experience, age
+    industry_stats = []
+    for row in sorted(rows, key=lambda r: r['industry']):
+        industry_stats.append({
+            'industry': row['industry'],
+            # rounding happen after calculation for more accuracy
+            'salary': np_round(row['salary'], 2),
+            'years_of_experience': np_round(row['years_of_experience'], 2),
+            'age': np_round(row['age'], 1),
+        })
+    industry_stats.sort(key=lambda r: r['salary'], reverse=True)
+    return industry_stats
+
+
+def format_yoe_stats(salaries):
+    # salaries : {YOE_BINS index: mean salary}, empty brackets are null
+    response_data = []
+    for index, label in enumerate(YOE_LABELS):
+        salary = salaries.get(index)
+        response_data.append({
+            'experience_bracket': label,
+            'salary': np_round(salary, 2) if salary is not None else None,
+        })
+    return response_data
+
+
+def format_age_stats(salaries):
+    # salaries : {(BRACKET_YOE_BINS index, AGE_BINS index): mean salary}
+    response_data = {}
+    if not salaries:
+        return response_data
+    for years in range(len(BRACKET_YOE_BINS) - 1):
+        years_str = prettify_brackets(interval_str(BRACKET_YOE_BINS, years)) + ' years of experience'
+        response_data[years_str] = {}
+        for age in range(len(AGE_BINS) - 1):
+            age_str = prettify_brackets(interval_str(AGE_BINS, age)) + ' years old'
+            salary = salaries.get((years, age))
+            response_data[years_str][age_str] = round(float(salary), 2) if salary is not None else None
+    return response_data
+
+
+def format_gender_stats(salaries):
+    # salaries : {(gender, BRACKET_YOE_BINS index): mean salary}
+    response_data = {}
+    for gender in sorted({gender for gender, _ in salaries}):
+        response_data[gender] = [
+            {
+                # just for the eyes
+                'years_of_experience': interval_str(BRACKET_YOE_BINS, years)
+                .replace('(', '').replace(']', '').replace(',', ' to'),
+                'salary': salaries.get((gender, years)),
+            }
+            for years in range(len(BRACKET_YOE_BINS) - 1)
+        ]
+    return response_data
+
+
+# ---------------------------------------------------------------------------
+# Plain Python implementation: one pass over the rows, no pandas nor numpy
+# to load, for small tables. The pass produces partial aggregates which
+# merge, hrapi.parallel computes them over ranges of the table at once.
+# ---------------------------------------------------------------------------
+
+# [count, sum, sum of squares, min, max] of the values of a group
+COUNT, SUM, SQUARES, MIN, MAX = range(5)
+
+
+def add(totals, group, value):
+    total = totals.get(group)
+    if total is None:
+        totals[group] = [1, value, value * value, value, value]
+        return
+    total[COUNT] += 1
+    total[SUM] += value
+    total[SQUARES] += value * value
+    if value < total[MIN]:
+        total[MIN] = value
+    elif value > total[MAX]:
+        total[MAX] = value
+
+
+def merge(partials):
+    # the partials of python_partials() as one, the same as computed over
+    # all their rows at once
+    merged = {}
+    for partial in partials:
+        for key, groups in partial.items():
+            totals = merged.setdefault(key, {})
+            for group, other in groups.items():
+                total = totals.get(group)
+                if total is None:
+                    totals[group] = list(other)
+                    continue
+                total[COUNT] += other[COUNT]
+                total[SUM] += other[SUM]
+                total[SQUARES] += other[SQUARES]
+                total[MIN] = min(total[MIN], other[MIN])
+                total[MAX] = max(total[MAX], other[MAX])
+    return merged
+
+
+def group_means(totals):
+    # {group: totals} -> {group: mean}
+    return {group: mean(total[SUM], total[COUNT]) for group, total in totals.items()}
+
+
+def python_partials(queryset=None, statistics=('industry', 'yoe', 'age', 'gender'), now=None):
+    # {(statistic, field): {group: totals of the field}} of the statistics
+    # asked for, with the ages of the employees on the date of now
+    queryset = Employee.objects.all() if queryset is None else queryset
+    now = now or datetime.now()
+    industry_salary, industry_years, industry_age, yoe, age, gender = {}, {}, {}, {}, {}, {}
+    rows = queryset.values_list('industry__name', 'gender', 'salary', 'years_of_experience', 'date_of_birth')
+    for industry_name, gender_name, salary, years, date_of_birth in rows.iterator():
+        employee_age = get_age(date_of_birth, now)
+        if 'industry' in statistics and industry_name is not None:
+            add(industry_salary, industry_name, salary)
+            add(industry_years, industry_name, years)
+            add(industry_age, industry_name, employee_age)
+        if 'yoe' in statistics and (index := bucket_index(years, YOE_BINS)) is not None:
+            add(yoe, index, salary)
+        bracket = bucket_index(years, BRACKET_YOE_BINS)
+        if bracket is None:
+            continue
+        if 'age' in statistics and (index := bucket_index(employee_age, AGE_BINS)) is not None:
+            add(age, (bracket, index), salary)
+        if 'gender' in statistics and gender_name is not None:
+            add(gender, (gender_name, bracket), salary)
+
+    partial = {}
+    if 'industry' in statistics:
+        partial.update({
+            ('industry', 'salary'): industry_salary,
+            ('industry', 'years_of_experience'): industry_years,
+            ('industry', 'age'): industry_age,
+        })
+    for statistic, totals in (('yoe', yoe), ('age', age), ('gender', gender)):
+        if statistic in statistics:
+            partial[statistic, 'salary'] = totals
+    return partial
+
+
+def python_results(partial, statistics=('industry', 'yoe', 'age', 'gender')):
+    # the responses of the statistics from their partial aggregates
+    def industry():
+        salaries, years, ages = (
+            group_means(partial['industry', field]) for field in ('salary', 'years_of_experience', 'age')
+        )
+        return format_industry_stats(
+            {'industry': name, 'salary': salary, 'years_of_experience': years[name], 'age': ages[name]}
+            for name, salary in salaries.items()
+        )
+
+    results = {
+        'industry': industry,
+        'yoe': lambda: format_yoe_stats(group_means(partial['yoe', 'salary'])),
+        'age': lambda: format_age_stats(group_means(partial['age', 'salary'])),
+        'gender': lambda: format_gender_stats(group_means(partial['gender', 'salary'])),
+    }
+    return {statistic: results[statistic]() for statistic in statistics}
+
+
+def python_stats(queryset=None, statistics=('industry', 'yoe', 'age', 'gender'), now=None):
+    # the statistics asked for, in one pass over the rows, with the ages
+    # of the employees on the date of now (today by default)
+    return python_results(python_partials(queryset, statistics, now), statistics)
+
+
+def industry_stats_python(queryset=None):
+    return python_stats(queryset, ['industry'])['industry']
+
+
+def yoe_stats_python(queryset=None):
+    return python_stats(queryset, ['yoe'])['yoe']
+
+
+def age_stats_python(queryset=None):
+    return python_stats(queryset, ['age'])['age']
+
+
+def gender_stats_python(queryset=None):
+    return python_stats(queryset, ['gender'])['gender']
+
+
+# ---------------------------------------------------------------------------
+# pandas implementation, the original one, kept as a reference for the tests.
+# pandas is imported on first use: the processes that never run it don't
+# pay for loading it.
+# ---------------------------------------------------------------------------
+
+def nan_to_none(value):
+    import pandas as pd
+    return None if pd.isna(value) else value
+
+
+def industry_stats_pandas(queryset=None):
+    import pandas as pd
+    queryset = Employee.objects.all() if queryset is None else queryset
+    employees = queryset.select_related('industry')
+    rows = list(employees.values(
+        'id', 'first_name', 'last_name', 'email', 'gender',
+        'date_of_birth', 'salary', 'years_of_experience',
+        'industry__name'
+    ))
+    with timer('dataframe'):
+        df = pd.DataFrame(rows)
+        if df.empty:
+            return []
+
+        # adding an age column
+        df['age'] = df['date_of_birth'].apply(get_age)
+
+        # more clarity in api output
+        df = df.rename(columns={'industry__name': 'industry'})
+
+    with timer('aggregate'):
+        # grouping, averaging
+        industry_stats = df.groupby('industry').agg(
+            {
+                'salary': 'mean',
+                'years_of_experience': 'mean',
+                'age': 'mean'
+            }
+        )
+
+        # rounding happen after calculation for more accuracy
+        industry_stats['salary'] = industry_stats['salary'].astype(float).round(2)
+        industry_stats['years_of_experience'] = industry_stats['years_of_experience'].round(2)
+        industry_stats['age'] = industry_stats['age'].round(1)
+
+        industry_stats = industry_stats.reset_index()
+        industry_stats = industry_stats.sort_values('salary', ascending=False, kind='stable')
+
+        return industry_stats.to_dict(orient='records')
+
+
+def yoe_stats_pandas(queryset=None):
+    import pandas as pd
+    queryset = Employee.objects.all() if queryset is None else queryset
+    rows = list(queryset.values())
+    with timer('dataframe'):
+        df = pd.DataFrame(rows)
+        if df.empty:
+            return format_yoe_stats({})
+
+    with timer('aggregate'):
+        df['experience_bracket'] = pd.cut(
+            df['years_of_experience'], bins=YOE_BINS, labels=YOE_LABELS)
+
+        # Group by the experience bracket and calculate the mean salary
+        salary_by_experience = df.groupby('experience_bracket', observed=False)['salary'].mean()
+        salary_by_experience = salary_by_experience.astype(float).round(2)
+        salary_by_experience = salary_by_experience.reset_index()
+
+        response_data = salary_by_experience.to_dict(orient='records')
+        for record in response_data:
+            record['salary'] = nan_to_none(record['salary'])
+        return response_data
+
+
+def age_stats_pandas(queryset=None):
+    import pandas as pd
+    queryset = Employee.objects.all() if queryset is None else queryset
+    rows = list(queryset.values())
+    with timer('dataframe'):
+        df = pd.DataFrame(rows)
+        if df.empty:
+            return {}
+
+        # adding an age column
+        df['age'] = df['date_of_birth'].apply(get_age)
+
+    with timer('aggregate'):
+        result = df.groupby([pd.cut(
+            df['years_of_experience'], BRACKET_YOE_BINS), pd.cut(df['age'], AGE_BINS)], observed=False)[
+            'salary'].mean()
+
+        # create a nested dictionary of results
+        response_data = {}
+        for years, age in result.index:
+            years_str = prettify_brackets(str(years)) + ' years of experience'
+            age_str = prettify_brackets(str(age)) + ' years old'
+            salary = nan_to_none(result[(years, age)])
+            if years_str not in response_data:
+                response_data[years_str] = {}
+            response_data[years_str][age_str] = round(float(salary), 2) if salary is not None else None
+
+        return response_data
+
+
+def gender_stats_pandas(queryset=None):
+    import pandas as pd
+    queryset = Employee.objects.all() if queryset is None else queryset
+    rows = list(queryset.values())
+    with timer('dataframe'):
+        df = pd.DataFrame(rows)
+        if df.empty:
+            return {}
+
+    with timer('aggregate'):
+        result = df.groupby([df['gender'], pd.cut(df['years_of_experience'], BRACKET_YOE_BINS)], observed=False)[
+            'salary'].mean()
+        result = result.reset_index()
+
+        # just for the eyes
+        result['years_of_experience'] = result['years_of_experience'].astype(str)\
+            .str.replace('(', '').str.replace(']', '').str.replace(',', ' to')
+        result['salary'] = result['salary'].astype(object).where(result['salary'].notna(), None)
+
+        # Group by gender again to create separate sections for males and females
+        return {
+            gender: group.drop('gender', axis=1).to_dict(orient='records')
+            for gender, group in result.groupby('gender')
+        }
@@ -0,0 +1,319 @@
+"""
+Incrementally maintained statistics summary.
+
+EmployeeStat keeps running totals per (industry, gender, experience bucket,
+birth year) cell, BirthdayStat counts birthdays per industry and SalaryBin
+holds the salary sketches (hrapi.sketch) of every (industry, gender,
+experience bucket) group. Every Employee write applies its contribution to
+EmployeeStat, BirthdayStat and SalaryBin in the same transaction (see
+Employee.save/delete and EmployeeQuerySet), so the statistics endpoints
+read a few hundred cells instead of the whole table.
+"""
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import datetime
+from decimal import Decimal
+
+from django.db import connection, transaction
+from django.db.models import Count, F, Q, Sum, Value
+from django.db.models.functions import Coalesce, ExtractDay, ExtractMonth, ExtractYear
+
+from hrapi.models import BirthdayStat, Employee, EmployeeStat, SalaryBin
+from hrapi.query import bucket_expression
+from hrapi.sketch import SalarySketch, sketch_key
+from hrapi.stats import (
+    BRACKET_YOE_BINS, YOE_BINS, bucket_index, mean,
+    format_gender_stats, format_industry_stats, format_yoe_stats,
+)
+
+NO_BUCKET = -1
+
+# experience bucket -> BRACKET_YOE_BINS index, the coarse bins are unions of buckets
+BRACKET_OF_BUCKET = {
+    bucket: bucket_index(YOE_BINS[bucket + 1], BRACKET_YOE_BINS)
+    for bucket in range(len(YOE_BINS) - 1)
+}
+
+
+def yoe_bucket(years_of_experience):
+    bucket = bucket_index(years_of_experience, YOE_BINS)
+    return NO_BUCKET if bucket is None else bucket
+
+
+def birthday(date_of_birth):
+    return date_of_birth.month * 100 + date_of_birth.day
+
+
+# ---------------------------------------------------------------------------
+# Contributions : ({cell: [headcount, salary_sum, experience_sum]},
+#                  {(industry_id, birthday): headcount},
+#                  {(industry_id, gender, yoe_bucket, salary key): headcount})
+# ---------------------------------------------------------------------------
+
+def employee_contributions(employees):
+    # contributions of saved or about to be saved Employee instances,
+    # whose fields may still hold raw values (str dates, float salaries)
+    cells = defaultdict(lambda: [0, Decimal(0), 0])
+    birthdays = defaultdict(int)
+    salaries = defaultdict(int)
+    fields = {name: Employee._meta.get_field(name) for name in ('date_of_birth', 'salary', 'years_of_experience')}
+    for employee in employees:
+        date_of_birth = fields['date_of_birth'].to_python(employee.date_of_birth)
+        salary = fields['salary'].to_python(employee.salary)
+        years_of_experience = fields['years_of_experience'].to_python(employee.years_of_experience)
+        key = (employee.industry_id, employee.gender or None,
+               yoe_bucket(years_of_experience), date_of_birth.year)
+        cells[key][0] += 1
+        cells[key][1] += salary
+        cells[key][2] += years_of_experience
+        birthdays[(employee.industry_id, birthday(date_of_birth))] += 1
+        salaries[key[:3] + (sketch_key(salary),)] += 1
+    return cells, birthdays, salaries
+
+
+def queryset_contributions(queryset):
+    # contributions of the employees of a queryset, grouped by the database
+    cells = {}
+    for row in employee_cells(queryset):
+        key = (row['industry_id'], row['gender'], row['yoe_bucket'], row['birth_year'])
+        cells[key] = [row['headcount'], row['salary_sum'], row['experience_sum']]
+    birthdays = {
+        (row['industry_id'], row['birthday']): row['headcount']
+        for row in birthday_cells(queryset)
+    }
+    return cells, birthdays, salary_cells(queryset)
+
+
+def employee_cells(queryset):
+    return queryset.order_by()\
+        .annotate(
+            yoe_bucket=bucket_expression('years_of_experience', YOE_BINS, default=NO_BUCKET),
+            birth_year=ExtractYear('date_of_birth'),
+        )\
+        .values('industry_id', 'gender', 'yoe_bucket', 'birth_year')\
+        .annotate(
+            headcount=Count('id'),
+            salary_sum=Coalesce(Sum('salary'), Value(Decimal(0))),
+            experience_sum=Coalesce(Sum('years_of_experience'), Value(0)),
+        )
+
+
+def birthday_cells(queryset):
+    return queryset.order_by()\
+        .annotate(birthday=ExtractMonth('date_of_birth') * 100 + ExtractDay('date_of_birth'))\
+        .values('industry_id', 'birthday')\
+        .annotate(headcount=Count('id'))
+
+
+def salary_cells(queryset):
+    # the salary keys are computed here rather than by the database, so
+    # that an employee always lands in the same bucket whatever the path
+    salaries = defaultdict(int)
+    rows = queryset.order_by()\
+        .annotate(yoe_bucket=bucket_expression('years_of_experience', YOE_BINS, default=NO_BUCKET))\
+        .values('industry_id', 'gender', 'yoe_bucket', 'salary')\
+        .annotate(headcount=Count('id'))
+    for row in rows:
+        salaries[(row['industry_id'], row['gender'], row['yoe_bucket'], sketch_key(row['salary']))] += row['headcount']
+    return salaries
+
+
+def apply_contributions(contributions, sign=1):
+    cells, birthdays, salaries = contributions
+    cells = {key: totals for key, totals in cells.items() if any(totals)}
+    birthdays = {key: headcount for key, headcount in birthdays.items() if headcount}
+    salaries = {key: headcount for key, headcount in salaries.items() if headcount}
+    if not cells and not birthdays and not salaries:
+        return
+
+    with transaction.atomic():
+        stats = locked_rows(
+            EmployeeStat, {key[0] for key in cells}, ['gender', 'yoe_bucket', 'birth_year'],
+            birth_year__in={key[3] for key in cells},
+        )
+        changed, created = [], []
+        for key, (headcount, salary_sum, experience_sum) in cells.items():
+            deltas = (sign * headcount, sign * salary_sum, sign * experience_sum)
+            if key in stats:
+                changed.append((stats[key], deltas))
+            else:
+                industry_id, gender, bucket, birth_year = key
+                created.append(EmployeeStat(
+                    industry_id=industry_id, gender=gender, yoe_bucket=bucket, birth_year=birth_year,
+                    headcount=deltas[0], salary_sum=deltas[1], experience_sum=deltas[2],
+                ))
+        increment(EmployeeStat, ['headcount', 'salary_sum', 'experience_sum'], changed)
+        EmployeeStat.objects.bulk_create(created, batch_size=500)
+
+        days = locked_rows(
+            BirthdayStat, {key[0] for key in birthdays}, ['birthday'],
+            birthday__in={key[1] for key in birthdays},
+        )
+        changed, created = [], []
+        for (industry_id, day), headcount in birthdays.items():
+            if (industry_id, day) in days:
+                changed.append((days[(industry_id, day)], (sign * headcount,)))
+            else:
+                created.append(BirthdayStat(industry_id=industry_id, birthday=day, headcount=sign * headcount))
+        increment(BirthdayStat, ['headcount'], changed)
+        BirthdayStat.objects.bulk_create(created, batch_size=500)
+
+        bins = locked_rows(
+            SalaryBin, {key[0] for key in salaries}, ['gender', 'yoe_bucket', 'key'],
+            key__in={key[3] for key in salaries},
+        )
+        changed, created = [], []
+        for key, headcount in salaries.items():
+            if key in bins:
+                changed.append((bins[key], (sign * headcount,)))
+            else:
+                industry_id, gender, bucket, salary_key = key
+                created.append(SalaryBin(
+                    industry_id=industry_id, gender=gender, yoe_bucket=bucket, key=salary_key,
+                    headcount=sign * headcount,
+                ))
+        increment(SalaryBin, ['headcount'], changed)
+        SalaryBin.objects.bulk_create(created, batch_size=500)
+
+
+def increment(model, fields, changes):
+    # changes : [(pk, deltas of fields)]. Relative updates, with a single
+    # statement prepared for all the rows (bulk_update builds a CASE per
+    # row and field, which dominates large writes)
+    if not changes:
+        return
+    quote = connection.ops.quote_name
+    assignments = ', '.join(f'{quote(field)} = {quote(field)} + %s' for field in fields)
+    with connection.cursor() as cursor:
+        cursor.executemany(
+            f'UPDATE {quote(model._meta.db_table)} SET {assignments} WHERE id = %s',
+            [(*deltas, pk) for pk, deltas in changes],
+        )
+
+
+def locked_rows(model, industry_ids, fields, **filters):
+    # {(industry_id, *fields): pk} of the existing summary rows, locked until
+    # the end of the transaction. A cell may have several rows when two
+    # transactions created it at the same time, they are summed on read so
+    # any one of them can be updated
+    if not industry_ids:
+        return {}
+    industries = Q(industry_id__in=[pk for pk in industry_ids if pk is not None])
+    if None in industry_ids:
+        industries |= Q(industry__isnull=True)
+    rows = {}
+    for pk, *key in model.objects.select_for_update().filter(industries, **filters)\
+            .order_by('pk').values_list('pk', 'industry_id', *fields):
+        rows.setdefault(tuple(key), pk)
+    return rows
+
+
+@contextmanager
+def tracking(queryset):
+    # moves the contributions of the employees of the queryset around a
+    # write, the queryset is evaluated before and after it
+    apply_contributions(queryset_contributions(queryset), sign=-1)
+    yield
+    apply_contributions(queryset_contributions(queryset))
+
+
+def rebuild():
+    # full recomputation, compacting duplicated and emptied cells
+    EmployeeStat.objects.all().delete()
+    BirthdayStat.objects.all().delete()
+    SalaryBin.objects.all().delete()
+    EmployeeStat.objects.bulk_create(
+        (EmployeeStat(**row) for row in employee_cells(Employee.objects.all())),
+        batch_size=1000,
+    )
+    BirthdayStat.objects.bulk_create(
+        (BirthdayStat(**row) for row in birthday_cells(Employee.objects.all())),
+        batch_size=1000,
+    )
+    SalaryBin.objects.bulk_create(
+        (
+            SalaryBin(industry_id=industry_id, gender=gender, yoe_bucket=bucket, key=key, headcount=headcount)
+            for (industry_id, gender, bucket, key), headcount in salary_cells(Employee.objects.all()).items()
+        ),
+        batch_size=1000,
+    )
+
+
+# ---------------------------------------------------------------------------
+# Statistics read from the summary
+# ---------------------------------------------------------------------------
+
+def industry_stats_summary():
+    now = datetime.now()
+    today = birthday(now)
+    ahead = dict(
+        BirthdayStat.objects.filter(industry__isnull=False, birthday__gt=today)
+        .values('industry_id')
+        .annotate(headcount=Sum('headcount'))
+        .values_list('industry_id', 'headcount')
+    )
+    rows = EmployeeStat.objects.filter(industry__isnull=False)\
+        .values('industry_id', 'industry__name')\
+        .annotate(
+            count=Sum('headcount'),
+            total_salary=Sum('salary_sum'),
+            total_experience=Sum('experience_sum'),
+            total_birth_year=Sum(F('headcount') * F('birth_year')),
+        )\
+        .filter(count__gt=0)
+    return format_industry_stats(
+        {
+            'industry': row['industry__name'],
+            'salary': mean(row['total_salary'], row['count']),
+            'years_of_experience': mean(row['total_experience'], row['count']),
+            # everyone is now.year - birth_year old, minus one until their birthday
+            'age': mean(
+                now.year * row['count'] - row['total_birth_year'] - ahead.get(row['industry_id'], 0),
+                row['count'],
+            ),
+        }
+        for row in rows
+    )
+
+
+def yoe_stats_summary():
+    rows = EmployeeStat.objects.exclude(yoe_bucket=NO_BUCKET)\
+        .values('yoe_bucket')\
+        .annotate(count=Sum('headcount'), total_salary=Sum('salary_sum'))\
+        .filter(count__gt=0)
+    return format_yoe_stats({
+        row['yoe_bucket']: mean(row['total_salary'], row['count']) for row in rows
+    })
+
+
+def gender_stats_summary():
+    rows = EmployeeStat.objects.filter(gender__isnull=False)\
+        .exclude(yoe_bucket=NO_BUCKET)\
+        .values('gender', 'yoe_bucket')\
+        .annotate(count=Sum('headcount'), total_salary=Sum('salary_sum'))
+    totals = defaultdict(lambda: [0, Decimal(0)])
+    for row in rows:
+        total = totals[(row['gender'], BRACKET_OF_BUCKET[row['yoe_bucket']])]
+        total[0] += row['count']
+        total[1] += row['total_salary']
+    return format_gender_stats({
+        key: mean(salary_sum, count) for key, (count, salary_sum) in totals.items() if count
+    })
+
+
+def salary_sketches(groups, filters=Q(), bucket_group=None):
+    # {group: SalarySketch} merged from the stored sketches. groups are
+    # SalaryBin fields ('industry__name', 'gender', 'yoe_bucket'), the
+    # experience buckets can be mapped to coarser brackets by bucket_group
+    rows = SalaryBin.objects.filter(filters)\
+        .values(*groups, 'key')\
+        .annotate(count=Sum('headcount'))\
+        .filter(count__gt=0)
+    sketches = defaultdict(SalarySketch)
+    for row in rows:
+        group = tuple(
+            bucket_group(row[name]) if name == 'yoe_bucket' and bucket_group else row[name]
+            for name in groups
+        )
+        sketches[group].counts[row['key']] += row['count']
+    return sketches
@@ -1,11 +1,67 @@
 # Create your tests here.
-from django.test import TestCase
+from django.core.cache import cache, caches
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import DatabaseError, connection, connections
+from django.http import HttpResponse
+from django.test import AsyncClient, RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
 from rest_framework.test import APIClient
 from django.urls import reverse
-from datetime import date
+from django.utils import timezone
+from django.core.management import call_command
+from asgiref.sync import async_to_sync
+from contextlib import redirect_stdout
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from io import StringIO
+from unittest import mock, skipUnless
+import asyncio
+import csv
+import gzip
+import importlib
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import numpy as np
+import pandas as pd
 
-from .models import Employee, Industry
-from .views import get_age
+from .management.commands.benchmark import synthetic_employees
+from .management.commands.importer import Command
+from .models import BirthdayStat, Employee, EmployeeStat, ImportCheckpoint, Industry, Job, SalaryBin, StatsSnapshot
+from . import caching, filters, instrumentation, jobs, objectcache, parallel, query, reader, replicas, sketch, snapshot, stats, summary
+from .pagination import KeysetPagination
+from .renderers import FastJSONRenderer
+from .serializers import EmployeeSerializer
+from .views import AgeStats, EmployeeViewSet, YoEStats, get_age
+
+MOCK_DATA = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'MOCK_DATA.json')
+
+
+def create_employees(count, industries=(None,), genders=('M', 'F', None), **fields):
+    # First i Last i, employee{i}@example.com, with the genders and
+    # industries in turn, the other fields (or these) functions of i
+    for i in range(count):
+        Employee.objects.create(**{
+            'first_name': f'First {i}', 'last_name': f'Last {i}', 'email': f'employee{i}@example.com',
+            'gender': genders[i % len(genders)], 'industry': industries[i % len(industries)],
+            **{name: value(i) for name, value in fields.items()},
+        })
+
+
+def create_team(industry):
+    # the ten employees of the history and job tests
+    create_employees(
+        10, [industry], genders=('M', 'F'), date_of_birth=lambda i: date(1970 + i * 3, 1 + i, 1 + i),
+        salary=lambda i: 40000 + i * 1000, years_of_experience=lambda i: i * 3,
+    )
 
 
 class GeneralStatisticTestCase(TestCase):
@@ -71,3 +127,1537 @@ class GeneralStatisticTestCase(TestCase):
         # Check that the average salary is calculated correctly
         self.assertEqual(response.data[0]['salary'], 70000.0)
         self.assertEqual(response.data[1]['salary'], 55000.0)
+
+
+class StatisticsReferenceTestCase(TestCase):
+    # the SQL aggregation must answer exactly what the pandas reference answers
+
+    def setUp(self):
+        self.client = APIClient()
+
+        industries = [Industry.objects.create(name=f'Industry {i}') for i in range(3)]
+        today = date.today()
+        create_employees(
+            60, [*industries, None],
+            # birthdays spread around today so that the age rule is exercised
+            date_of_birth=lambda i: date(today.year - 18 - i, (today.month + i) % 12 + 1, 1 + i % 28),
+            salary=lambda i: 30000 + i * 1234.57, years_of_experience=lambda i: i % 37,
+        )
+
+    def assertMatchesReference(self, url_name, reference):
+        response = self.client.get(reverse(url_name))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, reference())
+
+    def test_industry_stats(self):
+        self.assertMatchesReference('averages_per_industry', stats.industry_stats_pandas)
+
+    def test_yoe_stats(self):
+        self.assertMatchesReference('averages_per_yoe', stats.yoe_stats_pandas)
+
+    def test_age_stats(self):
+        self.assertMatchesReference('agestats', stats.age_stats_pandas)
+
+    def test_gender_stats(self):
+        response = self.client.get(reverse('genderstats'))
+        reference = stats.gender_stats_pandas()
+        self.assertEqual(response.data.keys(), reference.keys())
+        for gender, brackets in reference.items():
+            for expected, actual in zip(brackets, response.data[gender]):
+                self.assertEqual(actual['years_of_experience'], expected['years_of_experience'])
+                self.assertAlmostEqual(actual['salary'], expected['salary'], places=6)
+
+    def test_empty_table(self):
+        Employee.objects.all().delete()
+        self.assertEqual(self.client.get(reverse('averages_per_industry')).data, [])
+        self.assertEqual(self.client.get(reverse('agestats')).data, {})
+        self.assertEqual(self.client.get(reverse('genderstats')).data, {})
+
+    def test_python_engine(self):
+        self.assertEqual(stats.industry_stats_python(), stats.industry_stats_pandas())
+        self.assertEqual(stats.yoe_stats_python(), stats.yoe_stats_pandas())
+        self.assertEqual(stats.age_stats_python(), stats.age_stats_pandas())
+        self.assertEqual(stats.gender_stats_python(), query.gender_stats_sql())
+        Employee.objects.all().delete()
+        self.assertEqual(stats.industry_stats_python(), [])
+        self.assertEqual(stats.age_stats_python(), {})
+        self.assertEqual(stats.gender_stats_python(), {})
+
+    def test_parallel_engine(self):
+        # the ranges are aggregated in this process, the in-memory test
+        # database being out of reach of the pool, and merged
+        self.assertEqual(parallel.id_ranges(7)[0][0], Employee.objects.order_by('id').first().id)
+        self.assertEqual(sum(Employee.objects.filter(id__gte=low, id__lt=high).count()
+                             for low, high in parallel.id_ranges(7)), 60)
+        for workers in (1, 7, 100):
+            self.assertEqual(parallel.parallel_stats(parallelism=workers), stats.python_stats())
+        with override_settings(STATS_ENGINE='parallel'):
+            self.assertEqual(self.client.get(reverse('agestats')).data, stats.age_stats_pandas())
+
+        partial = stats.merge(
+            parallel.range_partials(id_range, ['yoe'], None) for id_range in parallel.id_ranges(7)
+        )
+        salaries = [employee.salary for employee in Employee.objects.filter(years_of_experience__range=(1, 5))]
+        self.assertEqual(partial['yoe', 'salary'][0], [
+            len(salaries), sum(salaries), sum(salary * salary for salary in salaries), min(salaries), max(salaries),
+        ])
+        Employee.objects.all().delete()
+        self.assertEqual(parallel.parallel_stats(parallelism=4)['industry'], [])
+
+    def test_analytics_loaded_on_first_use(self):
+        # a worker serving the CRUD endpoints never imports pandas nor numpy
+        script = (
+            "import sys, django; django.setup(); import hrbro.urls; "
+            "print(sorted(name for name in ('pandas', 'numpy') if name in sys.modules))"
+        )
+        output = subprocess.run([sys.executable, '-c', script], capture_output=True, text=True, check=True).stdout
+        self.assertEqual(output.strip(), '[]')
+
+
+class ParallelPoolTestCase(TransactionTestCase):
+    # the pool workers are separate processes with connections of their own,
+    # an in-memory SQLite database is swapped for a file they can open
+
+    def setUp(self):
+        default = connections['default']
+        if default.vendor == 'sqlite' and default.is_in_memory_db():
+            directory = tempfile.mkdtemp()
+            self.addCleanup(shutil.rmtree, directory)
+            on_file = default.__class__({**default.settings_dict, 'NAME': os.path.join(directory, 'db.sqlite3')})
+            connections['default'] = on_file
+            self.addCleanup(connections.__setitem__, 'default', default)
+            self.addCleanup(on_file.close)
+            call_command('migrate', verbosity=0)
+        industries = [Industry.objects.create(name=f'Industry {i}') for i in range(3)]
+        create_employees(
+            30, [None, *industries], date_of_birth=lambda i: date(1960 + i, 1, 1),
+            salary=lambda i: 30000 + 1000 * i, years_of_experience=lambda i: i % 12,
+        )
+
+    def test_pool(self):
+        with override_settings(STATS_PARALLELISM=3):
+            self.assertEqual(parallel.parallel_stats(), stats.python_stats())
+            with override_settings(STATS_ENGINE='parallel'):
+                self.assertEqual(self.client.get(reverse('agestats')).data, stats.age_stats_pandas())
+
+
+class StatisticsSummaryTestCase(TestCase):
+    # the summary must follow every kind of write
+
+    def setUp(self):
+        self.client = APIClient()
+        self.industry_1 = Industry.objects.create(name='Industry 1')
+        self.industry_2 = Industry.objects.create(name='Industry 2')
+        today = date.today()
+        create_employees(
+            20, [self.industry_1, self.industry_2, None],
+            date_of_birth=lambda i: date(today.year - 25 - i, (today.month + i) % 12 + 1, 1 + i % 28),
+            salary=lambda i: 40000 + i * 999.99, years_of_experience=lambda i: i * 2,
+        )
+
+    def assertSummaryUpToDate(self):
+        self.assertEqual(summary.industry_stats_summary(), query.industry_stats_sql())
+        self.assertEqual(summary.yoe_stats_summary(), query.yoe_stats_sql())
+        self.assertEqual(summary.gender_stats_summary(), query.gender_stats_sql())
+        stored = summary.salary_sketches(['industry_id', 'gender', 'yoe_bucket'])
+        recounted = summary.salary_cells(Employee.objects.all())
+        self.assertEqual(
+            {group + (key,): count for group, salaries in stored.items() for key, count in salaries.counts.items()},
+            {key: count for key, count in recounted.items() if count},
+        )
+
+    def test_data_migrations(self):
+        # the summary tables filled from the employees as the migrations do
+        from django.apps import apps
+        models = (EmployeeStat, BirthdayStat, SalaryBin)
+        stored = [list(model.objects.values()) for model in models]
+        for model in models:
+            model.objects.all().delete()
+        importlib.import_module('hrapi.migrations.0007_employeestat').populate_stats(apps, None)
+        importlib.import_module('hrapi.migrations.0008_salarybin').populate_bins(apps, None)
+
+        def cells(rows):
+            # the ids differ, the cells emptied by the writes are left out
+            return sorted(sorted((name, str(value)) for name, value in row.items() if name != 'id')
+                          for row in rows if row['headcount'])
+        for model, before in zip(models, stored):
+            self.assertEqual(cells(model.objects.values()), cells(before), model)
+
+    def test_save_and_delete(self):
+        employee = Employee.objects.get(email='employee4@example.com')
+        employee.salary = 123456.78
+        employee.industry = self.industry_1
+        employee.years_of_experience = 31
+        employee.save()
+        self.assertSummaryUpToDate()
+        employee.delete()
+        self.assertSummaryUpToDate()
+
+    def test_api_writes(self):
+        response = self.client.post(reverse('employee-list'), {
+            'first_name': 'New', 'last_name': 'Hire', 'email': 'new.hire@example.com',
+            'gender': 'F', 'date_of_birth': '1999-12-31', 'salary': '51000.50',
+            'years_of_experience': 1, 'industry': self.industry_2.pk,
+        })
+        self.assertEqual(response.status_code, 201)
+        self.assertSummaryUpToDate()
+        url = reverse('employee-detail', args=[response.data['id']])
+        self.client.patch(url, {'gender': 'M', 'salary': '61000.00'})
+        self.assertSummaryUpToDate()
+        self.client.delete(url)
+        self.assertSummaryUpToDate()
+
+    def test_bulk_paths(self):
+        Employee.objects.bulk_create([
+            Employee(first_name='Bulk', last_name=str(i), email=f'bulk{i}@example.com', gender='M',
+                     date_of_birth='1980-06-15', salary=75000.25, years_of_experience=12,
+                     industry=self.industry_2)
+            for i in range(5)
+        ])
+        self.assertSummaryUpToDate()
+        Employee.objects.filter(gender='M').update(industry=self.industry_1, years_of_experience=3)
+        self.assertSummaryUpToDate()
+        employees = list(Employee.objects.filter(gender='F'))
+        for employee in employees:
+            employee.salary = 99999
+        Employee.objects.bulk_update(employees, ['salary'])
+        self.assertSummaryUpToDate()
+        Employee.objects.filter(years_of_experience__gt=20).delete()
+        self.assertSummaryUpToDate()
+
+    def test_industry_delete(self):
+        self.industry_1.delete()
+        self.assertSummaryUpToDate()
+
+    def test_rebuild_stats(self):
+        EmployeeStat.objects.all().delete()
+        call_command('rebuild_stats', stdout=StringIO())
+        self.assertSummaryUpToDate()
+
+
+class ImporterTestCase(TestCase):
+
+    def setUp(self):
+        Industry.objects.create(name='Textiles')
+        Employee.objects.create(
+            first_name='Taken', last_name='Email', email='taken@example.com',
+            gender='F', date_of_birth=date(1970, 5, 5), salary=10000, years_of_experience=30,
+        )
+        rows = [
+            {'first_name': f'First {i}', 'last_name': f'Last {i}', 'email': f'employee{i}@example.com',
+             'gender': 'M' if i % 2 else None, 'date_of_birth': f'{1 + i % 28:02d}/0{1 + i % 9}/19{60 + i}',
+             'industry': ['Textiles', 'Coal Mining', 'n/a', None][i % 4],
+             'salary': 50000.5 + i, 'years_of_experience': i}
+            for i in range(25)
+        ]
+        rows.append(dict(rows[20], first_name='Twice'))
+        rows.append(dict(rows[1], email='taken@example.com'))
+        rows.append(dict(rows[2], email='missing@example.com', salary=None, years_of_experience=None))
+        self.file = tempfile.NamedTemporaryFile('w', suffix='.json', delete=False)
+        json.dump(rows, self.file)
+        self.file.close()
+
+    def tearDown(self):
+        for path in (self.file.name, self.file.name + '.rejects.ndjson'):
+            if os.path.exists(path):
+                os.unlink(path)
+
+    def test_bulk_import(self):
+        out = StringIO()
+        with redirect_stdout(out):
+            call_command('importer', self.file.name, batch_size=10)
+        self.assertEqual(Employee.objects.count(), 26)
+        self.assertEqual(Industry.objects.count(), 2)
+        self.assertEqual(Employee.objects.filter(industry__name='Coal Mining').count(), 7)
+        employee = Employee.objects.get(email='employee3@example.com')
+        self.assertEqual(employee.date_of_birth, date(1963, 4, 4))
+        self.assertEqual(str(employee.salary), '50003.50')
+        self.assertIn("Couldn't add 1 employees with missing or invalid fields: missing@example.com", out.getvalue())
+        self.assertIn("Couldn't add 1 employees appearing again later in the file: employee20@example.com",
+                      out.getvalue())
+        # the rows are applied in order, the existing email is updated
+        self.assertEqual(Employee.objects.get(email='employee20@example.com').first_name, 'Twice')
+        self.assertEqual(Employee.objects.get(email='taken@example.com').first_name, 'First 1')
+        self.assertIn('25 inserted, 1 updated, 0 unchanged, 2 rejected', out.getvalue())
+        self.assertIn('rows/s', out.getvalue())
+        self.assertEqual(summary.industry_stats_summary(), query.industry_stats_sql())
+
+        with open(self.file.name + '.rejects.ndjson') as file:
+            rejects = [json.loads(line) for line in file]
+        self.assertEqual([(reject['position'], reject['email'], reject['reason']) for reject in rejects], [
+            (27, 'missing@example.com', 'missing salary, missing years_of_experience'),
+            (20, 'employee20@example.com', 'superseded by a later row of the email'),
+        ])
+
+    def test_formats(self):
+        # the same chunks from a JSON array, NDJSON and CSV
+        with open(self.file.name) as file:
+            rows = json.load(file)
+        rows[5]['date_of_birth'] = '31/02/1990'
+        paths = [self.file.name + extension for extension in ('.array', '.ndjson', '.csv')]
+        with open(paths[0], 'w') as file:
+            json.dump(rows, file, indent=2)
+        with open(paths[1], 'w') as file:
+            file.writelines(json.dumps(row) + '\n' for row in rows)
+        with open(paths[2], 'w', newline='') as file:
+            writer = csv.DictWriter(file, fieldnames=list(rows[0]))
+            writer.writeheader()
+            writer.writerows(rows)
+        try:
+            # objects cut by the end of the blocks
+            with mock.patch('hrapi.reader.BLOCK_SIZE', 7):
+                chunks = [list(reader.chunks(path, 10)) for path in paths]
+            for format_chunks in chunks:
+                self.assertEqual([chunk.index[0] for chunk in format_chunks], [0, 10, 20])
+                cleaned = pd.concat([Command().clean(chunk) for chunk in format_chunks])
+                self.assertEqual(cleaned['date_of_birth'].tolist()[:5], [date(1960 + i, 1 + i, 1 + i) for i in range(5)])
+                self.assertIsNone(cleaned.at[5, 'date_of_birth'])
+                self.assertIsNone(cleaned.at[2, 'industry'])
+                self.assertEqual(cleaned.at[3, 'salary'], 50003.5)
+
+            out = StringIO()
+            with redirect_stdout(out):
+                call_command('importer', paths[2], batch_size=10)
+            self.assertIn('24 inserted, 1 updated, 0 unchanged, 3 rejected', out.getvalue())
+            with open(paths[2] + '.rejects.ndjson') as file:
+                self.assertEqual(json.loads(next(file))['reason'], 'invalid date_of_birth')
+        finally:
+            for path in paths + [paths[2] + '.rejects.ndjson']:
+                if os.path.exists(path):
+                    os.unlink(path)
+
+    def test_unreadable_and_refused_rows(self):
+        with open(self.file.name) as file:
+            rows = json.load(file)[:6]
+        rows[1]['gender'] = 'Male'
+        rows[2]['salary'] = 123456789.5
+        lines = [json.dumps(row) + '\n' for row in rows]
+        lines[3] = '{"first_name": "Broken",\n'
+        lines[4] = '[1, 2]\n'
+        path = self.file.name + '.ndjson'
+        with open(path, 'w') as file:
+            file.writelines(lines)
+        try:
+            for engine in ('bulk', 'copy'):
+                Employee.objects.filter(email__startswith='employee').delete()
+                with redirect_stdout(StringIO()):
+                    call_command('importer', path, engine=engine, batch_size=4)
+                self.assertEqual(
+                    sorted(Employee.objects.filter(email__startswith='employee').values_list('email', flat=True)),
+                    ['employee0@example.com', 'employee5@example.com'],
+                )
+                with open(path + '.rejects.ndjson') as file:
+                    rejects = [json.loads(line) for line in file]
+                self.assertEqual([(reject['position'], reject['reason'][:12]) for reject in rejects], [
+                    (3, 'invalid JSON'), (1, 'invalid gend'), (2, 'invalid sala'), (4, 'not a JSON o'),
+                ])
+                self.assertEqual(rejects[0]['text'], lines[3].strip())
+        finally:
+            for path in (path, path + '.rejects.ndjson'):
+                if os.path.exists(path):
+                    os.unlink(path)
+
+    def test_malformed_json_array(self):
+        # a malformed element stops the reading there, the blocks after it aren't read
+        with open(self.file.name, 'w') as file:
+            file.write('[{"first_name": "A"}, {"first_name": B}, ' + ' ' * 100 + '{"first_name": "C"}]')
+        with mock.patch('hrapi.reader.BLOCK_SIZE', 30):
+            with open(self.file.name) as file:
+                records = reader.json_records(file)
+                self.assertEqual(next(records), {'first_name': 'A'})
+                with self.assertRaisesRegex(ValueError, 'Invalid JSON array'):
+                    next(records)
+                self.assertLess(file.tell(), 100)
+
+    def test_reimport_writes_the_changes(self):
+        with redirect_stdout(StringIO()):
+            call_command('importer', self.file.name, batch_size=10)
+        with open(self.file.name) as file:
+            rows = json.load(file)
+        rows[3]['salary'] = 1000
+        rows.append(dict(rows[4], email='new@example.com'))
+        with open(self.file.name, 'w') as file:
+            json.dump(rows, file)
+
+        out = StringIO()
+        with redirect_stdout(out), CaptureQueriesContext(connection) as queries:
+            call_command('importer', self.file.name, batch_size=10)
+        self.assertIn('1 inserted, 1 updated, 25 unchanged, 2 rejected', out.getvalue())
+        self.assertEqual(str(Employee.objects.get(email='employee3@example.com').salary), '1000.00')
+        self.assertEqual(Employee.objects.count(), 27)
+        # nothing is written for the batches without changes
+        self.assertEqual(len([query for query in queries if 'UPDATE "hrapi_employee" ' in query['sql']]), 1)
+        self.assertEqual(summary.industry_stats_summary(), query.industry_stats_sql())
+
+    def test_resume(self):
+        write_batch = Command.write_batch
+
+        def crash_on_third_batch(command, batch, *args, **kwargs):
+            if ImportCheckpoint.objects.get().offset == 20:
+                raise KeyboardInterrupt
+            return write_batch(command, batch, *args, **kwargs)
+
+        with redirect_stdout(StringIO()), mock.patch.object(Command, 'write_batch', crash_on_third_batch):
+            with self.assertRaises(KeyboardInterrupt):
+                call_command('importer', self.file.name, batch_size=10)
+        self.assertEqual(Employee.objects.count(), 21)
+        self.assertEqual(ImportCheckpoint.objects.get().offset, 20)
+
+        out = StringIO()
+        with redirect_stdout(out):
+            call_command('importer', self.file.name, batch_size=10)
+        self.assertIn('Resuming', out.getvalue())
+        self.assertNotIn('Imported rows 0-9', out.getvalue())
+        # the tally covers both runs
+        self.assertIn('25 inserted, 1 updated, 0 unchanged, 2 rejected', out.getvalue())
+        self.assertEqual(Employee.objects.count(), 26)
+        self.assertTrue(ImportCheckpoint.objects.get().finished)
+
+        # a finished import starts over
+        out = StringIO()
+        with redirect_stdout(out):
+            call_command('importer', self.file.name, batch_size=10)
+        self.assertNotIn('Resuming', out.getvalue())
+        self.assertIn('0 inserted, 0 updated, 26 unchanged, 2 rejected', out.getvalue())
+
+    def test_copy_import_upserts(self):
+        out = StringIO()
+        with redirect_stdout(out):
+            call_command('importer', self.file.name, engine='copy', workers=2)
+        self.assertEqual(Employee.objects.count(), 26)
+        # the existing email is updated with the row of the file
+        self.assertEqual(Employee.objects.get(email='taken@example.com').first_name, 'First 1')
+        self.assertEqual(Employee.objects.filter(industry__name='Textiles').count(), 7)
+        self.assertIn('Successfully added or updated 26 employees', out.getvalue())
+        self.assertEqual(summary.industry_stats_summary(), query.industry_stats_sql())
+
+    @skipUnless(connection.vendor == 'postgresql', 'COPY is PostgreSQL only')
+    def test_copy_inside_transaction(self):
+        # the test transaction is still open: the staging table is loaded by
+        # COPY on its connection rather than by workers
+        objectcache.details.set('employee', 1, objectcache.versions('employee', 1), {'id': 1})
+        with redirect_stdout(StringIO()):
+            call_command('importer', self.file.name, engine='copy', workers=2)
+        self.assertTrue(connection.in_atomic_block)
+        self.assertEqual(Employee.objects.count(), 26)
+        self.assertEqual(Employee.objects.get(email='employee24@example.com').salary, Decimal('50024.50'))
+        self.assertIsNone(objectcache.details.get('employee', 1, objectcache.versions('employee', 1)))
+
+    def test_synthetic_employees(self):
+        # what the benchmark command loads, the same for the same seed
+        first = list(synthetic_employees(MOCK_DATA, 500, seed=1))
+        self.assertEqual(first, list(synthetic_employees(MOCK_DATA, 500, seed=1)))
+        self.assertNotEqual(first, list(synthetic_employees(MOCK_DATA, 500, seed=2)))
+        self.assertEqual(len({employee['email'] for employee in first}), 500)
+
+        with open(self.file.name, 'w') as file:
+            json.dump(first, file)
+        with redirect_stdout(StringIO()):
+            call_command('importer', self.file.name)
+        self.assertEqual(Employee.objects.count(), 501)
+
+
+class ResponseCacheTestCase(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.industry = Industry.objects.create(name='Industry 1')
+        Employee.objects.create(
+            first_name='John', last_name='Doe', email='john.doe@example.com',
+            gender='M', date_of_birth=date(1990, 1, 1), salary=50000,
+            years_of_experience=5, industry=self.industry
+        )
+
+    def test_cached_until_write(self):
+        url = reverse('averages_per_industry')
+        first = self.client.get(url)
+        with self.assertNumQueries(0):
+            second = self.client.get(url)
+        self.assertEqual(first.content, second.content)
+        self.assertEqual(first['ETag'], second['ETag'])
+
+        Employee.objects.create(
+            first_name='Jane', last_name='Doe', email='jane.doe@example.com',
+            gender='F', date_of_birth=date(1985, 1, 1), salary=60000,
+            years_of_experience=8, industry=self.industry
+        )
+        third = self.client.get(url)
+        self.assertNotEqual(first['ETag'], third['ETag'])
+        self.assertEqual(json.loads(third.content)[0]['salary'], 55000.0)
+
+        self.industry.name = 'Renamed'
+        self.industry.save()
+        self.assertEqual(json.loads(self.client.get(url).content)[0]['industry'], 'Renamed')
+
+    def test_conditional_get(self):
+        url = reverse('genderstats')
+        etag = self.client.get(url)['ETag']
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH='"stale"').status_code, 200)
+
+    def test_permissions_checked_on_hits(self):
+        url = reverse('averages_per_yoe')
+        self.assertEqual(self.client.get(url).status_code, 200)
+        with mock.patch.object(YoEStats, 'permission_classes', [IsAuthenticated]):
+            self.assertIn(self.client.get(url).status_code, (401, 403))
+
+    def test_age_dependent_expiry(self):
+        self.assertEqual(caching.seconds_until_tomorrow(datetime(2024, 2, 28, 23, 59, 30)), 30)
+        request = Request(RequestFactory().get(reverse('agestats')))
+        view = AgeStats()
+        self.assertNotEqual(
+            view.cache_key(request, datetime(2024, 2, 28, 23, 59)),
+            view.cache_key(request, datetime(2024, 2, 29, 0, 1)),
+        )
+        view = YoEStats()
+        self.assertEqual(
+            view.cache_key(request, datetime(2024, 2, 28, 23, 59)),
+            view.cache_key(request, datetime(2024, 2, 29, 0, 1)),
+        )
+
+
+class KeysetPaginationTestCase(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        Employee.objects.bulk_create([
+            Employee(first_name='First', last_name=f'Last {i}', email=f'employee{i}@example.com',
+                     date_of_birth=date(1980, 1, 1), salary=50000, years_of_experience=5)
+            for i in range(25)
+        ])
+
+    def test_follow_next_links(self):
+        ids = []
+        url = reverse('employee-list') + '?page_size=10'
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            ids.extend(employee['id'] for employee in response.data['results'])
+            url = response.data['next']
+        self.assertEqual(ids, list(Employee.objects.order_by('id').values_list('id', flat=True)))
+
+    def test_deep_page_uses_the_key(self):
+        response = self.client.get(reverse('employee-list') + '?page_size=10')
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(response.data['next'])
+        sql = queries.captured_queries[0]['sql']
+        self.assertIn('"hrapi_employee"."id" >', sql)
+        self.assertNotIn('OFFSET', sql)
+
+    def test_max_page_size(self):
+        response = self.client.get(reverse('employee-list') + '?page_size=100000')
+        self.assertEqual(len(response.data['results']), 25)
+        self.assertEqual(KeysetPagination().get_page_size(
+            Request(RequestFactory().get('/', {'page_size': 100000}))), KeysetPagination.max_page_size)
+
+
+class ExportTestCase(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        industry = Industry.objects.create(name='Textiles, Apparel')
+        Employee.objects.create(
+            first_name='John', last_name='Doe', email='john.doe@example.com',
+            gender='M', date_of_birth=date(1990, 1, 1), salary=50000,
+            years_of_experience=5, industry=industry
+        )
+        Employee.objects.create(
+            first_name='Jane', last_name='Doe', email='jane.doe@example.com',
+            date_of_birth=date(1985, 2, 3), salary=60000.5, years_of_experience=8,
+        )
+
+    def export(self, format):
+        response = self.client.get(reverse('employee-export'), {'format': format})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        return b''.join(response.streaming_content).decode()
+
+    def test_ndjson(self):
+        rows = [json.loads(line) for line in self.export('ndjson').splitlines()]
+        listed = self.client.get(reverse('employee-list')).data['results']
+        self.assertEqual(len(rows), 2)
+        for row, employee in zip(rows, listed):
+            self.assertEqual(row, dict(employee, industry_name=row['industry_name']))
+        self.assertEqual([row['industry_name'] for row in rows], ['Textiles, Apparel', None])
+
+    def test_csv(self):
+        rows = list(csv.reader(StringIO(self.export('csv'))))
+        self.assertEqual(rows[0], EmployeeViewSet.EXPORT_COLUMNS)
+        self.assertEqual(rows[1][-1], 'Textiles, Apparel')
+        self.assertEqual(rows[2][3:7], ['jane.doe@example.com', '', '1985-02-03', '60000.50'])
+
+
+class SnapshotTestCase(TestCase):
+
+    def setUp(self):
+        self.industry = Industry.objects.create(name='Industry 1')
+        Employee.objects.create(
+            first_name='John', last_name='Doe', email='john.doe@example.com',
+            gender='M', date_of_birth=date(1990, 3, 4), salary=50000.25,
+            years_of_experience=5, industry=self.industry
+        )
+
+    def test_columns(self):
+        current = snapshot.get_snapshot()
+        self.assertEqual(list(current['salary_cents']), [5000025])
+        self.assertEqual(list(current['date_of_birth']), [(date(1990, 3, 4) - date(1970, 1, 1)).days])
+        self.assertEqual(current['years_of_experience'].dtype, np.int16)
+        self.assertEqual(current.industries[current['industry'][0]], 'Industry 1')
+        self.assertFalse(current['id'].flags.writeable)
+
+    def test_rebuilt_after_write(self):
+        first = snapshot.get_snapshot()
+        self.assertIs(snapshot.get_snapshot(), first)
+        Employee.objects.create(
+            first_name='Jane', last_name='Doe', email='jane.doe@example.com',
+            gender='F', date_of_birth=date(1985, 1, 1), salary=60000,
+            years_of_experience=8, industry=self.industry
+        )
+        second = snapshot.get_snapshot()
+        self.assertNotEqual(second.path, first.path)
+        self.assertEqual(len(second), 2)
+        self.assertEqual(snapshot.industry_stats_snapshot(), query.industry_stats_sql())
+        # kept for the workers about to map it
+        self.assertTrue(first.path.exists())
+
+    def test_superseded_snapshots_removed(self):
+        first = snapshot.get_snapshot()
+        superseded = first.path / 'superseded'
+        caching.bump_generation('employee')
+        snapshot.get_snapshot()
+        self.assertTrue(superseded.exists())
+        os.utime(superseded, (0, 0))
+        caching.bump_generation('employee')
+        third = snapshot.get_snapshot()
+        self.assertFalse(first.path.exists())
+        self.assertTrue(third.path.exists())
+
+    def test_removed_while_loading(self):
+        load, removed = snapshot.Snapshot, []
+
+        def removing(path):
+            # by a build of another worker
+            if not removed:
+                removed.append(path)
+                shutil.rmtree(path)
+            return load(path)
+
+        caching.bump_generation('employee')
+        with mock.patch.object(snapshot, 'Snapshot', side_effect=removing):
+            current = snapshot.get_snapshot()
+        self.assertEqual(len(current), 1)
+        self.assertEqual(current.path, removed[0])
+
+
+class StatsQueryTestCase(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        industries = [Industry.objects.create(name=f'Industry {i}') for i in range(2)]
+        today = date.today()
+        create_employees(
+            30, industries,
+            date_of_birth=lambda i: date(today.year - 20 - i * 2, (today.month + i) % 12 + 1, 1 + i % 28),
+            salary=lambda i: 35000 + i * 2345.67, years_of_experience=lambda i: i,
+        )
+
+    def test_presets_match_reference(self):
+        self.assertEqual(query.industry_stats_sql(), stats.industry_stats_pandas())
+        self.assertEqual(query.yoe_stats_sql(), stats.yoe_stats_pandas())
+        self.assertEqual(query.age_stats_sql(), stats.age_stats_pandas())
+
+    def test_grouped_metrics_with_filters(self):
+        response = self.client.get(reverse('stats'), {
+            'group_by': 'industry', 'metrics': 'salary:mean,salary:count,age:max',
+            'filter': 'gender:eq:F,age:gt:40',
+        })
+        self.assertEqual(response.status_code, 200)
+
+        expected = {}
+        for employee in Employee.objects.filter(gender='F').select_related('industry'):
+            age = get_age(employee.date_of_birth)
+            if age > 40:
+                expected.setdefault(employee.industry.name, []).append((float(employee.salary), age))
+        self.assertEqual([row['industry'] for row in response.data], sorted(expected))
+        for row in response.data:
+            employees = expected[row['industry']]
+            self.assertEqual(row['salary_count'], len(employees))
+            self.assertAlmostEqual(row['salary_mean'], sum(s for s, _ in employees) / len(employees), places=6)
+            self.assertEqual(row['age_max'], max(age for _, age in employees))
+
+    def test_custom_bins(self):
+        response = self.client.get(reverse('stats'), {
+            'group_by': 'yoe', 'metrics': 'salary:count', 'yoe_bins': '0,10,inf',
+        })
+        # nobody at 0 years, left out like pd.cut does
+        self.assertEqual(response.data, [
+            {'yoe': '0 to 10', 'salary_count': 10},
+            {'yoe': '10+', 'salary_count': 19},
+        ])
+
+    def test_invalid_queries(self):
+        for params in (
+            {'group_by': 'email', 'metrics': 'salary:mean'},
+            {'group_by': 'industry', 'metrics': 'salary:mode'},
+            {'group_by': 'industry'},
+            {'metrics': 'salary:mean', 'filter': 'email:eq:x'},
+            {'metrics': 'salary:mean', 'filter': 'salary'},
+            {'group_by': 'yoe', 'metrics': 'salary:mean', 'yoe_bins': '10,5'},
+            {'metrics': 'salary:mean', 'filter': 'salary:gt:abc'},
+            {'metrics': 'salary:mean', 'filter': 'salary:gt:NaN'},
+            {'metrics': 'salary:mean', 'filter': 'age:gt:abc'},
+            {'metrics': 'salary:mean', 'filter': 'yoe:in:1|x'},
+            {'metrics': 'salary:mean', 'filter': 'gender:eq:X'},
+        ):
+            response = self.client.get(reverse('stats'), params)
+            self.assertEqual(response.status_code, 400, params)
+            response = self.client.post(reverse('job-stats'), params, format='json')
+            self.assertEqual(response.status_code, 400, params)
+        self.assertFalse(Job.objects.exists())
+
+    def test_filter_values(self):
+        response = self.client.get(reverse('stats'), {
+            'metrics': 'salary:count', 'filter': 'salary:gte:40000.5,yoe:in:3|4|5|29,gender:in:M|F',
+        })
+        self.assertEqual(response.data, [{'salary_count': Employee.objects.filter(
+            salary__gte=Decimal('40000.5'), years_of_experience__in=[3, 4, 5, 29], gender__in=['M', 'F'],
+        ).count()}])
+
+    def test_explain(self):
+        response = self.client.get(reverse('stats'), {
+            'group_by': 'gender', 'metrics': 'salary:sum', 'explain': 'true',
+        })
+        self.assertIn('GROUP BY', response.data['sql'])
+        self.assertTrue(response.data['plan'])
+
+
+class SalarySketchTestCase(TestCase):
+
+    def assertWithinBound(self, salaries, sketch_quantile, q):
+        # within RELATIVE_ACCURACY of one of the two salaries numpy interpolates between
+        salaries = np.sort(salaries)
+        rank = q * (len(salaries) - 1)
+        low, high = salaries[int(np.floor(rank))], salaries[int(np.ceil(rank))]
+        self.assertLessEqual(low * (1 - sketch.RELATIVE_ACCURACY), sketch_quantile)
+        self.assertLessEqual(sketch_quantile, high * (1 + sketch.RELATIVE_ACCURACY))
+
+    def test_error_bound_against_numpy(self):
+        rng = np.random.default_rng(42)
+        salaries = np.round(rng.lognormal(11.5, 0.5, 5000), 2)
+        salary_sketch = sketch.SalarySketch()
+        for salary in salaries:
+            salary_sketch.add(salary)
+        for q in (0.01, 0.1, 0.25, 0.5, 0.75, 0.9, 0.99):
+            self.assertWithinBound(salaries, salary_sketch.quantile(q), q)
+            # on a dense sample that is within the bound of numpy itself
+            self.assertLessEqual(
+                abs(salary_sketch.quantile(q) / np.percentile(salaries, q * 100) - 1),
+                sketch.RELATIVE_ACCURACY + 0.001,
+            )
+
+    def test_merge_and_remove(self):
+        rng = np.random.default_rng(7)
+        first, second = np.round(rng.uniform(30000, 300000, (2, 1000)), 2)
+        merged = sketch.SalarySketch()
+        for salary in first:
+            merged.add(salary)
+        other = sketch.SalarySketch()
+        for salary in second:
+            other.add(salary)
+        merged.merge(other)
+        self.assertWithinBound(np.concatenate([first, second]), merged.quantile(0.9), 0.9)
+
+        for salary in second:
+            merged.add(salary, -1)
+        self.assertWithinBound(first, merged.quantile(0.5), 0.5)
+        self.assertIsNone(sketch.SalarySketch().quantile(0.5))
+
+    def test_quantile_metrics(self):
+        industries = [Industry.objects.create(name=f'Industry {i}') for i in range(2)]
+        create_employees(
+            50, genders=('M', 'F'), date_of_birth=lambda i: date(1980, 1, 1),
+            salary=lambda i: 30000 + (i * 7919) % 100000, years_of_experience=lambda i: i % 40,
+            industry=lambda i: industries[i % 2 if i < 40 else 0],
+        )
+        Employee.objects.filter(pk__in=Employee.objects.order_by('id').values('pk')[:5]).update(salary=250000)
+        Employee.objects.order_by('id').last().delete()
+
+        response = APIClient().get(reverse('stats'), {
+            'group_by': 'industry', 'metrics': 'salary:median,salary:p90', 'filter': 'gender:eq:M',
+        })
+        self.assertEqual(response.status_code, 200)
+        for row in response.data:
+            salaries = np.array([float(salary) for salary in Employee.objects.filter(
+                industry__name=row['industry'], gender='M').values_list('salary', flat=True)])
+            self.assertWithinBound(salaries, row['salary_median'], 0.5)
+            self.assertWithinBound(salaries, row['salary_p90'], 0.9)
+
+        for params in (
+            {'group_by': 'age', 'metrics': 'salary:median'},
+            {'metrics': 'age:p90'},
+            {'metrics': 'salary:p90', 'filter': 'age:gt:40'},
+            {'group_by': 'yoe', 'metrics': 'salary:p90', 'yoe_bins': '0,7,inf'},
+        ):
+            self.assertEqual(APIClient().get(reverse('stats'), params).status_code, 400, params)
+
+
+class EmployeeFilterTestCase(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.industries = [Industry.objects.create(name=f'Industry {i}') for i in range(3)]
+        today = date.today()
+        for i in range(40):
+            Employee.objects.create(
+                first_name=['Anna', 'Bob', 'Carla', 'Dmitri'][i % 4], last_name=f'Smith{i}' if i % 5 else f'Jones{i}',
+                email=f'employee{i}@example.com', gender=['M', 'F'][i % 2],
+                date_of_birth=filters.years_before(today, 20 + i),
+                salary=30000 + i * 1000, years_of_experience=i % 20,
+                industry=self.industries[i % 3],
+            )
+
+    def list_emails(self, **params):
+        response = self.client.get(reverse('employee-list'), {**params, 'page_size': 1000})
+        self.assertEqual(response.status_code, 200)
+        return {employee['email'] for employee in response.data['results']}
+
+    def assertFilters(self, params, predicate):
+        expected = {employee.email for employee in Employee.objects.all() if predicate(employee)}
+        self.assertTrue(expected)
+        self.assertEqual(self.list_emails(**params), expected)
+
+    def test_filters(self):
+        industry = self.industries[1]
+        self.assertFilters({'industry': industry.pk}, lambda e: e.industry_id == industry.pk)
+        self.assertFilters({'gender': 'F', 'salary_min': 40000, 'salary_max': 50000},
+                           lambda e: e.gender == 'F' and 40000 <= e.salary <= 50000)
+        self.assertFilters({'yoe_min': 5, 'yoe_max': 7}, lambda e: 5 <= e.years_of_experience <= 7)
+        self.assertFilters({'age_min': 30, 'age_max': 35}, lambda e: 30 <= get_age(e.date_of_birth) <= 35)
+        self.assertFilters({'born_before': date.today().replace(year=date.today().year - 50).isoformat()},
+                           lambda e: get_age(e.date_of_birth) >= 50)
+        self.assertFilters({'search': 'jones'}, lambda e: 'jones' in e.last_name.lower())
+        self.assertFilters({'prefix': 'car'}, lambda e: e.first_name == 'Carla')
+        self.assertFilters({'prefix': 'employee1'}, lambda e: e.email.startswith('employee1'))
+
+    def test_invalid_filters(self):
+        for params in ({'gender': 'X'}, {'salary_min': 'lots'}, {'born_after': 'yesterday'}):
+            response = self.client.get(reverse('employee-list'), params)
+            self.assertEqual(response.status_code, 400, params)
+
+    def assertIndexScan(self, **params):
+        queryset = filters.EmployeeFilterBackend().filter(Employee.objects.order_by(), params)
+        plan = queryset.explain()
+        self.assertNotIn('Seq Scan', plan)
+        self.assertNotRegex(plan, r'SCAN hrapi_employee(\n|$)')
+        self.assertRegex(plan, r'Index|INDEX')
+
+    def test_filters_use_indexes(self):
+        # as many rows as a real deployment, so that the planner picks the
+        # indexes for the selective filters on its own
+        industries = Industry.objects.bulk_create(Industry(name=f'Sector {i}') for i in range(50))
+        today = date.today()
+        Employee.objects.bulk_create(
+            Employee(
+                first_name=f'First{i % 997}', last_name='Jones' if i % 500 == 0 else f'Last{i % 991}',
+                email=f'worker{i}@example.com', gender=['M', 'F'][i % 2],
+                date_of_birth=today - timedelta(days=7000 + i), salary=20000 + i * 7 % 80000,
+                years_of_experience=i % 40, industry=industries[i % 50],
+            )
+            for i in range(20000)
+        )
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE hrapi_employee')
+        self.assertIndexScan(industry=industries[0].pk)
+        self.assertIndexScan(industry=industries[0].pk, salary_min=40000)
+        self.assertIndexScan(gender='F', salary_min=40000, salary_max=40500)
+        self.assertIndexScan(salary_min=40000, salary_max=41000)
+        self.assertIndexScan(yoe_min=5, yoe_max=5)
+        self.assertIndexScan(age_min=70, age_max=70)
+        self.assertIndexScan(born_after=today - timedelta(days=7100))
+        if connection.vendor == 'postgresql':
+            # trigram indexes, LIKE '%...%' always scans on SQLite
+            self.assertIndexScan(search='jones')
+            self.assertIndexScan(prefix='worker1234')
+
+
+class BulkChangeTestCase(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.industry = Industry.objects.create(name='Industry 1')
+        create_employees(
+            3, [self.industry], genders=('F',), date_of_birth=lambda i: date(1980, 1, 1),
+            salary=lambda i: 50000, years_of_experience=lambda i: 10,
+        )
+        self.employees = list(Employee.objects.order_by('id'))
+
+    def new_employee(self, i, **fields):
+        return {
+            'first_name': f'New {i}', 'last_name': 'Hire', 'email': f'new{i}@example.com', 'gender': 'M',
+            'date_of_birth': '1990-05-17', 'salary': '61000.50', 'years_of_experience': 3,
+            'industry': self.industry.pk, **fields,
+        }
+
+    def bulk(self, items):
+        return self.client.post(reverse('employee-bulk'), items, format='json')
+
+    def test_create_update_delete(self):
+        response = self.bulk([
+            {'op': 'create', 'data': self.new_employee(0)},
+            {'op': 'update', 'id': self.employees[0].pk, 'data': {'salary': '70000.00', 'industry': None}},
+            # a deleted employee's email can be reused in the same batch
+            {'op': 'update', 'email': 'employee1@example.com', 'data': {'email': 'employee2@example.com'}},
+            {'op': 'delete', 'email': 'employee2@example.com'},
+        ])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([item['status'] for item in response.data], ['created', 'updated', 'updated', 'deleted'])
+
+        created = Employee.objects.get(email='new0@example.com')
+        self.assertEqual(response.data[0]['id'], created.pk)
+        self.assertEqual(created.industry, self.industry)
+        self.employees[0].refresh_from_db()
+        self.assertEqual((self.employees[0].salary, self.employees[0].industry), (70000, None))
+        self.assertEqual(Employee.objects.get(email='employee2@example.com').pk, self.employees[1].pk)
+        self.assertFalse(Employee.objects.filter(pk=self.employees[2].pk).exists())
+        self.assertEqual(query.industry_stats_sql(), summary.industry_stats_summary())
+
+    def test_invalid_batch_writes_nothing(self):
+        response = self.bulk([
+            {'op': 'create', 'data': self.new_employee(0)},
+            {'op': 'create', 'data': self.new_employee(1, email='employee0@example.com')},
+            {'op': 'create', 'data': self.new_employee(2, salary='lots')},
+            {'op': 'update', 'id': 0, 'data': {'salary': '1.00'}},
+            {'op': 'update', 'id': self.employees[0].pk, 'data': {'industry': 999}},
+            {'op': 'delete', 'id': self.employees[1].pk},
+            {'op': 'delete', 'email': 'employee1@example.com'},
+            {'op': 'create', 'data': self.new_employee(3, email='new0@example.com')},
+            {'op': 'rename'},
+        ])
+        self.assertEqual(response.status_code, 400)
+        # new0 is used twice, the second delete targets the same employee
+        self.assertEqual([item['status'] for item in response.data], ['error'] * 5 + ['valid'] + ['error'] * 3)
+        self.assertIn('email', response.data[1]['errors'])
+        self.assertIn('salary', response.data[2]['errors'])
+        self.assertIn('industry', response.data[4]['errors'])
+        self.assertEqual(Employee.objects.count(), 3)
+
+    def test_invalid_targets(self):
+        response = self.bulk([
+            {'op': 'delete', 'id': 'abc'},
+            {'op': 'delete', 'id': [1]},
+            {'op': 'update', 'email': {'a': 1}, 'data': {}},
+            {'op': 'update', 'email': 'nobody', 'data': {}},
+            {'op': 'update', 'id': str(self.employees[0].pk), 'data': {'salary': '1.00'}},
+        ])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual([item['status'] for item in response.data], ['error'] * 4 + ['valid'])
+        self.assertEqual([list(item['errors']) for item in response.data[:4]], [['id'], ['id'], ['email'], ['email']])
+
+        # the ids given as strings are those of the employees
+        response = self.bulk([{'op': 'delete', 'id': str(self.employees[0].pk)}])
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(Employee.objects.filter(pk=self.employees[0].pk).exists())
+
+    @skipUnless(connection.features.has_select_for_update, 'SELECT ... FOR UPDATE is not supported')
+    def test_targets_locked(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.bulk([{'op': 'update', 'id': self.employees[0].pk, 'data': {'salary': '1.00'}}])
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(any('FOR UPDATE' in query['sql'] for query in queries))
+
+    def test_email_released_later(self):
+        first, second = [employee.email for employee in self.employees[:2]]
+        response = self.bulk([
+            {'op': 'update', 'id': self.employees[0].pk, 'data': {'email': second}},
+            {'op': 'update', 'id': self.employees[1].pk, 'data': {'email': first}},
+        ])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual([item['status'] for item in response.data], ['error', 'valid'])
+        self.assertIn('email', response.data[0]['errors'])
+
+        # released before it is written
+        response = self.bulk([
+            {'op': 'update', 'id': self.employees[1].pk, 'data': {'email': 'moved@example.com'}},
+            {'op': 'update', 'id': self.employees[0].pk, 'data': {'email': second}},
+        ])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Employee.objects.get(email=second).pk, self.employees[0].pk)
+
+    def test_ndjson_batch_queries(self):
+        body = ''.join(json.dumps({'op': 'create', 'data': self.new_employee(i)}) + '\n' for i in range(300))
+        body += ''.join(json.dumps({'op': 'update', 'id': employee.pk, 'data': {'years_of_experience': 11}}) + '\n'
+                        for employee in self.employees)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(reverse('employee-bulk'), body, content_type='application/x-ndjson')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Employee.objects.count(), 303)
+        self.assertEqual(set(Employee.objects.values_list('years_of_experience', flat=True)), {3, 11})
+        # batched lookups and writes, not one query per item
+        self.assertLess(len(queries), 60)
+
+
+class ReadPathTestCase(TestCase):
+    # the fast read path must send the bytes of ModelSerializer + JSONRenderer
+
+    def setUp(self):
+        self.client = APIClient()
+        industry = Industry.objects.create(name='Textiles')
+        Employee.objects.create(
+            first_name='Zoë', last_name='O Brien', email='zoe@example.com', gender='F',
+            date_of_birth=date(1990, 2, 28), salary='50000.5', years_of_experience=5, industry=industry,
+        )
+        Employee.objects.create(
+            first_name='Jan', last_name='Nowak', email='jan@example.com',
+            date_of_birth=date(1975, 12, 1), salary=0, years_of_experience=0,
+        )
+
+    def expected(self, data):
+        return JSONRenderer().render(data)
+
+    def test_list_and_detail(self):
+        employees = Employee.objects.order_by('id')
+        response = self.client.get(reverse('employee-list'))
+        self.assertEqual(
+            json.loads(response.content)['results'],
+            json.loads(self.expected(EmployeeSerializer(employees, many=True).data)),
+        )
+        self.assertIn(self.expected(EmployeeSerializer(employees, many=True).data)[1:-1], response.content)
+
+        for employee in employees:
+            response = self.client.get(reverse('employee-detail', args=[employee.pk]))
+            self.assertEqual(response.content, self.expected(EmployeeSerializer(employee).data))
+        self.assertEqual(self.client.get(reverse('employee-detail', args=[0])).status_code, 404)
+        self.assertEqual(self.client.get(reverse('employee-detail', args=['abc'])).status_code, 404)
+
+    def test_renderer(self):
+        data = {
+            'text': 'Zoë     "quoted"', 'none': None, 'decimal': Decimal('1.10'), 'float': 0.1,
+            'date': date(2020, 1, 2), 'datetime': datetime(2020, 1, 2, 3, 4, 5, 678901), 1: [True, {}],
+        }
+        self.assertEqual(FastJSONRenderer().render(data), JSONRenderer().render(data))
+        self.assertEqual(FastJSONRenderer().render(data, 'application/json; indent=2'),
+                         JSONRenderer().render(data, 'application/json; indent=2'))
+
+    def test_fields(self):
+        url = reverse('employee-list')
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, {'fields': 'salary,first_name,id'})
+        self.assertEqual(response.json()['results'], [
+            {'id': employee.pk, 'salary': str(employee.salary), 'first_name': employee.first_name}
+            for employee in Employee.objects.order_by('id')
+        ])
+        self.assertNotIn('email', queries[0]['sql'])
+        employee = Employee.objects.get(email='zoe@example.com')
+        response = self.client.get(reverse('employee-detail', args=[employee.pk]), {'fields': 'date_of_birth'})
+        self.assertEqual(response.json(), {'id': employee.pk, 'date_of_birth': '1990-02-28'})
+        response = self.client.get(url, {'fields': 'salary,password'})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('password', response.json()['fields'])
+
+    def test_columnar(self):
+        url = reverse('employee-list')
+        employees = Employee.objects.order_by('id')
+        response = self.client.get(url, {'format': 'columnar', 'fields': 'last_name,industry', 'page_size': 1})
+        self.assertEqual(response['Content-Type'], 'application/vnd.hrbro.columnar+json')
+        data = response.json()
+        industry = Industry.objects.get()
+        self.assertEqual(data['columns'], ['id', 'last_name', 'industry'])
+        self.assertEqual(data['data'], {
+            'id': [employees[0].pk], 'last_name': [employees[0].last_name], 'industry': [industry.pk],
+        })
+        self.assertEqual(data['dictionaries'], {'industry': {str(industry.pk): 'Textiles'}})
+        self.assertIsNone(data['previous'])
+        data = self.client.get(data['next']).json()
+        self.assertEqual(data['data']['industry'], [None])
+        self.assertEqual(data['dictionaries'], {'industry': {}})
+
+        rows = self.client.get(url).json()['results']
+        data = self.client.get(url, {'format': 'columnar'}).json()
+        self.assertEqual([dict(zip(data['columns'], values)) for values in zip(*data['data'].values())], rows)
+
+        # the other actions don't offer it
+        detail = reverse('employee-detail', args=[employees[0].pk])
+        self.assertEqual(self.client.get(detail, {'format': 'columnar'}).status_code, 404)
+        response = self.client.get(detail, HTTP_ACCEPT='application/vnd.hrbro.columnar+json')
+        self.assertEqual(response.status_code, 406)
+        response = self.client.post(url, {}, format='json', HTTP_ACCEPT='application/vnd.hrbro.columnar+json')
+        self.assertEqual(response.status_code, 406)
+
+    def test_gzip(self):
+        create_employees(
+            20, genders=(None,), date_of_birth=lambda i: date(1980, 1, 1),
+            salary=lambda i: 1000 * i, years_of_experience=lambda i: i,
+        )
+        url = reverse('employee-list')
+        response = self.client.get(url, HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(json.loads(gzip.decompress(response.content)), self.client.get(url).json())
+        # small responses as they are
+        response = self.client.get(url, {'fields': 'id', 'page_size': 2}, HTTP_ACCEPT_ENCODING='gzip')
+        self.assertFalse(response.has_header('Content-Encoding'))
+
+
+class AsyncViewTestCase(TransactionTestCase):
+    # the pool threads have connections of their own, so the rows are committed
+
+    def setUp(self):
+        cache.clear()
+        industry = Industry.objects.create(name='Industry 1')
+        for index in range(3):
+            Employee.objects.create(
+                first_name='John', last_name=f'Doe {index}', email=f'john.doe{index}@example.com',
+                gender='MF'[index % 2], date_of_birth=date(1980 + index, 1, 1), salary=50000 + index * 1000,
+                years_of_experience=5 * index, industry=industry,
+            )
+
+    @async_to_sync
+    async def get(self, name, params):
+        return await AsyncClient().get(reverse(name), params)
+
+    def test_same_responses(self):
+        params = {'group_by': 'gender', 'metrics': 'salary:mean'}
+        for name in ('averages_per_industry', 'averages_per_yoe', 'agestats', 'genderstats', 'stats'):
+            expected = self.client.get(reverse(name), params)
+            response = self.get(f'async-{name}', params)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.content, expected.content)
+
+        response = self.get('async-employee-list', {'page_size': 2})
+        expected = self.client.get(reverse('employee-list'), {'page_size': 2})
+        self.assertEqual(response.json()['results'], expected.json()['results'])
+        self.assertIn('/api/async/employees/?cursor=', response.json()['next'])
+        self.assertEqual(self.get('async-stats', {'group_by': 'id'}).status_code, 400)
+
+    @override_settings(ASYNC_POOL_SIZE=2)
+    def test_bounded_pool(self):
+        lock = threading.Lock()
+        running, peak = [0], [0]
+
+        def slow_stats(statistic):
+            with lock:
+                running[0] += 1
+                peak[0] = max(peak[0], running[0])
+            time.sleep(0.05)
+            with lock:
+                running[0] -= 1
+            return stats.compute_stats(statistic)
+
+        async def dashboards():
+            # distinct query strings, so that none is answered from the cache
+            client = AsyncClient()
+            return await asyncio.gather(*(
+                client.get(reverse('async-averages_per_yoe'), {'client': number}) for number in range(8)))
+
+        with mock.patch('hrapi.views.compute_stats', slow_stats):
+            responses = async_to_sync(dashboards)()
+        self.assertEqual({response.status_code for response in responses}, {200})
+        self.assertEqual(peak[0], 2)
+
+
+class InstrumentationTestCase(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        for histogram in instrumentation.HISTOGRAMS:
+            histogram.clear()
+        industry = Industry.objects.create(name='Industry 1')
+        for index in range(3):
+            Employee.objects.create(
+                first_name='John', last_name=f'Doe {index}', email=f'john.doe{index}@example.com',
+                gender='M', date_of_birth=date(1980 + index, 1, 1), salary=50000,
+                years_of_experience=5 * index, industry=industry,
+            )
+
+    @override_settings(STATS_ENGINE='pandas')
+    def test_server_timing(self):
+        timing = self.client.get(reverse('agestats'))['Server-Timing']
+        self.assertRegex(timing, r'^db;dur=[0-9.]+;desc="1 queries, 3 rows", dataframe;dur=[0-9.]+, '
+                                 r'aggregate;dur=[0-9.]+, stats;dur=[0-9.]+, serialize;dur=[0-9.]+, total;dur=[0-9.]+$')
+        # answered from the cache
+        self.assertRegex(self.client.get(reverse('agestats'))['Server-Timing'], r'^db;dur=0.0;desc="0 queries, 0 rows"')
+
+        metrics = self.client.get(reverse('metrics')).content.decode()
+        self.assertIn('hrapi_request_duration_seconds_count{view="agestats",method="GET",status="200"} 2\n', metrics)
+        self.assertIn('hrapi_request_rows_bucket{view="agestats",le="1.0"} 1\n', metrics)
+        self.assertIn('hrapi_request_rows_bucket{view="agestats",le="10.0"} 2\n', metrics)
+        self.assertIn('hrapi_request_phase_seconds_count{view="agestats",phase="dataframe"} 1\n', metrics)
+
+    @override_settings(SLOW_REQUEST_THRESHOLD=0, SLOW_QUERY_THRESHOLD=0)
+    def test_slow_request_log(self):
+        with self.assertLogs('hrapi.slow', 'WARNING') as logs:
+            self.client.get(reverse('employee-detail', args=[Employee.objects.first().pk]))
+        self.assertEqual(len(logs.output), 1)
+        self.assertIn('GET /api/employees/', logs.output[0])
+        self.assertIn('1 queries', logs.output[0])
+        self.assertIn('SELECT', logs.output[0])
+
+    def test_histogram(self):
+        histogram = instrumentation.Histogram('size', 'Sizes', [1, 10], ['view'])
+        for value in (0, 1, 5, 50):
+            histogram.observe(value, 'a"b')
+        self.assertEqual(histogram.exposition().splitlines()[2:], [
+            'size_bucket{view="a\\"b",le="1.0"} 2',
+            'size_bucket{view="a\\"b",le="10.0"} 3',
+            'size_bucket{view="a\\"b",le="+Inf"} 4',
+            'size_sum{view="a\\"b"} 56.0',
+            'size_count{view="a\\"b"} 4',
+        ])
+
+
+@override_settings(DATABASE_REPLICAS=['replica'], REPLICA_MAX_LAG=None)
+class ReplicaRouterTestCase(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        replicas.lags.clear()
+        self.router = replicas.ReplicaRouter()
+
+    def read(self, method='GET', cookies=None):
+        # the database the reads and writes of a request go to, in order
+        request = RequestFactory().generic(method, '/api/employees/')
+        request.COOKIES.update(cookies or {})
+        self.response = HttpResponse()
+
+        def view(request):
+            self.response.seen = [self.router.db_for_read(Employee)]
+            if request.method == 'POST':
+                self.response.seen.append(self.router.db_for_write(Employee))
+                self.response.seen.append(self.router.db_for_read(Employee))
+            return self.response
+
+        return replicas.ReplicaMiddleware(view)(request).seen
+
+    def test_routing(self):
+        self.assertEqual(self.read(), ['replica'])
+        self.assertEqual(self.read('HEAD'), ['replica'])
+        self.assertEqual(self.read('POST'), ['default', 'default', 'default'])
+        # outside requests, management commands and the shell
+        self.assertEqual(self.router.db_for_read(Employee), 'default')
+        self.assertFalse(self.router.allow_migrate('replica', 'hrapi'))
+        self.assertTrue(self.router.allow_migrate('default', 'hrapi'))
+
+    def test_write_pins_the_request(self):
+        token = replicas.current.set(replicas.ReplicaState())
+        try:
+            self.assertEqual(self.router.db_for_read(Employee), 'replica')
+            self.assertEqual(self.router.db_for_write(Employee), 'default')
+            self.assertEqual(self.router.db_for_read(Employee), 'default')
+        finally:
+            replicas.current.reset(token)
+
+    def test_read_after_write(self):
+        self.assertEqual(self.read('POST'), ['default', 'default', 'default'])
+        cookies = {name: morsel.value for name, morsel in self.response.cookies.items()}
+        self.assertEqual(self.read(cookies=cookies), ['default'])
+        # other clients
+        self.assertEqual(self.read(), ['replica'])
+        with override_settings(REPLICA_PIN_SECONDS=0):
+            self.assertEqual(self.read(cookies=cookies), ['replica'])
+        self.assertEqual(self.read(cookies={replicas.WRITE_COOKIE: 'soon'}), ['replica'])
+
+    def test_cache_fills_after_write(self):
+        Industry.objects.create(name='Tech')
+        token = replicas.current.set(replicas.ReplicaState())
+        try:
+            replicas.pin_after_write()
+            self.assertEqual(self.router.db_for_read(Employee), 'default')
+        finally:
+            replicas.current.reset(token)
+        with override_settings(REPLICA_PIN_SECONDS=0):
+            token = replicas.current.set(replicas.ReplicaState())
+            try:
+                replicas.pin_after_write()
+                self.assertEqual(self.router.db_for_read(Employee), 'replica')
+            finally:
+                replicas.current.reset(token)
+
+    @override_settings(REPLICA_MAX_LAG=10)
+    def test_replication_lag(self):
+        with mock.patch('hrapi.replicas.replication_lag', return_value=2.0) as lag:
+            self.assertEqual(self.read(), ['replica'])
+            self.assertEqual(self.read(), ['replica'])
+        # checked once every REPLICA_LAG_CHECK_INTERVAL
+        self.assertEqual(lag.call_count, 1)
+
+        replicas.lags.clear()
+        with mock.patch('hrapi.replicas.replication_lag', return_value=30.0):
+            self.assertEqual(self.read(), ['default'])
+        replicas.lags.clear()
+        with mock.patch('hrapi.replicas.replication_lag', side_effect=DatabaseError):
+            self.assertEqual(self.read(), ['default'])
+
+
+class StatsHistoryTestCase(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.industry = Industry.objects.create(name='Tech')
+        create_team(self.industry)
+
+    def snapshot(self, day):
+        out = StringIO()
+        call_command('snapshot_stats', date=day, stdout=out)
+        return out.getvalue()
+
+    def test_snapshot_stats(self):
+        self.assertIn('Stored the statistics of', self.snapshot(date.today()))
+        stored = StatsSnapshot.objects.get(date=date.today())
+        self.assertEqual(stored.employees, 10)
+        self.assertEqual(stored.industry, query.industry_stats_sql())
+        self.assertEqual(stored.yoe, query.yoe_stats_sql())
+        self.assertEqual(stored.age, query.age_stats_sql())
+        self.assertEqual(stored.gender, json.loads(json.dumps(query.gender_stats_sql())))
+        self.assertIn('Replaced the statistics of', self.snapshot(date.today()))
+        self.assertEqual(StatsSnapshot.objects.count(), 1)
+
+    def test_history(self):
+        today = date.today()
+        self.snapshot(date(today.year - 1, 1, 1))
+        Employee.objects.filter(email='employee0@example.com').update(salary=100000)
+        self.snapshot(date(today.year - 1, 1, 2))
+        Industry.objects.create(name='Banks').employee_set.add(Employee.objects.get(email='employee1@example.com'))
+        self.snapshot(date(today.year - 1, 1, 3))
+
+        url = reverse('stats-history')
+        params = {'metric': 'industry_salary', 'from': f'{today.year - 1}-01-01', 'to': f'{today.year - 1}-12-31'}
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        # read from the snapshots only
+        self.assertFalse([query for query in queries if 'hrapi_employee' in query['sql']])
+        self.assertEqual(response.json()['dates'], [f'{today.year - 1}-01-0{day}' for day in (1, 2, 3)])
+        self.assertEqual(response.json()['series'], {
+            'Tech': [44500.0, 50500.0, 51555.56],
+            'Banks': [None, None, 41000.0],
+        })
+
+        self.assertEqual(self.client.get(url, dict(params, to=f'{today.year - 1}-01-02')).json()['dates'],
+                         [f'{today.year - 1}-01-01', f'{today.year - 1}-01-02'])
+        # the range ends today and starts a year before by default
+        self.assertEqual(self.client.get(url, {'metric': 'yoe_salary'}).json()['dates'], [])
+        self.snapshot(today)
+        self.assertEqual(self.client.get(url, {'metric': 'yoe_salary'}).json()['dates'], [today.isoformat()])
+
+        self.assertEqual(self.client.get(url, {'metric': 'salary'}).status_code, 400)
+        self.assertEqual(self.client.get(url, dict(params, to='tomorrow')).status_code, 400)
+        self.assertEqual(self.client.get(url, dict(params, to=f'{today.year - 2}-01-01')).status_code, 400)
+
+
+class JobsTestCase(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        settings = override_settings(JOB_UPLOAD_DIR=self.directory.name)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        create_team(Industry.objects.create(name='Tech'))
+
+    def test_stats_report(self):
+        params = {'group_by': 'industry,gender', 'metrics': 'salary:mean,salary:count'}
+        response = self.client.post(reverse('job-stats'), params, content_type='application/json')
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.json()['status'], 'queued')
+        self.assertTrue(response['Location'].endswith(reverse('job-detail', kwargs={'pk': response.json()['id']})))
+
+        self.assertEqual(jobs.work(burst=True), 1)
+        job = self.client.get(response['Location']).json()
+        self.assertEqual(job['status'], 'succeeded')
+        self.assertEqual(job['attempts'], 1)
+        self.assertEqual(job['result'], self.client.get(reverse('stats'), params).json())
+        self.assertEqual((job['processed'], job['total']), (2, 2))
+
+        response = self.client.post(reverse('job-stats'), {'group_by': 'shoe_size'}, content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Job.objects.count(), 1)
+
+    def test_import(self):
+        employees = list(synthetic_employees(MOCK_DATA, 30, seed=0))
+        employees[3]['salary'] = None
+        content = '\n'.join(json.dumps(employee) for employee in employees).encode()
+        response = self.client.post(reverse('job-import'), {'file': SimpleUploadedFile('employees.ndjson', content)})
+        self.assertEqual(response.status_code, 202)
+        upload, = os.listdir(self.directory.name)
+        self.assertTrue(upload.endswith('.ndjson'))
+
+        jobs.work(burst=True)
+        job = Job.objects.get()
+        self.assertEqual(job.status, Job.SUCCEEDED, job.error)
+        self.assertEqual(job.result, {'inserted': 29, 'updated': 0, 'unchanged': 0, 'rejected': 1})
+        self.assertEqual((job.processed, job.total), (30, 30))
+        self.assertEqual(Employee.objects.count(), 39)
+        # the upload is gone, the rows refused are kept
+        self.assertEqual(os.listdir(self.directory.name), [f'{upload}.rejects.ndjson'])
+        response = self.client.get(reverse('job-rejects', args=[job.pk]))
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        reject, = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+        self.assertEqual((reject['email'], reject['reason']), (employees[3]['email'], 'missing salary'))
+
+        # until JOB_REJECTS_SECONDS after the import
+        jobs.purge_rejects()
+        self.assertEqual(len(os.listdir(self.directory.name)), 1)
+        os.utime(os.path.join(self.directory.name, f'{upload}.rejects.ndjson'), (0, 0))
+        jobs.work(burst=True)
+        self.assertEqual(os.listdir(self.directory.name), [])
+        self.assertEqual(self.client.get(reverse('job-rejects', args=[job.pk])).status_code, 404)
+
+    def test_failed_job(self):
+        job = jobs.enqueue('import', {'path': os.path.join(self.directory.name, 'missing.json')})
+        with self.assertLogs('hrapi.jobs', 'ERROR'):
+            jobs.work(burst=True)
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.FAILED)
+        self.assertIn('FileNotFoundError', job.error)
+        self.assertIsNotNone(job.finished_at)
+
+        # the upload of a failed import is removed, as are those of the jobs
+        # whose workers were lost too many times
+        path = os.path.join(self.directory.name, 'malformed.json')
+        with open(path, 'w') as file:
+            file.write('[{"first_name": }]')
+        job = jobs.enqueue('import', {'path': path})
+        with self.assertLogs('hrapi.jobs', 'ERROR'):
+            jobs.work(burst=True)
+        self.assertEqual(Job.objects.get(pk=job.pk).status, Job.FAILED)
+        self.assertFalse(os.path.exists(path))
+
+        open(path, 'w').close()
+        job = jobs.enqueue('import', {'path': path})
+        jobs.claim('a')
+        Job.objects.filter(pk=job.pk).update(heartbeat_at=timezone.now() - timedelta(seconds=121), attempts=3)
+        self.assertIsNone(jobs.claim('b'))
+        self.assertEqual(Job.objects.get(pk=job.pk).status, Job.FAILED)
+        self.assertFalse(os.path.exists(path))
+
+    def test_claim(self):
+        first = jobs.enqueue('stats', {'metrics': 'salary:mean'})
+        second = jobs.enqueue('stats', {'metrics': 'salary:max'})
+        self.assertEqual(jobs.claim('a'), first)
+        self.assertEqual(jobs.claim('b'), second)
+        self.assertIsNone(jobs.claim('c'))
+
+        # the worker of the first job died, it runs again until JOB_MAX_ATTEMPTS
+        stale = timezone.now() - timedelta(seconds=121)
+        Job.objects.filter(pk=first.pk).update(heartbeat_at=stale)
+        claimed = jobs.claim('c')
+        self.assertEqual((claimed, claimed.attempts, claimed.worker), (first, 2, 'c'))
+        Job.objects.filter(pk=first.pk).update(heartbeat_at=stale, attempts=3)
+        self.assertIsNone(jobs.claim('d'))
+        first.refresh_from_db()
+        self.assertEqual((first.status, first.error), (Job.FAILED, 'Worker lost'))
+
+    def test_claim_skips_locked_rows(self):
+        job = jobs.enqueue('stats', {'metrics': 'salary:mean'})
+        with CaptureQueriesContext(connection) as queries:
+            jobs.claim('a')
+        select = next(query['sql'] for query in queries if query['sql'].startswith('SELECT'))
+        if connection.features.has_select_for_update_skip_locked:
+            self.assertIn('FOR UPDATE SKIP LOCKED', select)
+        self.assertEqual(Job.objects.get(pk=job.pk).status, Job.RUNNING)
+
+
+class DetailCacheTestCase(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        caches['objects'].clear()
+        objectcache.details.clear()
+        instrumentation.DETAIL_CACHE_LOOKUPS.clear()
+        self.client = APIClient()
+        self.industry = Industry.objects.create(name='Industry 1')
+        self.employee = Employee.objects.create(
+            first_name='John', last_name='Doe', email='john.doe@example.com',
+            gender='M', date_of_birth=date(1990, 1, 1), salary=50000,
+            years_of_experience=5, industry=self.industry
+        )
+        self.url = reverse('employee-detail', args=[self.employee.pk])
+
+    def test_read_through(self):
+        first = self.client.get(self.url).json()
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(self.url).json(), first)
+        # ?fields= isn't cached
+        self.assertEqual(self.client.get(self.url, {'fields': 'salary'}).json(),
+                         {'id': self.employee.pk, 'salary': '50000.00'})
+        self.assertEqual(self.client.get(reverse('employee-detail', args=[0])).status_code, 404)
+        self.assertEqual(self.client.get(reverse('employee-detail', args=[0])).status_code, 404)
+        self.assertEqual(self.client.get(reverse('employee-detail', args=['²'])).status_code, 404)
+        lookups = instrumentation.DETAIL_CACHE_LOOKUPS
+        self.assertEqual((lookups.value('employee', 'hit'), lookups.value('employee', 'miss')), (1, 3))
+        self.assertIn('hrapi_detail_cache_lookups_total{table="employee",result="hit"} 1',
+                      self.client.get(reverse('metrics')).content.decode())
+
+    def test_invalidation(self):
+        self.client.get(self.url)
+        data = {**self.client.get(self.url).json(), 'salary': '60000.00'}
+        self.client.put(self.url, data, format='json')
+        self.assertEqual(self.client.get(self.url).json()['salary'], '60000.00')
+
+        Employee.objects.bulk_update([Employee(pk=self.employee.pk, salary=70000)], ['salary'])
+        self.assertEqual(self.client.get(self.url).json()['salary'], '70000.00')
+        Employee.objects.filter(pk=self.employee.pk).update(years_of_experience=9)
+        self.assertEqual(self.client.get(self.url).json()['years_of_experience'], 9)
+
+        industry_url = reverse('industry-detail', args=[self.industry.pk])
+        self.client.get(industry_url)
+        self.industry.name = 'Renamed'
+        self.industry.save()
+        self.assertEqual(self.client.get(industry_url).json()['name'], 'Renamed')
+        # the employees lose their industry with it
+        self.industry.delete()
+        self.assertEqual(self.client.get(industry_url).status_code, 404)
+        self.assertIsNone(self.client.get(self.url).json()['industry'])
+
+        self.client.delete(self.url)
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+
+    def test_invalidation_of_batches(self):
+        other = Employee.objects.create(
+            first_name='Jane', last_name='Doe', email='jane.doe@example.com',
+            gender='F', date_of_birth=date(1985, 1, 1), salary=60000, years_of_experience=8,
+        )
+        other_url = reverse('employee-detail', args=[other.pk])
+        self.client.get(self.url)
+        self.client.get(other_url)
+        response = self.client.post(reverse('employee-bulk'), [
+            {'op': 'update', 'id': self.employee.pk, 'data': {'salary': '51000.00'}},
+        ], format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.client.get(self.url).json()['salary'], '51000.00')
+        # in another shard
+        with self.assertNumQueries(0):
+            self.client.get(other_url)
+
+        path = os.path.join(tempfile.mkdtemp(), 'employees.ndjson')
+        with open(path, 'w') as file:
+            file.write(json.dumps({**self.client.get(self.url).json(), 'date_of_birth': '01/01/1990', 'industry': None,
+                                   'salary': 52000}) + '\n')
+        with redirect_stdout(StringIO()):
+            call_command('importer', path, engine='bulk')
+        self.assertEqual(self.client.get(self.url).json()['salary'], '52000.00')
+
+        # the copy engine replaces the rows wholesale, in SQL
+        with connection.cursor() as cursor:
+            cursor.execute('UPDATE hrapi_employee SET years_of_experience = 20')
+        objectcache.invalidate_all('employee')
+        self.assertEqual(self.client.get(other_url).json()['years_of_experience'], 20)
+
+    @override_settings(DETAIL_CACHE_MAX_ENTRIES=2)
+    def test_eviction(self):
+        others = Employee.objects.bulk_create([
+            Employee(
+                first_name='Jane', last_name='Doe', email=f'jane.doe{index}@example.com', gender='F',
+                date_of_birth=date(1985, 1, 1), salary=60000, years_of_experience=8,
+            )
+            for index in range(2)
+        ])
+        evictions = instrumentation.DETAIL_CACHE_EVICTIONS.value('employee')
+        for employee in [self.employee, *others]:
+            self.client.get(reverse('employee-detail', args=[employee.pk]))
+        self.assertEqual(instrumentation.DETAIL_CACHE_EVICTIONS.value('employee'), evictions + 1)
+        self.assertEqual(list(objectcache.details.entries), [('employee', others[0].pk), ('employee', others[1].pk)])
+        with self.assertNumQueries(0):
+            self.client.get(reverse('employee-detail', args=[others[0].pk]))
@@ -1,10 +1,16 @@
 from django.urls import path, include
 from rest_framework import routers
-from hrapi.views import EmployeeViewSet, IndustryViewSet, GeneralStatistic, YoEStats, AgeStats, GenderStats
+from hrapi.views import EmployeeViewSet, IndustryViewSet, GeneralStatistic, YoEStats, AgeStats, GenderStats, StatsQueryView
+from hrapi.views import JobViewSet, StatsHistoryView
+from hrapi.views import (
+    async_employee_list, async_general_statistic, async_yoe_stats, async_age_stats, async_gender_stats,
+    async_stats_query,
+)
 
 router = routers.DefaultRouter()
 router.register(r'employees', EmployeeViewSet)
 router.register(r'industries', IndustryViewSet)
+router.register(r'jobs', JobViewSet)
 
 urlpatterns = [
     path('', include(router.urls)),
@@ -12,4 +18,13 @@ urlpatterns = [
     path('averages_per_yoe/', YoEStats.as_view(), name='averages_per_yoe'),
     path('agestats/', AgeStats.as_view(), name='agestats'),
     path('genderstats/', GenderStats.as_view(), name='genderstats'),
+    path('stats/', StatsQueryView.as_view(), name='stats'),
+    path('stats/history/', StatsHistoryView.as_view(), name='stats-history'),
+    # same responses, served without holding a thread per request under ASGI
+    path('async/employees/', async_employee_list, name='async-employee-list'),
+    path('async/averages_per_industry/', async_general_statistic, name='async-averages_per_industry'),
+    path('async/averages_per_yoe/', async_yoe_stats, name='async-averages_per_yoe'),
+    path('async/agestats/', async_age_stats, name='async-agestats'),
+    path('async/genderstats/', async_gender_stats, name='async-genderstats'),
+    path('async/stats/', async_stats_query, name='async-stats'),
 ]
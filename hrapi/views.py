@@ -1,153 +1,245 @@
-import json
-import math
-
-from rest_framework.viewsets import ModelViewSet
+from pathlib import Path
+import os
+import uuid
+
+from django.conf import settings
+from django.db import transaction
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from rest_framework import status
+from rest_framework.decorators import action
+from rest_framework.generics import get_object_or_404
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.parsers import JSONParser, MultiPartParser
+from rest_framework.reverse import reverse
+from rest_framework.viewsets import ModelViewSet, ReadOnlyModelViewSet
 from rest_framework.response import Response
+from rest_framework.settings import api_settings
 from rest_framework.views import APIView
-from hrapi.models import Employee, Industry
-from hrapi.serializers import EmployeeSerializer, IndustrySerializer
-import pandas as pd
-import numpy as np
-from datetime import datetime
-
-
-class EmployeeViewSet(ModelViewSet):
+from hrapi.bulk import BulkChange
+from hrapi.caching import CachedResponseMixin
+from hrapi.filters import EmployeeFilterBackend
+from hrapi.history import trend
+from hrapi.instrumentation import exposition, timer
+from hrapi.jobs import enqueue, rejects_path, stats_query
+from hrapi.models import Employee, Industry, Job
+from hrapi.objectcache import CachedDetailMixin
+from hrapi.offload import offloaded
+from hrapi.pagination import RecentFirstPagination
+from hrapi.parsers import NDJSONParser
+from hrapi.query import StatsQuery
+from hrapi.renderers import ColumnarRenderer, CSVRenderer, NDJSONRenderer, columnar
+from hrapi.serializers import EmployeeReadSerializer, EmployeeSerializer, IndustrySerializer, JobSerializer
+from hrapi.stats import AGE_BINS, YOE_BINS, get_age, compute_stats
+
+
+class EmployeeViewSet(CachedDetailMixin, ModelViewSet):
     queryset = Employee.objects.all()
     serializer_class = EmployeeSerializer
-
-
-class IndustryViewSet(ModelViewSet):
+    filter_backends = [EmployeeFilterBackend]
+
+    EXPORT_COLUMNS = [
+        'id', 'first_name', 'last_name', 'email', 'gender', 'date_of_birth',
+        'salary', 'years_of_experience', 'industry', 'industry_name',
+    ]
+
+    # reads skip the ModelSerializer machinery, same output, see EmployeeReadSerializer.
+    # ?fields=first_name,salary reads and sends only those columns (and the id),
+    # ?format=columnar sends the lists as columns, see hrapi.renderers.columnar
+    renderer_classes = [*api_settings.DEFAULT_RENDERER_CLASSES, ColumnarRenderer]
+
+    def get_renderers(self):
+        # only list() builds the columns, the other actions (details, writes,
+        # their errors) are not offered as columnar
+        renderers = super().get_renderers()
+        if self.action == 'list':
+            return renderers
+        return [renderer for renderer in renderers if not isinstance(renderer, ColumnarRenderer)]
+
+    def list(self, request, *args, **kwargs):
+        fields = EmployeeReadSerializer.fields(request.query_params.get('fields'))
+        queryset = self.filter_queryset(self.get_queryset()).values(*fields)
+        page = self.paginate_queryset(queryset)
+        rows = EmployeeReadSerializer(list(queryset) if page is None else page, many=True).data
+        if request.accepted_renderer.format == 'columnar':
+            data = columnar(rows, fields)
+            if 'industry' in fields:
+                # the names of the industries once, the rows hold their pk
+                pks = {pk for pk in data['data']['industry'] if pk is not None}
+                data['dictionaries'] = {'industry': dict(Industry.objects.filter(pk__in=pks).values_list('id', 'name'))}
+            if page is not None:
+                data.update(next=self.paginator.get_next_link(), previous=self.paginator.get_previous_link())
+            return Response(data)
+        if page is not None:
+            return self.get_paginated_response(rows)
+        return Response(rows)
+
+    def retrieve_uncached(self, request, *args, **kwargs):
+        # get_object on the values() rows, the details without ?fields= are
+        # cached by CachedDetailMixin, see hrapi.objectcache
+        queryset = self.filter_queryset(self.get_queryset())\
+            .values(*EmployeeReadSerializer.fields(request.query_params.get('fields')))
+        lookup = self.lookup_url_kwarg or self.lookup_field
+        employee = get_object_or_404(queryset, **{self.lookup_field: kwargs[lookup]})
+        self.check_object_permissions(request, employee)
+        return Response(EmployeeReadSerializer(employee).data)
+
+    @action(detail=False, renderer_classes=[NDJSONRenderer, CSVRenderer])
+    def export(self, request):
+        # Streams the whole (filtered) table with a server side cursor, rows go
+        # out chunk by chunk instead of being serialized all at once in memory.
+        # ?format=ndjson or ?format=csv
+        queryset = self.filter_queryset(self.get_queryset())
+        # the rows are read after the request is handled, on the database chosen now
+        rows = queryset.using(queryset.db)\
+            .order_by('id')\
+            .values_list(*self.EXPORT_COLUMNS[:-1], 'industry__name')\
+            .iterator(chunk_size=2000)
+        rows = ((*row[:6], str(row[6]), *row[7:]) for row in rows)
+        renderer = request.accepted_renderer
+        response = StreamingHttpResponse(
+            renderer.stream(self.EXPORT_COLUMNS, rows),
+            content_type=f'{renderer.media_type}; charset={renderer.charset}',
+        )
+        response['Content-Disposition'] = f'attachment; filename="employees.{renderer.format}"'
+        return response
+
+    @action(detail=False, methods=['post'], parser_classes=[JSONParser, NDJSONParser])
+    def bulk(self, request):
+        # Creates, updates and deletes as a JSON array or NDJSON, applied in
+        # one transaction when they are all valid, see hrapi.bulk.
+        # Answers the result of every item, in order.
+        change = BulkChange(request.data)
+        with transaction.atomic():
+            if not change.is_valid():
+                return Response(change.results, status=status.HTTP_400_BAD_REQUEST)
+            change.save()
+        return Response(change.results)
+
+
+class IndustryViewSet(CachedDetailMixin, ModelViewSet):
     queryset = Industry.objects.all()
     serializer_class = IndustrySerializer
 
 
-def get_age(date_of_birth):
-    now = datetime.now()
-    age = now.year - date_of_birth.year - ((now.month, now.day) < (date_of_birth.month, date_of_birth.day))
-    return age
-
-
-def prettify_brackets(bracket_str):
-    pretty_bracket = bracket_str.replace('(', '').replace(']', '').replace(',', ' to').replace('to inf', '+')
-    return pretty_bracket
-
-
-class GeneralStatistic(APIView):
-
-    def get(self, request):
-        employees = Employee.objects.all().select_related('industry')
-        df = pd.DataFrame(employees.values(
-            'id', 'first_name', 'last_name', 'email', 'gender',
-            'date_of_birth', 'salary', 'years_of_experience',
-            'industry__name'
-        ))
-
-        # adding an age column
-        df['age'] = df['date_of_birth'].apply(get_age)
-
-        # more clarity in api output
-        df = df.rename(columns={'industry__name': 'industry'})
-
-        # grouping, averaging
-        industry_stats = df.groupby('industry').agg(
-            {
-                'salary': 'mean',
-                'years_of_experience': 'mean',
-                'age': 'mean'
-            }
-        )
-
-        # rounding happen after calculation for more accuracy
-        industry_stats['salary'] = industry_stats['salary'].astype(float).round(2)
-        industry_stats['years_of_experience'] = industry_stats['years_of_experience'].round(2)
-        industry_stats['age'] = industry_stats['age'].round(1)
-
-        industry_stats = industry_stats.reset_index()
-        industry_stats = industry_stats.sort_values('salary', ascending=False)
-
-        # Convert the pandas dataframe to a JSON response
-        response_data = industry_stats.to_dict(orient='records')
-        return Response(response_data)
-
+# The statistics are computed by the engine chosen with the STATS_ENGINE
+# setting, see hrapi.stats. Their responses are cached until the next write,
+# see hrapi.caching.
 
-class YoEStats(APIView):
+class GeneralStatistic(CachedResponseMixin, APIView):
+    age_dependent = True
 
-    def get(self, request):
-        employees = Employee.objects.all()
-        df = pd.DataFrame(employees.values())
-        # Define the bins for the years of experience
-        bins = [0, 5, 10, 15, 20, 25, 30, float('inf')]
+    def get_uncached(self, request):
+        return Response(compute_stats('industry'))
 
-        # Bin edges are exclusive on the right side.
-        # So someone with exactly 5 years of experience would fall into the 5-10
-        labels = ['1-5', '5-10', '10-15', '15-20', '20-25', '25-30', 'More than 30']
-        df['experience_bracket'] = pd.cut(
-            df['years_of_experience'], bins=bins, labels=labels)
 
-        # Group by the experience bracket and calculate the mean salary
-        salary_by_experience = df.groupby('experience_bracket')['salary'].mean()
-        salary_by_experience = salary_by_experience.astype(float).round(2)
-        salary_by_experience = salary_by_experience.reset_index()
+class YoEStats(CachedResponseMixin, APIView):
 
-        # Convert the pandas dataframe to a JSON response
-        response_data = salary_by_experience.to_dict(orient='records')
-        return Response(response_data)
+    def get_uncached(self, request):
+        return Response(compute_stats('yoe'))
 
 
-class AgeStats(APIView):
+class AgeStats(CachedResponseMixin, APIView):
+    age_dependent = True
 
-    def get(self, request):
-        employees = Employee.objects.all()
-        df = pd.DataFrame(employees.values())
+    def get_uncached(self, request):
+        return Response(compute_stats('age'))
 
-        # adding an age column
-        df['age'] = df['date_of_birth'].apply(get_age)
 
-        # define age bins and labels
-        age_bins = [20, 30, 40, 50, float('inf')]
-        year_bins = [0, 5, 10, 15, 20, 30, float('inf')]
+class GenderStats(CachedResponseMixin, APIView):
 
-        result = df.groupby([pd.cut(
-            df['years_of_experience'], year_bins), pd.cut(df['age'], age_bins)])[
-            'salary'].mean()
+    def get_uncached(self, request):
+        return Response(compute_stats('gender'))
 
-        # create a nested dictionary of results
-        response_data = {}
-        for years, age in result.index:
-            years_str = prettify_brackets(str(years)) + ' years of experience'
-            age_str = prettify_brackets(str(age)) + ' years old'
-            salary = result[(years, age)]
-            if years_str not in response_data:
-                response_data[years_str] = {}
-            response_data[years_str][age_str] = round(float(salary), 2)
 
-        # Return the response
-        return Response(response_data)
+class StatsQueryView(CachedResponseMixin, APIView):
+    # Any grouping of the employees, e.g.
+    # ?group_by=industry&metrics=salary:mean,salary:count&filter=gender:eq:F,age:gt:40
+    # &explain=true returns the SQL and the query plan instead, see hrapi.query
+    age_dependent = True
 
+    def get_uncached(self, request):
+        query = StatsQuery.from_params(request.query_params, yoe_bins=YOE_BINS, age_bins=AGE_BINS)
+        if request.query_params.get('explain') in ('1', 'true'):
+            return Response(query.explain())
+        with timer('stats'):
+            return Response(query.results())
 
-class GenderStats(APIView):
 
-    def get(self, request):
-        employees = Employee.objects.all()
-        df = pd.DataFrame(employees.values())
+class StatsHistoryView(CachedResponseMixin, APIView):
+    # Trends over the daily snapshots of the statistics, e.g.
+    # ?metric=industry_salary&from=2026-01-01&to=2026-06-30, see hrapi.history.
+    # Cached until the next snapshot, and until midnight as the range ends
+    # today by default.
+    cache_tables = ('statssnapshot',)
+    age_dependent = True
 
-        year_bins = [0, 5, 10, 15, 20, 30, float('inf')]
+    def get_uncached(self, request):
+        return Response(trend(request.query_params))
 
-        # Drop gender column before grouping by gender and years_of_experience bins
-        result = df.groupby([df['gender'], pd.cut(df['years_of_experience'], year_bins)])[
-            'salary'].mean()
-        result = result.reset_index()
 
-        # just for the eyes
-        result['years_of_experience'] = result['years_of_experience'].astype(str)\
-            .str.replace('(', '').str.replace(']', '').str.replace(',', ' to')
+class JobViewSet(ReadOnlyModelViewSet):
+    # Imports and statistics reports run in the background by the run_workers
+    # command, see hrapi.jobs. Both actions answer 202 with the job queued,
+    # to poll at its Location until it succeeded or failed.
+    queryset = Job.objects.all()
+    serializer_class = JobSerializer
+    pagination_class = RecentFirstPagination
 
-        # Group by gender again to create separate sections for males and females
-        result = result.groupby('gender')\
-            .apply(
-            lambda x: x.drop('gender', axis=1).to_dict(orient='records')
-        ).to_dict()
+    UPLOAD_EXTENSIONS = ('.json', '.ndjson', '.jsonl', '.csv')
 
-        return Response(result)
+    @action(detail=False, methods=['post'], url_path='import', url_name='import', parser_classes=[MultiPartParser])
+    def import_file(self, request):
+        # a file field with the employees as for the importer, JSON, NDJSON or CSV
+        upload = request.FILES.get('file')
+        if upload is None:
+            raise ValidationError({'file': 'Expected a JSON, NDJSON or CSV file'})
+        extension = Path(upload.name).suffix.lower()
+        if extension not in self.UPLOAD_EXTENSIONS:
+            # the format is then found from the content, see hrapi.reader
+            extension = ''
+        path = Path(settings.JOB_UPLOAD_DIR) / f'{uuid.uuid4().hex}{extension}'
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, 'wb') as file:
+            for chunk in upload.chunks():
+                file.write(chunk)
+        return self.queued(enqueue('import', {'path': str(path)}))
 
+    @action(detail=False, methods=['post'], parser_classes=[JSONParser])
+    def stats(self, request):
+        # the query parameters of /api/stats/ as a JSON object, e.g.
+        # {"group_by": "industry,gender", "metrics": "salary:p50,salary:p99"}
+        params = request.data
+        if not isinstance(params, dict) or not all(isinstance(value, str) for value in params.values()):
+            raise ValidationError('Expected the query parameters of /api/stats/ as an object of strings')
+        stats_query(params)
+        return self.queued(enqueue('stats', params))
 
+    @action(detail=True)
+    def rejects(self, request, pk=None):
+        # the rows an import refused, with the reason, as NDJSON
+        job = self.get_object()
+        path = rejects_path(job) if job.kind == 'import' else None
+        if path is None or not os.path.exists(path):
+            raise NotFound('No rows refused, or no longer kept')
+        return FileResponse(
+            open(path, 'rb'), content_type='application/x-ndjson', filename=f'job-{job.pk}-rejects.ndjson')
+
+    def queued(self, job):
+        location = reverse('job-detail', kwargs={'pk': job.pk}, request=self.request)
+        return Response(self.get_serializer(job).data, status=status.HTTP_202_ACCEPTED, headers={'Location': location})
+
+
+def metrics(request):
+    # the histograms of hrapi.instrumentation, in the Prometheus text format
+    return HttpResponse(exposition(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+# Async variants of the list and the statistics for ASGI servers, the same
+# views run on a bounded pool of threads, see hrapi.offload
+
+async_employee_list = offloaded(EmployeeViewSet.as_view({'get': 'list'}, basename='employee', detail=False))
+async_general_statistic = offloaded(GeneralStatistic.as_view())
+async_yoe_stats = offloaded(YoEStats.as_view())
+async_age_stats = offloaded(AgeStats.as_view())
+async_gender_stats = offloaded(GenderStats.as_view())
+async_stats_query = offloaded(StatsQueryView.as_view())
@@ -11,6 +11,8 @@ https://docs.djangoproject.com/en/4.2/ref/settings/
 """
 
 from pathlib import Path
+import os
+import tempfile
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -41,6 +43,11 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # first, so that it times the other middlewares too
+    'hrapi.instrumentation.InstrumentationMiddleware',
+    'hrapi.replicas.ReplicaMiddleware',
+    # before the ones reading or changing the content, see hrapi.compression
+    'hrapi.compression.LargeResponseGZipMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -98,6 +105,101 @@ DATABASES = {
     }
 }
 
+# Read replicas of the default database, every other alias, e.g.
+# DATABASES['replica'] = dict(DATABASES['default'], HOST='db-replica', TEST={'MIRROR': 'default'})
+# The reads of GET, HEAD and OPTIONS requests go to one of them, see hrapi.replicas
+
+DATABASE_REPLICAS = [alias for alias in DATABASES if alias != 'default']
+DATABASE_ROUTERS = ['hrapi.replicas.ReplicaRouter']
+
+# the reads of a client go to the primary for that long after it wrote, and
+# the reads filling the shared caches after anyone wrote, longer than the
+# replication lag
+REPLICA_PIN_SECONDS = 5
+
+# replicas lagging more than that many seconds aren't read from, None to never check
+REPLICA_MAX_LAG = None
+
+
+# Cache
+# https://docs.djangoproject.com/en/4.2/topics/cache/
+
+# file based so that every worker process sees the same generation tokens,
+# see hrapi.caching. The version tokens of the cached details have their own,
+# see hrapi.objectcache: at most 2 * (SHARDS + 1) of them, it never culls.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': Path(tempfile.gettempdir()) / 'hrbro_cache',
+        'TIMEOUT': 300,
+        'OPTIONS': {
+            'MAX_ENTRIES': 1000,
+        },
+    },
+    'objects': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': Path(tempfile.gettempdir()) / 'hrbro_objects',
+        'TIMEOUT': None,
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000,
+        },
+    },
+}
+
+# seconds a statistics response stays cached when nothing is written
+STATS_CACHE_TIMEOUT = 300
+
+# how the statistics endpoints aggregate, see hrapi.stats.STATS_ENGINES :
+# summary (tables maintained on every write), snapshot (memory-mapped
+# columnar copy of the employees shared by the workers, rebuilt from the
+# whole table under a lock by the first read after every write), sql,
+# pandas, python (one pass over the rows, neither numpy nor pandas loaded)
+# or parallel (the python one over STATS_PARALLELISM ranges of the table
+# at once, in as many processes, see hrapi.parallel)
+STATS_ENGINE = 'summary'
+# size of the process pool of the parallel engine, every web server process
+# starts a pool of its own
+STATS_PARALLELISM = os.cpu_count()
+STATS_SNAPSHOT_DIR = Path(tempfile.gettempdir()) / 'hrbro_snapshots'
+
+# background jobs, see hrapi.jobs: a running job whose worker gave no sign
+# of life for JOB_STALE_SECONDS is run again, at most JOB_MAX_ATTEMPTS times.
+# Files uploaded for import wait in JOB_UPLOAD_DIR, which the workers read,
+# until their job is over, the rows they refused are kept there for
+# JOB_REJECTS_SECONDS.
+JOB_STALE_SECONDS = 120
+JOB_MAX_ATTEMPTS = 3
+JOB_UPLOAD_DIR = BASE_DIR / 'uploads'
+JOB_REJECTS_SECONDS = 7 * 24 * 3600
+
+# bounds of the employee and industry details each process keeps, the
+# least recently read going first, see hrapi.objectcache. 0 entries turns
+# the cache off.
+DETAIL_CACHE_MAX_ENTRIES = 10000
+DETAIL_CACHE_MAX_BYTES = 16 * 2 ** 20
+
+# bytes from which responses are gzipped, see hrapi.compression
+GZIP_MIN_LENGTH = 1400
+
+# threads the async views of an ASGI process run on, see hrapi.offload
+ASYNC_POOL_SIZE = 4
+
+# seconds above which a request is logged to hrapi.slow, with its queries
+# slower than SLOW_QUERY_THRESHOLD, see hrapi.instrumentation
+SLOW_REQUEST_THRESHOLD = 1.0
+SLOW_QUERY_THRESHOLD = 0.1
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'hrapi.slow': {'handlers': ['console'], 'level': 'WARNING'},
+    },
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
@@ -142,4 +244,14 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 ALLOWED_HOSTS = ['0.0.0.0', 'localhost']
 
-REST_FRAMEWORK = { 'DEFAULT_SCHEMA_CLASS': 'rest_framework.schemas.coreapi.AutoSchema' }
\ No newline at end of file
+REST_FRAMEWORK = {
+    'DEFAULT_SCHEMA_CLASS': 'rest_framework.schemas.coreapi.AutoSchema',
+    # keyset pagination, ?page_size= up to KeysetPagination.max_page_size
+    'DEFAULT_PAGINATION_CLASS': 'hrapi.pagination.KeysetPagination',
+    'PAGE_SIZE': 100,
+    # same bytes as rest_framework.renderers.JSONRenderer, faster
+    'DEFAULT_RENDERER_CLASSES': [
+        'hrapi.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+}
\ No newline at end of file
@@ -19,6 +19,7 @@ from django.urls import path, include
 from rest_framework.documentation import include_docs_urls
 from drf_yasg.views import get_schema_view
 from drf_yasg import openapi
+from hrapi.views import metrics
 
 
 schema_view = get_schema_view(
@@ -36,6 +37,8 @@ schema_view = get_schema_view(
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/', include('hrapi.urls')),
+    # Prometheus scrape target, see hrapi.instrumentation
+    path('metrics', metrics, name='metrics'),
     path("docs/", include_docs_urls(title="API Documentation")),
     path(
         "swagger/",